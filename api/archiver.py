@@ -0,0 +1,71 @@
+""" Background archiving of old logs to the local segment files of RequestsDao.archive
+
+A job reads, segment by segment, the logs whose request date is before the cutoff, writes them to a segment file and
+then removes them from mongo in chunks. A log is only removed once its segment and index are on disk, so a failed job
+leaves at worst logs both archived and stored, which reads find once. Progress is saved after every segment.
+"""
+import time
+import datetime
+import logging
+import gevent
+import dateutil.parser
+
+from apilog.settings import ARCHIVE
+
+logger_api = logging.getLogger("apilog")
+
+
+def start(dao, jobs_dao, before=None):
+    """ Create an archive job and run it in a greenlet of this worker
+    :before: max request date of archived logs, ARCHIVE['max_age_days'] ago by default
+    :raises ValueError with an invalid date
+    :return job id
+    """
+    if before:
+        try:
+            cutoff = dateutil.parser.parse(before)
+        except (TypeError, OverflowError):
+            # python-dateutil 2.2 raises TypeError for strings without any date
+            raise ValueError("Invalid date {}".format(before))
+    else:
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=ARCHIVE['max_age_days'])
+    job_id = jobs_dao.create('archive', {'before': cutoff})
+    gevent.spawn(run, dao, jobs_dao, job_id, cutoff)
+    return job_id
+
+
+def _report(jobs_dao, job_id, progress, started):
+    """ Save progress with its throughput and the estimated seconds left
+    """
+    elapsed = time.time() - started
+    progress['elapsed'] = round(elapsed, 1)
+    progress['rate'] = round(progress['archived'] / elapsed, 1) if elapsed else 0
+    left = max(progress['total'] - progress['archived'], 0)
+    progress['eta'] = round(left / progress['rate'], 1) if progress['rate'] else None
+    jobs_dao.update(job_id, progress)
+
+
+def run(dao, jobs_dao, job_id, before):
+    """ Move logs older than before to segment files, saving progress after every segment
+    """
+    started = time.time()
+    progress = {'state': 'running', 'archived': 0, 'removed': 0, 'segments': 0}
+    try:
+        progress['total'] = dao.count_archivable(before)
+        _report(jobs_dao, job_id, progress, started)
+        for shard, docs in dao.archivable_docs(before):
+            dao.archive.write(docs)
+            progress['segments'] += 1
+            progress['archived'] += len(docs)
+            progress['removed'] += dao.remove_ids(shard, [doc['id'] for doc in docs])
+            _report(jobs_dao, job_id, progress, started)
+            gevent.sleep(0)
+        progress['state'] = 'done'
+    except Exception as e:
+        logger_api.error("Archive job {0} error: {1}".format(job_id, e))
+        progress['state'] = 'failed'
+        progress['error'] = str(e)
+    progress.setdefault('total', progress['archived'])
+    _report(jobs_dao, job_id, progress, started)
+    logger_api.info("Archive job {0} {1}".format(job_id, progress))
+    return progress
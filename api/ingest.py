@@ -0,0 +1,657 @@
+import os
+import math
+import socket
+import logging
+import datetime
+import gevent
+from rest_framework import status
+
+from .logparser import BVParser, JSONNormalizer, LoggerException
+from apilog import metrics
+from apilog.blocking import offload
+from apilog.dedup import DedupFilter
+from apilog.ingestqueue import IngestQueue
+from apilog.spool import Spool, SpoolFull
+from apilog.sketch import LatencyRecorder
+from apilog.heavyhitters import HeavyHittersRecorder
+from apilog.ratelimit import TokenBuckets, log_key
+from apilog.tail import TailBuffer
+from apilog.sampling import Sampler
+from apilog.traces import TraceRecorder
+from apilog.compact import pack_line
+from apilog.mongo import LatencyDao, HeavyHittersDao, RejectedLinesDao, SamplingDao, TracesDao
+from apilog.settings import INGEST, DEDUP, ASYNC_INGEST, SPOOL, LATENCY, HEAVY_HITTERS, RATE_LIMIT, TAIL, RAW_LINES, \
+    SAMPLING, TRACES
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError, AutoReconnect, ConnectionFailure
+
+logger_api = logging.getLogger("apilog")
+dedup_counters = metrics.counters('dedup')
+dedup_filter = DedupFilter(DEDUP['window'], DEDUP['memory'], DEDUP['hashes']) if DEDUP['enabled'] else None
+async_counters = metrics.counters('async_ingest')
+async_queue = None
+normalizer = JSONNormalizer()
+spool_counters = metrics.counters('spool')
+spool = None
+latency_recorder = None
+heavy_hitters_recorder = None
+rate_counters = metrics.counters('rate_limit')
+token_buckets = None
+tail_buffer = None
+rejected_dao = None
+sampling_counters = metrics.counters('sampling')
+sampler = None
+trace_counters = metrics.counters('traces')
+trace_recorder = None
+
+
+def prepare_result(result):
+    """ Prepare result dictionary
+    """
+    return {"result": result}
+
+
+def _prepare_doc(data):
+    """ Document to store from received data
+    :data: dict to insert directly or plain text log line to parse
+    :raises LoggerException
+    """
+    if isinstance(data, dict):
+        # direct insert in db
+        logger_api.info("Data inserted directly {}".format(data))
+        return normalizer.normalize(data) if INGEST['normalize_json'] else data
+    elif isinstance(data, basestring):
+        parser = BVParser()
+        if not RAW_LINES['enabled']:
+            return parser.parse_log(data)
+        try:
+            doc = parser.parse_log(data)
+        except LoggerException as e:
+            _reject_line(data, e.value)
+            raise
+        doc['raw_line'] = pack_line(data)
+        doc['parserVersion'] = BVParser.VERSION
+        return doc
+    else:
+        logger_api.error('Invalid data log: {0}'.format(data))
+        raise LoggerException("Invalid data log")
+
+
+def get_rejected_dao():
+    """ Rejected lines dao of this worker, created on first use
+    """
+    global rejected_dao
+    if rejected_dao is None:
+        rejected_dao = RejectedLinesDao()
+    return rejected_dao
+
+
+def _reject_line(line, reason):
+    """ Keep a line rejected by the parser to reprocess it with newer parser versions
+    """
+    try:
+        get_rejected_dao().insert_line(line, reason, BVParser.VERSION)
+    except Exception as e:
+        # the client still gets the parser error
+        logger_api.error("Rejected line not stored: {}".format(e))
+
+
+def _check_duplicate(dao, doc):
+    """ Answer for an already stored log, None when doc is new
+    Filter hits are confirmed against the transactionId and origin index
+    """
+    transaction_id = doc.get('transactionId')
+    if dedup_filter is None or not transaction_id:
+        return None
+    dedup_counters.incr('checks')
+    key = u'{0}|{1}'.format(transaction_id, doc.get('origin')).encode('utf-8')
+    if not dedup_filter.seen(key):
+        return None
+    dedup_counters.incr('hits')
+    log_id = dao.find_by_transaction(transaction_id, doc.get('origin'))
+    if log_id is None:
+        dedup_counters.incr('false_positives')
+        return None
+    dedup_counters.incr('duplicates')
+    logger_api.info("Duplicated log {0} from {1} already stored as {2}".format(transaction_id, doc.get('origin'),
+                                                                              log_id))
+    if DEDUP['duplicate_status'] == status.HTTP_200_OK:
+        return prepare_result(log_id), status.HTTP_200_OK
+    return "Duplicated log {}".format(transaction_id), status.HTTP_409_CONFLICT
+
+
+def _batch_key(doc):
+    """ Key of a log for duplicates inside one batch, None when duplicates are not checked
+    """
+    if dedup_filter is None or not doc.get('transactionId'):
+        return None
+    return doc['transactionId'], doc.get('origin')
+
+
+def _batch_duplicate(doc):
+    """ Result of a duplicated log in a batch answered with 409 duplicates, in place of its id
+    """
+    return {"status": status.HTTP_409_CONFLICT, "detail": "Duplicated log {}".format(doc.get('transactionId'))}
+
+
+def get_latency_recorder():
+    """ Latency sketches of this worker, starting the greenlet that flushes them on first use
+    """
+    global latency_recorder
+    if latency_recorder is None:
+        latency_recorder = LatencyRecorder(LATENCY['bucket'], LATENCY['relative_accuracy'])
+        gevent.spawn(_latency_flusher, LatencyDao(), latency_recorder)
+    return latency_recorder
+
+
+def _latency_flusher(latency_dao, recorder):
+    """ Add the sketches of this worker to the stored ones forever
+    """
+    while True:
+        gevent.sleep(LATENCY['flush_interval'])
+        sketches = recorder.drain()
+        try:
+            latency_dao.flush(sketches)
+        except Exception as e:
+            logger_api.error("Latency flush error: {}".format(e))
+            # keep them for the next flush
+            for key, sketch in sketches.items():
+                recorder.sketches.setdefault(key, sketch.__class__(sketch.relative_accuracy)).merge(sketch)
+
+
+def get_heavy_hitters_recorder():
+    """ Heavy hitter summaries of this worker, starting the greenlet that flushes them on first use
+    """
+    global heavy_hitters_recorder
+    if heavy_hitters_recorder is None:
+        heavy_hitters_recorder = HeavyHittersRecorder(HEAVY_HITTERS['fields'], HEAVY_HITTERS['failure_fields'],
+                                                      HEAVY_HITTERS['capacity'], HEAVY_HITTERS['bucket'])
+        gevent.spawn(_heavy_hitters_flusher, HeavyHittersDao(), heavy_hitters_recorder,
+                     '{0}-{1}'.format(socket.gethostname(), os.getpid()))
+    return heavy_hitters_recorder
+
+
+def _heavy_hitters_flusher(heavy_hitters_dao, recorder, worker):
+    """ Store the summaries of this worker forever, forgetting finished buckets once stored
+    """
+    while True:
+        gevent.sleep(HEAVY_HITTERS['flush_interval'])
+        keep_after = datetime.datetime.utcnow() - datetime.timedelta(seconds=HEAVY_HITTERS['bucket'])
+        summaries = recorder.pending(keep_after)
+        try:
+            heavy_hitters_dao.flush(worker, summaries)
+        except Exception as e:
+            logger_api.error("Heavy hitters flush error: {}".format(e))
+            for key, summary in summaries.items():
+                recorder.summaries.setdefault(key, summary)
+
+
+def _record(docs):
+    """ Add new logs to the worker latency sketches and heavy hitter summaries, once they are stored or spooled
+    so retried inserts are not counted twice
+    """
+    if LATENCY['enabled']:
+        recorder = get_latency_recorder()
+        for doc in docs:
+            recorder.record(doc)
+    if HEAVY_HITTERS['enabled']:
+        recorder = get_heavy_hitters_recorder()
+        for doc in docs:
+            recorder.record(doc)
+
+
+def get_sampler():
+    """ Sampler of this worker, starting the greenlet that flushes its counts on first use
+    """
+    global sampler
+    if sampler is None:
+        sampler = Sampler(SAMPLING['rules'], SAMPLING['keep_exceptions'], SAMPLING['bucket'])
+        gevent.spawn(_sampling_flusher, SamplingDao(), sampler)
+    return sampler
+
+
+def _sampling_flusher(sampling_dao, log_sampler):
+    """ Add the received and stored counts of this worker to the stored ones forever
+    """
+    while True:
+        gevent.sleep(SAMPLING['flush_interval'])
+        counts = log_sampler.drain()
+        try:
+            sampling_dao.flush(counts)
+        except Exception as e:
+            logger_api.error("Sampling flush error: {}".format(e))
+            # keep them for the next flush
+            for key, (received, kept) in counts.items():
+                pending = log_sampler.counts.setdefault(key, [0, 0])
+                pending[0] += received
+                pending[1] += kept
+
+
+def _sample(docs):
+    """ Count received logs and decide which ones are stored, dropped logs still feed latency and heavy hitters
+    :return list with True for each log to store
+    """
+    if not SAMPLING['enabled']:
+        return [True] * len(docs)
+    log_sampler = get_sampler()
+    keep = [log_sampler.keep(doc) for doc in docs]
+    dropped = [doc for doc, kept in zip(docs, keep) if not kept]
+    _record(dropped)
+    sampling_counters.incr('received', len(docs))
+    sampling_counters.incr('dropped', len(dropped))
+    return keep
+
+
+def get_tail_buffer():
+    """ Tail ring of this worker, starting the greenlet that flushes it on first use
+    """
+    global tail_buffer
+    if tail_buffer is None:
+        tail_buffer = TailBuffer(TAIL['path'], size=TAIL['size'])
+        gevent.spawn(_tail_flusher, tail_buffer)
+    return tail_buffer
+
+
+def _tail_flusher(buffer):
+    """ Append the logs stored by this worker to the shared ring forever
+    """
+    while True:
+        gevent.sleep(TAIL['flush_interval'])
+        try:
+            offload(buffer.flush)
+        except Exception as e:
+            logger_api.error("Tail flush error: {}".format(e))
+
+
+def _tail(docs, ids):
+    """ Add stored logs to the tail ring
+    :ids: id of each doc, None for logs not stored
+    """
+    if TAIL['enabled']:
+        buffer = get_tail_buffer()
+        for doc, log_id in zip(docs, ids):
+            if log_id is not None:
+                buffer.append(doc)
+
+
+def get_trace_recorder():
+    """ Trace recorder of this worker, starting the greenlet that flushes its traces on first use
+    """
+    global trace_recorder
+    if trace_recorder is None:
+        trace_recorder = TraceRecorder(TRACES['max_pending'])
+        gevent.spawn(_trace_flusher, TracesDao(), trace_recorder)
+    return trace_recorder
+
+
+def _trace_flusher(traces_dao, recorder):
+    """ Upsert the traces of this worker forever, one update per transaction and flush
+    """
+    while True:
+        gevent.sleep(TRACES['flush_interval'])
+        traces = recorder.drain()
+        try:
+            traces_dao.flush(traces)
+            trace_counters.incr('flushed', len(traces))
+        except Exception as e:
+            logger_api.error("Trace flush error: {}".format(e))
+            # keep them for the next flush, before hops recorded meanwhile
+            for transaction_id, trace in traces.items():
+                pending = recorder.traces.setdefault(transaction_id, {'fe': None, 'be': []})
+                pending['fe'] = pending['fe'] or trace['fe']
+                pending['be'][:0] = trace['be']
+        trace_counters.set('dropped', recorder.dropped)
+
+
+def _trace(docs, ids):
+    """ Add stored logs to the traces of their transaction
+    :ids: id of each doc, None for logs not stored
+    """
+    if TRACES['enabled']:
+        recorder = get_trace_recorder()
+        for doc, log_id in zip(docs, ids):
+            if log_id is not None:
+                recorder.record(doc, log_id)
+
+
+def get_async_queue(dao):
+    """ Ingest queue of this worker, starting the greenlets that store queued logs on first use
+    :dao: requests dao where queued logs are inserted
+    """
+    global async_queue
+    if async_queue is None:
+        async_queue = IngestQueue(ASYNC_INGEST['path'], claim_timeout=ASYNC_INGEST['claim_timeout'],
+                                  retention=ASYNC_INGEST['retention'])
+        for worker in range(ASYNC_INGEST['workers']):
+            gevent.spawn(_async_worker, dao, async_queue, '{0}-{1}'.format(os.getpid(), worker))
+    return async_queue
+
+
+def process_batch(dao, queue, owner):
+    """ Parse and store one batch of queued logs, updating their tickets
+    :dao: requests dao where logs are inserted
+    :queue: ingest queue
+    :owner: worker identifier
+    :return number of logs taken from the queue
+    """
+    batch = offload(queue.claim, ASYNC_INGEST['batch_size'], owner)
+    tickets, docs, stored, rejected = [], [], [], []
+    # position in docs of the first log of each key, and (ticket, position) of later logs with the same key
+    first, repeated = {}, []
+    for ticket, data in batch:
+        try:
+            doc = _prepare_doc(data)
+        except LoggerException as e:
+            rejected.append((ticket, e.value))
+            continue
+        if not _sample([doc])[0]:
+            stored.append((ticket, None))
+            continue
+        key = _batch_key(doc)
+        if key in first:
+            dedup_counters.incr('duplicates')
+            repeated.append((ticket, first[key]))
+            continue
+        duplicate = _check_duplicate(dao, doc)
+        if duplicate:
+            result, status_code = duplicate
+            if status_code == status.HTTP_200_OK:
+                stored.append((ticket, result['result']))
+            else:
+                rejected.append((ticket, result))
+            continue
+        if key:
+            first[key] = len(docs)
+        tickets.append(ticket)
+        docs.append(doc)
+    ids = []
+    try:
+        ids = dao.insert_batch(docs)
+    except Exception:
+        # keep logs queued until the database is back
+        offload(queue.release, tickets + [ticket for ticket, _ in repeated])
+        raise
+    finally:
+        # parse errors and duplicates are final even when the insert failed
+        stored.extend((ticket, log_id) for ticket, log_id in zip(tickets, ids) if log_id is not None)
+        rejected.extend((ticket, "Duplicated log") for ticket, log_id in zip(tickets, ids) if log_id is None)
+        for ticket, position in repeated:
+            if position < len(ids):
+                # same answer as a later delivery of the first log
+                if DEDUP['duplicate_status'] == status.HTTP_200_OK and ids[position] is not None:
+                    stored.append((ticket, ids[position]))
+                else:
+                    rejected.append((ticket, "Duplicated log {}".format(docs[position]['transactionId'])))
+        offload(queue.complete, stored)
+        offload(queue.reject, rejected)
+        async_counters.incr('stored', len(stored))
+        async_counters.incr('rejected', len(rejected))
+    _record([doc for doc, log_id in zip(docs, ids) if log_id is not None])
+    _tail(docs, ids)
+    _trace(docs, ids)
+    return len(batch)
+
+
+def _async_worker(dao, queue, owner):
+    """ Store queued logs forever
+    """
+    while True:
+        try:
+            if not process_batch(dao, queue, owner):
+                offload(queue.purge)
+                gevent.sleep(ASYNC_INGEST['poll_interval'])
+        except Exception as e:
+            logger_api.error("Asynchronous ingest error: {}".format(e))
+            gevent.sleep(ASYNC_INGEST['poll_interval'])
+
+
+def get_spool(dao):
+    """ Spool of this worker, starting the greenlet that replays spooled logs on first use
+    :dao: requests dao where spooled logs are replayed
+    """
+    global spool
+    if spool is None:
+        spool = Spool(SPOOL['directory'], segment_bytes=SPOOL['segment_bytes'], max_bytes=SPOOL['max_bytes'],
+                      seal_after=SPOOL['seal_after'], claim_timeout=SPOOL['claim_timeout'])
+        gevent.spawn(_spool_replayer, dao, spool)
+    return spool
+
+
+def replay_segment(dao, log_spool):
+    """ Store the logs of the oldest sealed segment, sealing idle segments first
+    Logs keep the _id given when spooled, so logs stored by a timed out insert or a failed replay are not repeated
+    :return True if a segment was replayed
+    """
+    log_spool.seal_idle()
+    depth = log_spool.depth()
+    for name in ('segments', 'bytes', 'age'):
+        spool_counters.set(name, depth[name])
+    segment = log_spool.claim()
+    if segment is None:
+        return False
+    docs, corrupt = log_spool.read(segment)
+    if corrupt:
+        logger_api.error("Spool segment {0} has {1} unreadable bytes".format(segment, corrupt))
+        spool_counters.incr('corrupt_bytes', corrupt)
+    try:
+        for start in range(0, len(docs), SPOOL['batch_size']):
+            ids = dao.insert_batch(docs[start:start + SPOOL['batch_size']], keep_object_id=True)
+            _trace(docs[start:start + SPOOL['batch_size']], ids)
+            spool_counters.incr('replayed', len([log_id for log_id in ids if log_id is not None]))
+            spool_counters.incr('already_stored', len([log_id for log_id in ids if log_id is None]))
+    except Exception:
+        log_spool.release(segment)
+        raise
+    log_spool.remove(segment)
+    return True
+
+
+def _spool_replayer(dao, log_spool):
+    """ Replay spooled logs forever
+    """
+    while True:
+        try:
+            if not replay_segment(dao, log_spool):
+                gevent.sleep(SPOOL['replay_interval'])
+        except Exception as e:
+            logger_api.error("Spool replay error: {}".format(e))
+            gevent.sleep(SPOOL['replay_interval'])
+
+
+def _spool_docs(dao, docs, error):
+    """ Append logs that could not be inserted to the spool, all of them or none so a retried batch is not
+    stored twice
+    :return list with the spool key of each log, None when the spool is full
+    """
+    logger_api.error("Spooling {0} logs: {1}".format(len(docs), error or "insert timeout"))
+    for doc in docs:
+        doc.pop('id', None)
+    try:
+        get_spool(dao).extend(docs)
+    except SpoolFull as e:
+        logger_api.error(str(e))
+        spool_counters.incr('full', len(docs))
+        return None
+    spool_counters.incr('spooled', len(docs))
+    return [str(doc['_id']) for doc in docs]
+
+
+def _insert(dao, docs, batch=True):
+    """ Insert logs, spooling them when mongo is unreachable or slower than SPOOL['insert_timeout']
+    :batch: insert with insert_batch, otherwise docs holds a single log inserted with insert
+    :return tuple with the list of ids and None, or None and the list of spool keys (None when the spool is full)
+    """
+    if not SPOOL['enabled']:
+        ids = dao.insert_batch(docs) if batch else [dao.insert(docs[0])]
+        _record([doc for doc, log_id in zip(docs, ids) if log_id is not None])
+        _tail(docs, ids)
+        _trace(docs, ids)
+        return ids, None
+    for doc in docs:
+        doc['_id'] = ObjectId()
+    try:
+        with gevent.Timeout(SPOOL['insert_timeout']):
+            if batch:
+                ids = dao.insert_batch(docs, keep_object_id=True)
+            else:
+                ids = [dao.insert(docs[0], keep_object_id=True)]
+    except (AutoReconnect, ConnectionFailure, gevent.Timeout) as e:
+        keys = _spool_docs(dao, docs, str(e))
+        if keys:
+            _record(docs)
+        return None, keys
+    _record([doc for doc, log_id in zip(docs, ids) if log_id is not None])
+    _tail(docs, ids)
+    _trace(docs, ids)
+    return ids, None
+
+
+def _spooled_result(keys):
+    """ Answer for spooled logs
+    """
+    if keys is None:
+        return "Log spool is full", status.HTTP_503_SERVICE_UNAVAILABLE
+    return prepare_result([{"spooled": key} for key in keys]), status.HTTP_202_ACCEPTED
+
+
+def _enqueue(dao, data):
+    """ Queue a log, or each log of a list, after cheap validation
+    :return tuple with response data and status code
+    """
+    logs = data if isinstance(data, list) else [data]
+    for log in logs:
+        if not isinstance(log, dict) and not (isinstance(log, basestring) and 'INFOSTATS' in log):
+            logger_api.error('Invalid data log: {0}'.format(log))
+            return "Invalid data log", status.HTTP_400_BAD_REQUEST
+    tickets = offload(get_async_queue(dao).put_many, logs)
+    async_counters.incr('queued', len(tickets))
+    if isinstance(data, list):
+        return prepare_result([{"ticket": ticket} for ticket in tickets]), status.HTTP_202_ACCEPTED
+    return prepare_result({"ticket": tickets[0]}), status.HTTP_202_ACCEPTED
+
+
+def _ingest_batch(dao, logs):
+    """ Store a list of logs with a single insert, rejecting the whole list if any log is invalid
+    Logs repeating the transactionId and origin of an earlier log of the list are duplicates of it
+    :return tuple with response data (ids in received order, None for sampled out logs, duplicates as the stored id
+    or as a 409 object depending on DEDUP['duplicate_status']) and status code
+    """
+    docs = []
+    for index, log in enumerate(logs):
+        try:
+            docs.append(_prepare_doc(log))
+        except LoggerException as e:
+            logger_api.error("POST error in log {0}: {1}".format(index, e.value))
+            return "Log {0}: {1}".format(index, e.value), status.HTTP_400_BAD_REQUEST
+    ids = [None] * len(docs)
+    pending = []
+    # index of the first log of each key, and index of the first log by index of later logs with the same key
+    first, repeated = {}, {}
+    for index, (doc, kept) in enumerate(zip(docs, _sample(docs))):
+        if not kept:
+            continue
+        key = _batch_key(doc)
+        if key in first:
+            dedup_counters.incr('duplicates')
+            repeated[index] = first[key]
+            continue
+        if key:
+            first[key] = index
+        duplicate = _check_duplicate(dao, doc)
+        if duplicate is None:
+            pending.append(index)
+        elif duplicate[1] == status.HTTP_200_OK:
+            ids[index] = duplicate[0]['result']
+        else:
+            ids[index] = _batch_duplicate(doc)
+    inserted, keys = _insert(dao, [docs[index] for index in pending])
+    if inserted is None:
+        return _spooled_result(keys)
+    for index, log_id in zip(pending, inserted):
+        if log_id is None and DEDUP['duplicate_status'] != status.HTTP_200_OK:
+            # rejected by the unique transactionId and origin index
+            log_id = _batch_duplicate(docs[index])
+        ids[index] = log_id
+    for index, source in repeated.items():
+        ids[index] = ids[source] if DEDUP['duplicate_status'] == status.HTTP_200_OK else _batch_duplicate(docs[index])
+    return prepare_result(ids), status.HTTP_201_CREATED
+
+
+def _throttle(data):
+    """ Take tokens for a log, or each log of a list, from the buckets of their app and origin, all of them or none
+    :return None when allowed, otherwise tuple with the 429 response data and status code
+    """
+    global token_buckets
+    if token_buckets is None:
+        token_buckets = TokenBuckets(RATE_LIMIT['path'])
+    costs = {}
+    for log in data if isinstance(data, list) else [data]:
+        key = log_key(log)
+        costs[key] = costs.get(key, 0) + 1
+    limited, requests = [], []
+    for (app, origin), cost in costs.items():
+        limit = RATE_LIMIT['limits'].get(u'{0}|{1}'.format(app, origin)) or RATE_LIMIT['limits'].get(app) or \
+            RATE_LIMIT['default']
+        if limit:
+            limited.append((app, origin, cost))
+            requests.append((u'{0}|{1}'.format(app, origin), limit['rate'], limit['burst'], cost))
+    if not requests:
+        return None
+    try:
+        # tokens of every bucket or of none, a list over one limit does not spend the tokens of the others
+        waits = offload(token_buckets.acquire_many, requests)
+    except Exception as e:
+        # never lose logs because of the limiter
+        logger_api.error("Rate limit error: {}".format(e))
+        return None
+    if not any(waits):
+        return None
+    for (app, origin, cost), wait in zip(limited, waits):
+        if wait:
+            rate_counters.incr(u'throttled.{}'.format(app or 'unknown'), cost)
+            logger_api.error("Rate limit exceeded for app {0} origin {1}".format(app, origin))
+    app = next(app for (app, _, _), wait in zip(limited, waits) if wait)
+    return {"detail": "Rate limit exceeded for app {}".format(app),
+            "retry_after": int(math.ceil(max(waits)))}, status.HTTP_429_TOO_MANY_REQUESTS
+
+
+def ingest(dao, data):
+    """ Store a received log, shared by the Logger api and the WSGI fast path
+    :dao: requests dao where the log is inserted
+    :data: dict to insert directly, plain text log line to parse or a list of both
+    :return tuple with response data and status code
+    """
+    if isinstance(data, list) and len(data) > INGEST['max_batch']:
+        logger_api.error("Received {} logs in one request".format(len(data)))
+        return "Too many logs, at most {} per request".format(INGEST['max_batch']), \
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    throttled = _throttle(data) if data and RATE_LIMIT['enabled'] else None
+    if throttled:
+        return throttled
+    if data and ASYNC_INGEST['enabled']:
+        return _enqueue(dao, data)
+    elif data and isinstance(data, list):
+        return _ingest_batch(dao, data)
+    elif data:
+        try:
+            doc = _prepare_doc(data)
+        except LoggerException as e:
+            logger_api.error("POST error: {}".format(e.value))
+            return e.value, status.HTTP_400_BAD_REQUEST
+        if not _sample([doc])[0]:
+            return prepare_result(None), status.HTTP_202_ACCEPTED
+        duplicate = _check_duplicate(dao, doc)
+        if duplicate:
+            return duplicate
+        try:
+            inserted, keys = _insert(dao, [doc], batch=False)
+            if inserted is None:
+                data, status_code = _spooled_result(keys)
+                return (prepare_result(data['result'][0]) if keys else data), status_code
+            return prepare_result(inserted[0]), status.HTTP_201_CREATED
+        except DuplicateKeyError as dex:
+            logger_api.error("Duplicate key error {}".format(dex.message))
+            return dex.message, status.HTTP_400_BAD_REQUEST
+    else:
+        logger_api.error("Received data is empty")
+        return "Received data is empty", status.HTTP_400_BAD_REQUEST
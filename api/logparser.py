@@ -1,8 +1,9 @@
 import re
-import json
 import base64
 import logging
+import datetime
 import dateutil.parser
+from apilog import jsoncodec
 
 logger_parser = logging.getLogger("apilog.parser")
 
@@ -18,6 +19,8 @@ class LoggerException(Exception):
 
 
 class BVParser(object):
+    # Increase when parse_log extracts different fields, stored raw lines of older versions can be reprocessed
+    VERSION = 1
     SUPPORTED_APIS = ['Payment', 'payment', 'NeoPayment', 'MobileId']
     # List of fields with interesting info
     INTERESTING_FIELDS = [
@@ -39,6 +42,8 @@ class BVParser(object):
         'paymentMethodType',
         'exceptionId',
         'exceptionText']
+    # Method, url and api of the http request of FE log bodies
+    BODY_REGEXP = re.compile(r'[\"|\[]*(?P<method>[A-Z]+)[ ]+/(?P<url>(?P<api>[\w]+)/[\w|/]+)')
 
     def _dict_depth(self, d, keys, field_list):
         """Recursively find a key in dict
@@ -81,7 +86,6 @@ class BVParser(object):
             r'+(?P<origin>[A-Z]{2})[ ]+(?P<app>[\w]+)[ ]+(?P<serviceId>[0-9]*)/(?P<appId>[0-9]*)[\w]*[ ]'
             r'+(?P<ob>[0-9]*)[ ]+'
             r'(?P<statType>INFOSTATS)[ ]+(?P<responseCode>[0-9]{3})([ ]+(?P<body>.*))*')
-        body_regexp = re.compile(r'[\"|\[]*(?P<method>[A-Z]+)[ ]+/(?P<url>(?P<api>[\w]+)/[\w|/]+)')
 
         # extract only fields
         infostats_match = line_part_regexp.match(oneLog)
@@ -93,7 +97,7 @@ class BVParser(object):
 
                 # try to parse simple fields
                 body = log_info.get("body", "{}") or "{}"
-                body_json = json.loads(body)
+                body_json = jsoncodec.loads(body)
 
                 api = ""
                 http_request = {}
@@ -112,7 +116,7 @@ class BVParser(object):
                 # frontend case
                 elif isinstance(log_info["body"], str) or isinstance(log_info["body"], unicode):
                     try:
-                        body_match = body_regexp.match(log_info["body"])
+                        body_match = BVParser.BODY_REGEXP.match(log_info["body"])
                         http_request = body_match.groupdict()
                         api = http_request["api"]
                     except Exception, e:
@@ -135,3 +139,72 @@ class BVParser(object):
         else:
             logger_parser.error('Invalid data log: {0}'.format(oneLog))
             raise LoggerException("Invalid data log")
+
+
+class JSONNormalizer(object):
+    """ Give logs posted as JSON the types and derived fields of parsed log lines
+    Dates become datetimes, codes strings, and api, http_request, body_request and exceptionId are derived from the
+    body when missing. Unknown fields are kept untouched.
+    """
+    STRING_FIELDS = ('transactionId', 'domain', 'origin', 'app', 'serviceId', 'appId', 'ob', 'statType',
+                     'responseCode')
+    DATE_FIELDS = ('requestDate', 'responseDate')
+    DATE_FORMATS = ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%dT%H:%M:%S.%f', '%Y/%m/%dT%H:%M:%S.%f')
+
+    def __init__(self):
+        self.parser = BVParser()
+        # field coercions compiled once, applied in order
+        self.coercions = [(field, self._to_string) for field in JSONNormalizer.STRING_FIELDS] + \
+                         [(field, self._to_date) for field in JSONNormalizer.DATE_FIELDS]
+
+    def _to_string(self, value):
+        return str(value) if isinstance(value, (int, long)) and not isinstance(value, bool) else value
+
+    def _to_date(self, value):
+        if not isinstance(value, basestring):
+            return value
+        for date_format in JSONNormalizer.DATE_FORMATS:
+            try:
+                return datetime.datetime.strptime(value, date_format)
+            except ValueError:
+                pass
+        try:
+            return dateutil.parser.parse(value)
+        except (ValueError, TypeError, OverflowError):
+            # python-dateutil 2.2 raises TypeError for strings without any date
+            logger_parser.warning('Unknown date format {}'.format(value))
+            return value
+
+    def _derive(self, doc):
+        """ Fields BVParser.parse_log extracts from the body
+        """
+        body = doc.get('body')
+        first = body[0] if isinstance(body, list) and body else body
+        api = None
+        if isinstance(first, dict):
+            api = self.parser._match_api(first)
+            if 'body_request' not in doc:
+                body_request = {}
+                self.parser._dict_depth(first, BVParser.INTERESTING_FIELDS, body_request)
+                doc['body_request'] = body_request
+        elif isinstance(first, basestring):
+            body_match = BVParser.BODY_REGEXP.match(first)
+            if body_match:
+                api = body_match.group('api')
+                doc.setdefault('http_request', body_match.groupdict())
+        if api and not doc.get('api'):
+            doc['api'] = api.lower()
+        body_request = doc.get('body_request')
+        if isinstance(body_request, dict) and 'exceptionId' in body_request and 'exceptionId' not in doc:
+            doc['exceptionId'] = body_request['exceptionId']
+
+    def normalize(self, doc):
+        """ Normalize a posted log in place
+        :return doc
+        """
+        for field, coerce in self.coercions:
+            if field in doc:
+                doc[field] = coerce(doc[field])
+        if 'body' in doc:
+            self._derive(doc)
+        return doc
@@ -0,0 +1,116 @@
+""" Background reprocessing of stored raw lines with the current BVParser version
+
+A job reparses, chunk by chunk, the logs of a request date range whose raw line was parsed by an older parser and
+updates their parsed fields, then retries the lines older parsers rejected in the same reception date range, storing
+the ones it now parses as new logs. Progress and throughput are saved after every chunk in the jobs collection, so
+any worker answers for a job.
+"""
+import time
+import logging
+import gevent
+import dateutil.parser
+
+from .logparser import BVParser, LoggerException
+from apilog.compact import unpack_line
+from apilog.settings import RAW_LINES
+
+logger_api = logging.getLogger("apilog")
+
+
+def start(dao, rejected_dao, jobs_dao, date_from=None, date_to=None):
+    """ Create a reprocess job and run it in a greenlet of this worker
+    :date_from: min request date of logs, and reception date of rejected lines
+    :date_to: max date
+    :raises ValueError with invalid dates
+    :return job id
+    """
+    for date in (date_from, date_to):
+        if date:
+            try:
+                dateutil.parser.parse(date)
+            except (TypeError, OverflowError):
+                # python-dateutil 2.2 raises TypeError for strings without any date
+                raise ValueError("Invalid date {}".format(date))
+    job_id = jobs_dao.create('reprocess', {'from': date_from, 'to': date_to, 'parserVersion': BVParser.VERSION})
+    gevent.spawn(run, dao, rejected_dao, jobs_dao, job_id, date_from, date_to)
+    return job_id
+
+
+def _report(jobs_dao, job_id, progress, started):
+    """ Save progress with its throughput and the estimated seconds left
+    """
+    elapsed = time.time() - started
+    progress['elapsed'] = round(elapsed, 1)
+    progress['rate'] = round(progress['processed'] / elapsed, 1) if elapsed else 0
+    left = max(progress['total'] - progress['processed'], 0)
+    progress['eta'] = round(left / progress['rate'], 1) if progress['rate'] else None
+    jobs_dao.update(job_id, progress)
+
+
+def _parse(parser, raw_line):
+    """ Parse a stored raw line with the current parser
+    :return doc, or the parser error
+    """
+    try:
+        doc = parser.parse_log(unpack_line(raw_line))
+    except LoggerException as e:
+        return None, e.value
+    doc['raw_line'] = raw_line
+    doc['parserVersion'] = BVParser.VERSION
+    return doc, None
+
+
+def run(dao, rejected_dao, jobs_dao, job_id, date_from=None, date_to=None):
+    """ Reparse outdated logs and rejected lines, saving progress after every chunk
+    """
+    parser = BVParser()
+    version = BVParser.VERSION
+    started = time.time()
+    progress = {'state': 'running', 'processed': 0, 'updated': 0, 'recovered': 0, 'failed': 0}
+    try:
+        progress['total'] = dao.count_outdated(version, date_from, date_to) + \
+            rejected_dao.count_outdated(version, date_from, date_to)
+        _report(jobs_dao, job_id, progress, started)
+        for shard, docs in dao.outdated_lines(version, date_from, date_to):
+            parsed = []
+            for doc in docs:
+                new_doc, error = _parse(parser, doc['raw_line'])
+                if error:
+                    progress['failed'] += 1
+                    continue
+                new_doc['id'] = doc['id']
+                parsed.append(new_doc)
+            dao.update_parsed(shard, parsed)
+            progress['processed'] += len(docs)
+            progress['updated'] += len(parsed)
+            _report(jobs_dao, job_id, progress, started)
+            gevent.sleep(RAW_LINES['throttle'])
+        for lines in rejected_dao.outdated_lines(version, date_from, date_to):
+            parsed, recovered, errors = [], [], {}
+            for line in lines:
+                new_doc, error = _parse(parser, line['raw_line'])
+                if error:
+                    errors.setdefault(error, []).append(line['_id'])
+                    continue
+                parsed.append(new_doc)
+                recovered.append(line['_id'])
+            if parsed:
+                dao.insert_batch(parsed)
+                rejected_dao.remove_lines(recovered)
+            for error, object_ids in errors.items():
+                # not retried until the parser version changes
+                rejected_dao.mark_lines(object_ids, error, version)
+            progress['processed'] += len(lines)
+            progress['recovered'] += len(parsed)
+            progress['failed'] += len(lines) - len(parsed)
+            _report(jobs_dao, job_id, progress, started)
+            gevent.sleep(RAW_LINES['throttle'])
+        progress['state'] = 'done'
+    except Exception as e:
+        logger_api.error("Reprocess job {0} error: {1}".format(job_id, e))
+        progress['state'] = 'failed'
+        progress['error'] = str(e)
+    progress.setdefault('total', progress['processed'])
+    _report(jobs_dao, job_id, progress, started)
+    logger_api.info("Reprocess job {0} {1}".format(job_id, progress))
+    return progress
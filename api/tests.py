@@ -1,14 +1,43 @@
+import os
+import shutil
+import tempfile
 import unittest
 import json
+import datetime
 
 from django.test.client import Client
 from rest_framework.test import APIClient
-from pymongo.errors import DuplicateKeyError
-from mock import patch, create_autospec
+from pymongo.errors import DuplicateKeyError, AutoReconnect
+from mock import patch, create_autospec, Mock
 from django.core.urlresolvers import reverse
-from .logparser import BVParser, LoggerException
-from apilog.mongo import RequestsDao, DBLogException, DB
+from rest_framework.renderers import JSONRenderer
+from .logparser import BVParser, JSONNormalizer, LoggerException
+from .views import FastJSONRenderer
+from . import ingest, views, reprocess, archiver
+from apilog import metrics
+from apilog.blocking import offload
+from apilog.dedup import DedupFilter
+from apilog.ingestqueue import IngestQueue
+from apilog.spool import Spool
+from apilog.ratelimit import TokenBuckets
+from apilog.tail import TailBuffer
+from apilog.compact import pack_line, unpack_line
+from apilog.mongo import RequestsDao, LatencyDao, JobsDao, TracesDao, DBLogException, DB
+from apilog.archive import Archive
+from apilog.traces import TraceRecorder
+from apilog.httpcache import ResponseCache
+from apilog.sketch import LatencySketch, LatencyRecorder
+from apilog.heavyhitters import HeavyHittersRecorder
 from pymongo.cursor import Cursor
+import mongomock
+
+
+def start_patches(test, *patchers):
+    """ Start patchers for the duration of a test, they are stopped on its cleanup
+    """
+    for patcher in patchers:
+        patcher.start()
+        test.addCleanup(patcher.stop)
 
 
 class ApiLoggerDetailTest(unittest.TestCase):
@@ -97,6 +126,67 @@ class ApiLoggerDetailTest(unittest.TestCase):
         self.assertEqual(ret.data, "Received data is empty")
         self.assertEqual(ret.status_code, 400, "Status 400 returned in POST because empty data")
 
+    @patch.object(RequestsDao, 'patch_doc')
+    def test_patch_log(self, mock_patch_doc):
+        """ Partial update sends only changed fields
+        """
+        mock_patch_doc.return_value = {u'updatedExisting': True, u'ok': 1.0, u'err': None, u'n': 1}
+        data = json.dumps({"set": {"domain": "M2M"}, "unset": ["body"]})
+        ret = self.client.patch(ApiLoggerDetailTest.LOG_DETAIL_URL, data, content_type='application/json')
+        mock_patch_doc.assert_called_once_with(u'1', fields={u'domain': u'M2M'}, unset=[u'body'], expected=None)
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.data, "Log 1 updated correctly")
+
+    @patch.object(RequestsDao, 'exists', return_value=True)
+    @patch.object(RequestsDao, 'patch_doc')
+    def test_patch_log_precondition_failed(self, mock_patch_doc, mock_exists):
+        """ Conditional partial update of a modified log
+        """
+        mock_patch_doc.return_value = {u'updatedExisting': False, u'ok': 1.0, u'err': None, u'n': 0}
+        data = json.dumps({"set": {"responseCode": "500"}, "expected": {"responseCode": "400"}})
+        ret = self.client.patch(ApiLoggerDetailTest.LOG_DETAIL_URL, data, content_type='application/json')
+        mock_exists.assert_called_once_with(u'1')
+        self.assertEqual(ret.status_code, 412)
+        self.assertEqual(ret.data, "Log 1 does not match expected values")
+
+    @patch.object(RequestsDao, 'patch_doc')
+    def test_patch_unknown_log(self, mock_patch_doc):
+        """ Partial update of unknown log
+        """
+        mock_patch_doc.return_value = {u'updatedExisting': False, u'ok': 1.0, u'err': None, u'n': 0}
+        data = json.dumps({"domain": "M2M"})
+        ret = self.client.patch(ApiLoggerDetailTest.UNKNOWN_LOG, data, content_type='application/json')
+        mock_patch_doc.assert_called_once_with(u'2', fields={u'domain': u'M2M'}, unset=None, expected=None)
+        self.assertEqual(ret.status_code, 404)
+        self.assertEqual(ret.data, "Unknown log 2 to update")
+
+    @patch.object(RequestsDao, '_update_one')
+    def test_patch_invalid_set(self, mock_update_one):
+        """ Partial update with set not being an object is a bad request
+        """
+        data = json.dumps({"set": [1]})
+        ret = self.client.patch(ApiLoggerDetailTest.LOG_DETAIL_URL, data, content_type='application/json')
+        self.assertEqual(ret.status_code, 400)
+        self.assertFalse(mock_update_one.called)
+
+    @patch.object(RequestsDao, '_update_one')
+    def test_patch_invalid_unset(self, mock_update_one):
+        """ Partial update with unset not being a list of field names is a bad request
+        """
+        data = json.dumps({"unset": "abc"})
+        ret = self.client.patch(ApiLoggerDetailTest.LOG_DETAIL_URL, data, content_type='application/json')
+        self.assertEqual(ret.status_code, 400)
+        self.assertFalse(mock_update_one.called)
+
+    @patch.object(RequestsDao, '_update_one')
+    def test_patch_expected_operator(self, mock_update_one):
+        """ Partial update with query operators in the expected values is a bad request
+        """
+        data = json.dumps({"set": {"domain": "M2M"}, "expected": {"domain": {"$ne": "Bluevia"}}})
+        ret = self.client.patch(ApiLoggerDetailTest.LOG_DETAIL_URL, data, content_type='application/json')
+        self.assertEqual(ret.status_code, 400)
+        self.assertFalse(mock_update_one.called)
+
     @patch.object(RequestsDao, 'select')
     def test_get_log_info(self, mock_select):
         """ Testing getting log information
@@ -350,6 +440,638 @@ class ApiLoggerTest(unittest.TestCase):
         self.assertEqual(ret.data, error_text)
 
 
+class ApiLoggerBatchTest(unittest.TestCase):
+    """ Posting several logs in one request
+    """
+    LOG_URL = reverse('logger-api')
+    LOG_LINE = '2013/05/17T02:10:25.335 2013/05/17T02:10:25.548 Microsoft 1e246bb8-1162-46a2-93af-1da64ca9e3cb ' \
+               'FE FrontendTrustedPartner 9/18297 21407 INFOSTATS 201 ["POST /payment/v2/payments HTTP/1.0"]'
+
+    def setUp(self):
+        self.apiclient = APIClient()
+
+    def tearDown(self):
+        del self.apiclient
+
+    @patch.object(RequestsDao, 'insert_batch', return_value=[10, 11])
+    def test_post_batch(self, mock_insert_batch):
+        """ JSON lists of logs and log lines are inserted at once
+        """
+        data = [{"data": "datas"}, ApiLoggerBatchTest.LOG_LINE]
+        ret = self.apiclient.post(ApiLoggerBatchTest.LOG_URL, data, format='json')
+        docs = mock_insert_batch.call_args[0][0]
+        self.assertEqual(docs[0], {"data": "datas"})
+        self.assertEqual(docs[1]['origin'], 'FE')
+        self.assertEqual(ret.status_code, 201)
+        self.assertEqual(ret.data, {"result": [10, 11]})
+
+    @patch.object(RequestsDao, 'insert_batch')
+    def test_post_batch_invalid_log(self, mock_insert_batch):
+        """ A single invalid log rejects the whole list
+        """
+        ret = self.apiclient.post(ApiLoggerBatchTest.LOG_URL, [{"data": "datas"}, 'afadfadfadfa', 5], format='json')
+        self.assertFalse(mock_insert_batch.called)
+        self.assertEqual(ret.status_code, 400)
+        self.assertEqual(ret.data, "Log 1: Invalid data log")
+
+    def test_post_batch_too_large(self):
+        """ Lists over the configured size are rejected
+        """
+        with patch.dict(ingest.INGEST, {'max_batch': 2}):
+            ret = self.apiclient.post(ApiLoggerBatchTest.LOG_URL, [{}, {}, {}], format='json')
+        self.assertEqual(ret.status_code, 413)
+
+
+class ApiLoggerDedupTest(unittest.TestCase):
+    """ Duplicated deliveries filter in the logger api
+    """
+    LOG_URL = reverse('logger-api')
+    DATA = {"transactionId": "2bf76d13-883a-419e-bfb3-f9a05e83928e", "origin": "BE"}
+
+    def setUp(self):
+        self.apiclient = APIClient()
+        self.counters = metrics.counters('dedup')
+        self.counters.reset()
+
+    def tearDown(self):
+        del self.apiclient
+
+    @patch.object(RequestsDao, 'find_by_transaction', return_value=81)
+    @patch.object(RequestsDao, 'insert', return_value=81)
+    def test_duplicated_post_conflict(self, mock_insert, mock_find):
+        """ Second delivery of a log is rejected without inserting
+        """
+        with patch.object(ingest, 'dedup_filter', DedupFilter(3600, 1024, 4)):
+            ret = self.apiclient.post(ApiLoggerDedupTest.LOG_URL, ApiLoggerDedupTest.DATA, format='json')
+            self.assertEqual(ret.status_code, 201)
+            self.assertFalse(mock_find.called)
+            ret = self.apiclient.post(ApiLoggerDedupTest.LOG_URL, ApiLoggerDedupTest.DATA, format='json')
+        mock_find.assert_called_once_with(ApiLoggerDedupTest.DATA['transactionId'], 'BE')
+        self.assertEqual(mock_insert.call_count, 1)
+        self.assertEqual(ret.status_code, 409)
+        self.assertEqual(self.counters.snapshot(), {'checks': 2, 'hits': 1, 'duplicates': 1})
+
+    @patch.object(RequestsDao, 'find_by_transaction', return_value=None)
+    @patch.object(RequestsDao, 'insert', return_value=82)
+    def test_false_positive_is_inserted(self, mock_insert, mock_find):
+        """ Filter hits not found in the database are stored
+        """
+        dedup_filter = create_autospec(DedupFilter)
+        dedup_filter.seen.return_value = True
+        with patch.object(ingest, 'dedup_filter', dedup_filter):
+            ret = self.apiclient.post(ApiLoggerDedupTest.LOG_URL, ApiLoggerDedupTest.DATA, format='json')
+        self.assertEqual(ret.status_code, 201)
+        self.assertEqual(ret.data, {"result": 82})
+        self.assertEqual(self.counters.get('false_positives'), 1)
+
+    @patch.object(RequestsDao, 'find_by_transaction', return_value=81)
+    def test_duplicated_post_ok(self, mock_find):
+        """ Duplicates may be answered with the stored id
+        """
+        dedup_filter = create_autospec(DedupFilter)
+        dedup_filter.seen.return_value = True
+        with patch.object(ingest, 'dedup_filter', dedup_filter):
+            with patch.dict(ingest.DEDUP, {'duplicate_status': 200}):
+                ret = self.apiclient.post(ApiLoggerDedupTest.LOG_URL, ApiLoggerDedupTest.DATA, format='json')
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.data, {"result": 81})
+
+    @patch.object(RequestsDao, 'find_by_transaction', return_value=None)
+    @patch.object(RequestsDao, 'insert_batch', return_value=[81, 82])
+    def test_duplicated_in_batch(self, mock_insert_batch, mock_find):
+        """ Logs repeated inside a list are inserted once and reported as duplicates, or with the id of the first
+        """
+        other = dict(ApiLoggerDedupTest.DATA, origin='FE')
+        data = [ApiLoggerDedupTest.DATA, other, ApiLoggerDedupTest.DATA]
+        with patch.object(ingest, 'dedup_filter', DedupFilter(3600, 1024, 4)):
+            ret = self.apiclient.post(ApiLoggerDedupTest.LOG_URL, data, format='json')
+        self.assertEqual(len(mock_insert_batch.call_args[0][0]), 2)
+        self.assertFalse(mock_find.called)
+        self.assertEqual(ret.status_code, 201)
+        self.assertEqual(ret.data, {"result": [81, 82, {"status": 409, "detail": "Duplicated log {}".format(
+            ApiLoggerDedupTest.DATA['transactionId'])}]})
+        self.assertEqual(self.counters.get('duplicates'), 1)
+
+        with patch.object(ingest, 'dedup_filter', DedupFilter(3600, 1024, 4)):
+            with patch.dict(ingest.DEDUP, {'duplicate_status': 200}):
+                ret = self.apiclient.post(ApiLoggerDedupTest.LOG_URL, data, format='json')
+        self.assertEqual(ret.data, {"result": [81, 82, 81]})
+
+    @patch.object(RequestsDao, 'find_by_transaction', return_value=None)
+    @patch.object(RequestsDao, 'insert_batch', return_value=[81])
+    def test_duplicated_in_queued_batch(self, mock_insert_batch, mock_find):
+        """ Queued logs repeated inside a batch are inserted once and their tickets rejected
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        queue = IngestQueue(os.path.join(directory, 'ingest.db'))
+        first, second = queue.put(ApiLoggerDedupTest.DATA), queue.put(ApiLoggerDedupTest.DATA)
+        with patch.object(ingest, 'dedup_filter', DedupFilter(3600, 1024, 4)):
+            self.assertEqual(ingest.process_batch(views.dao, queue, 'test'), 2)
+        self.assertEqual(len(mock_insert_batch.call_args[0][0]), 1)
+        self.assertEqual(queue.status(first), {'state': 'stored', 'id': 81})
+        self.assertEqual(queue.status(second), {'state': 'rejected', 'reason': 'Duplicated log {}'.format(
+            ApiLoggerDedupTest.DATA['transactionId'])})
+
+
+class ApiLoggerSpoolTest(unittest.TestCase):
+    """ Spooling logs while mongo is down
+    """
+    LOG_URL = reverse('logger-api')
+
+    def setUp(self):
+        self.apiclient = APIClient()
+        self.directory = tempfile.mkdtemp()
+        self.spool = Spool(self.directory)
+        start_patches(self, patch.dict(ingest.SPOOL, {'enabled': True}), patch.object(ingest, 'spool', self.spool))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        del self.apiclient
+
+    @patch.object(RequestsDao, 'insert', side_effect=AutoReconnect('connection refused'))
+    def test_post_spooled_and_replayed(self, mock_insert):
+        """ Logs are spooled when mongo is unreachable and replayed with the same _id
+        """
+        ret = self.apiclient.post(ApiLoggerSpoolTest.LOG_URL, {"data": "datas"}, format='json')
+        self.assertEqual(ret.status_code, 202)
+        key = ret.data['result']['spooled']
+        self.assertTrue(mock_insert.call_args[1]['keep_object_id'])
+        self.spool.seal()
+        with patch.object(RequestsDao, 'insert_batch', return_value=[12]) as mock_insert_batch:
+            self.assertTrue(ingest.replay_segment(views.dao, self.spool))
+        docs = mock_insert_batch.call_args[0][0]
+        self.assertEqual(str(docs[0]['_id']), key)
+        self.assertEqual(docs[0]['data'], 'datas')
+        self.assertEqual(self.spool.depth()['segments'], 0)
+
+    @patch.object(RequestsDao, 'insert_batch', side_effect=AutoReconnect('connection refused'))
+    def test_failed_replay_keeps_segment(self, mock_insert_batch):
+        """ Segments stay in the spool until mongo takes them
+        """
+        self.spool.append({'data': 'datas'})
+        self.spool.seal()
+        with self.assertRaises(AutoReconnect):
+            ingest.replay_segment(views.dao, self.spool)
+        self.assertIsNotNone(self.spool.claim())
+
+    @patch.object(RequestsDao, 'insert_batch', side_effect=AutoReconnect('connection refused'))
+    def test_post_batch_spool_full_partway(self, mock_insert_batch):
+        """ A batch filling the spool partway is refused without spooling any of its logs, so retrying it
+        does not store them twice
+        """
+        logs = [{"data": "x" * 200} for _ in range(10)]
+        with patch.object(self.spool, 'max_bytes', 1024):
+            ret = self.apiclient.post(ApiLoggerSpoolTest.LOG_URL, logs, format='json')
+            self.assertEqual(ret.status_code, 503)
+            self.assertEqual(self.spool.depth()['bytes'], 0)
+            ret = self.apiclient.post(ApiLoggerSpoolTest.LOG_URL, logs[:2], format='json')
+        self.assertEqual(ret.status_code, 202)
+        self.spool.seal()
+        self.assertEqual(len(self.spool.read(self.spool.claim())[0]), 2)
+
+
+class ApiLoggerRateLimitTest(unittest.TestCase):
+    """ Per app rate limits
+    """
+    LOG_URL = reverse('logger-api')
+
+    def setUp(self):
+        self.apiclient = APIClient()
+        self.directory = tempfile.mkdtemp()
+        start_patches(self, patch.dict(ingest.RATE_LIMIT, {'enabled': True, 'default': None,
+                                                           'limits': {'MobileId': {'rate': 1, 'burst': 2}}}),
+                            patch.object(ingest, 'token_buckets', TokenBuckets(os.path.join(self.directory, 'rl.db'))))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        del self.apiclient
+
+    @patch.object(RequestsDao, 'insert', return_value=1)
+    def test_post_throttled(self, mock_insert):
+        """ Logs over the app limit are answered 429 with a retry hint, other apps are not limited
+        """
+        metrics.counters('rate_limit').reset()
+        log = {"app": "MobileId", "origin": "BE"}
+        for _ in range(2):
+            self.assertEqual(self.apiclient.post(self.LOG_URL, log, format='json').status_code, 201)
+        ret = self.apiclient.post(self.LOG_URL, log, format='json')
+        self.assertEqual(ret.status_code, 429)
+        self.assertEqual(ret['Retry-After'], '1')
+        self.assertEqual(mock_insert.call_count, 2)
+        self.assertEqual(metrics.counters('rate_limit').get('throttled.MobileId'), 1)
+        ret = self.apiclient.post(self.LOG_URL, {"app": "FrontendBasic"}, format='json')
+        self.assertEqual(ret.status_code, 201)
+
+    @patch.object(RequestsDao, 'insert_batch', return_value=[1, 2])
+    def test_list_throttled_keeps_other_tokens(self, mock_insert_batch):
+        """ A list over the limit of one bucket takes no tokens from the buckets of its other logs
+        """
+        with patch.dict(ingest.RATE_LIMIT['limits'], {'FrontendBasic': {'rate': 1, 'burst': 1}}), \
+                patch.object(RequestsDao, 'insert', return_value=1):
+            for _ in range(2):
+                ret = self.apiclient.post(self.LOG_URL, {"app": "MobileId", "origin": "BE"}, format='json')
+                self.assertEqual(ret.status_code, 201)
+            logs = [{"app": "FrontendBasic"}, {"app": "MobileId", "origin": "BE"}]
+            self.assertEqual(self.apiclient.post(self.LOG_URL, logs, format='json').status_code, 429)
+            self.assertFalse(mock_insert_batch.called)
+            ret = self.apiclient.post(self.LOG_URL, {"app": "FrontendBasic"}, format='json')
+            self.assertEqual(ret.status_code, 201)
+
+    @patch.object(RequestsDao, 'insert', return_value=1)
+    def test_acquire_offloaded(self, mock_insert):
+        """ Tokens are taken in the threadpool, not in the hub thread
+        """
+        with patch.object(ingest, 'offload', side_effect=offload) as mock_offload:
+            self.apiclient.post(self.LOG_URL, {"app": "MobileId", "origin": "BE"}, format='json')
+        self.assertEqual(mock_offload.call_args[0][0], ingest.token_buckets.acquire_many)
+
+
+class ApiLoggerTailTest(unittest.TestCase):
+    """ Live tail of stored logs
+    """
+    LOG_URL = reverse('logger-api')
+    TAIL_URL = reverse('logger-api-tail')
+
+    def setUp(self):
+        self.apiclient = APIClient()
+        self.directory = tempfile.mkdtemp()
+        start_patches(self, patch.dict(ingest.TAIL, {'enabled': True}),
+                            patch.dict(views.TAIL, {'enabled': True}),
+                            patch.object(ingest, 'tail_buffer', TailBuffer(os.path.join(self.directory, 'tail.db'))))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        del self.apiclient
+
+    @patch.object(RequestsDao, 'insert', return_value=7)
+    def test_tail_posted_logs(self, mock_insert):
+        """ Stored logs are returned after the cursor, filtered by app
+        """
+        cursor = self.apiclient.get(self.TAIL_URL).data['result']['cursor']
+        self.apiclient.post(self.LOG_URL, {"app": "MobileId", "id": 7}, format='json')
+        self.apiclient.post(self.LOG_URL, {"app": "FrontendBasic", "id": 7}, format='json')
+        ingest.tail_buffer.flush()
+        ret = self.apiclient.get(self.TAIL_URL, {'cursor': cursor, 'app': 'MobileId', 'timeout': 0})
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.data['result']['logs'], [{"app": "MobileId", "id": 7}])
+
+    def test_tail_timeout(self):
+        """ Without new logs the request answers an empty list after timeout
+        """
+        ret = self.apiclient.get(self.TAIL_URL, {'cursor': 0, 'timeout': 0.01})
+        self.assertEqual(ret.data['result'], {'cursor': 0, 'logs': []})
+
+    def test_tail_read_offloaded(self):
+        """ The ring is read in the threadpool, not in the hub thread
+        """
+        with patch.object(views, 'offload', side_effect=offload) as mock_offload:
+            self.apiclient.get(self.TAIL_URL, {'cursor': 0, 'timeout': 0})
+        self.assertEqual(mock_offload.call_args[0][0], ingest.tail_buffer.read)
+
+
+class ApiLoggerSamplingTest(unittest.TestCase):
+    """ Sampling of received logs
+    """
+    LOG_URL = reverse('logger-api')
+
+    def setUp(self):
+        self.apiclient = APIClient()
+        start_patches(self, patch.dict(ingest.SAMPLING, {'enabled': True,
+                                                         'rules': [{'responseCode': '2xx', 'rate': 0}]}),
+                            patch.object(ingest, 'sampler', None),
+                            patch.object(ingest.gevent, 'spawn'))
+        ingest.sampling_counters.reset()
+
+    def tearDown(self):
+        del self.apiclient
+
+    @patch.object(RequestsDao, 'insert')
+    def test_post_sampled_out(self, mock_insert):
+        """ Dropped logs are counted and answered without id
+        """
+        ret = self.apiclient.post(self.LOG_URL, {"app": "MobileId", "responseCode": "200"}, format='json')
+        self.assertEqual(ret.status_code, 202)
+        self.assertEqual(ret.data, {'result': None})
+        self.assertFalse(mock_insert.called)
+        self.assertEqual(ingest.sampling_counters.get('dropped'), 1)
+        self.assertEqual(sum(received for received, _ in ingest.sampler.counts.values()), 1)
+
+    @patch.object(RequestsDao, 'insert_batch', return_value=[5])
+    def test_post_batch_keeps_errors(self, mock_insert_batch):
+        """ Logs no rule drops are stored with their sample rate
+        """
+        ret = self.apiclient.post(self.LOG_URL, [{"app": "MobileId", "responseCode": "200"},
+                                                 {"app": "MobileId", "responseCode": "500"}], format='json')
+        self.assertEqual(ret.status_code, 201)
+        self.assertEqual(ret.data, {'result': [None, 5]})
+        self.assertEqual(mock_insert_batch.call_args[0][0], [{"app": "MobileId", "responseCode": "500",
+                                                              "sampleRate": 1.0}])
+        self.assertEqual(ingest.sampling_counters.get('received'), 2)
+
+    @patch.object(views.sampling_dao, 'totals', return_value=[{'api': 'payment', 'app': 'Microsoft',
+                                                                'responseCode': '201', 'received': 100, 'kept': 1}])
+    def test_get_totals(self, mock_totals):
+        """ Received and stored totals by api, app and responseCode
+        """
+        ret = self.apiclient.get(reverse('sampling-api'), {'api': 'payment'})
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual((ret.data['result']['received'], ret.data['result']['kept']), (100, 1))
+        self.assertEqual(mock_totals.call_args[1]['api'], 'payment')
+
+    def test_get_totals_invalid_dates(self):
+        """ Strings without any date are rejected
+        """
+        ret = self.apiclient.get(reverse('sampling-api'), {'from': 'garbage'})
+        self.assertEqual(ret.status_code, 400)
+        self.assertEqual(ret.data, "Invalid sampling parameters")
+
+
+class ApiRawLinesTest(unittest.TestCase):
+    """ Raw lines storage and reprocessing
+    """
+    LOG_URL = reverse('logger-api')
+    REPROCESS_URL = reverse('logger-api-reprocess')
+    LOG_LINE = '2013/05/17T02:10:25.335 2013/05/17T02:10:25.548 Microsoft 1e246bb8-1162-46a2-93af-1da64ca9e3cb ' \
+               'FE FrontendTrustedPartner 9/18297 21407 INFOSTATS 201 ["POST /payment/v2/payments HTTP/1.0"]'
+
+    def setUp(self):
+        self.client = Client()
+        start_patches(self, patch.dict(ingest.RAW_LINES, {'enabled': True}),
+                            patch.dict(views.RAW_LINES, {'enabled': True}))
+
+    def tearDown(self):
+        del self.client
+
+    @patch.object(RequestsDao, 'insert', return_value=1)
+    def test_post_keeps_raw_line(self, mock_insert):
+        """ Parsed logs keep their compressed line and the parser version
+        """
+        ret = self.client.post(self.LOG_URL, self.LOG_LINE, content_type='text/plain')
+        self.assertEqual(ret.status_code, 201)
+        doc = mock_insert.call_args[0][0]
+        self.assertEqual(unpack_line(doc['raw_line']), self.LOG_LINE)
+        self.assertEqual(doc['parserVersion'], BVParser.VERSION)
+
+    @patch.object(ingest, 'get_rejected_dao')
+    def test_post_rejected_line_kept(self, mock_rejected_dao):
+        """ Lines the parser rejects are stored with the error
+        """
+        ret = self.client.post(self.LOG_URL, 'afadfadfadfa', content_type='text/plain')
+        self.assertEqual(ret.status_code, 400)
+        mock_rejected_dao.return_value.insert_line.assert_called_once_with('afadfadfadfa', 'Invalid data log',
+                                                                           BVParser.VERSION)
+
+    def test_run_reprocess(self):
+        """ Outdated logs are updated and rejected lines parsed now are stored
+        """
+        dao, rejected_dao, jobs_dao = create_autospec(RequestsDao), Mock(), Mock()
+        dao.count_outdated.return_value = 2
+        rejected_dao.count_outdated.return_value = 2
+        dao.outdated_lines.return_value = [('shard', [{'id': 5, 'raw_line': pack_line(self.LOG_LINE)},
+                                                      {'id': 6, 'raw_line': pack_line('garbage')}])]
+        rejected_dao.outdated_lines.return_value = [[{'_id': 'r1', 'raw_line': pack_line(self.LOG_LINE)},
+                                                     {'_id': 'r2', 'raw_line': pack_line('garbage')}]]
+        with patch.dict(reprocess.RAW_LINES, {'throttle': 0}):
+            progress = reprocess.run(dao, rejected_dao, jobs_dao, 'job')
+        self.assertEqual(progress['state'], 'done')
+        self.assertEqual((progress['total'], progress['processed'], progress['updated'], progress['recovered'],
+                          progress['failed']), (4, 4, 1, 1, 2))
+        shard, parsed = dao.update_parsed.call_args[0]
+        self.assertEqual((shard, parsed[0]['id'], parsed[0]['api']), ('shard', 5, 'payment'))
+        self.assertEqual(dao.insert_batch.call_args[0][0][0]['parserVersion'], BVParser.VERSION)
+        rejected_dao.remove_lines.assert_called_once_with(['r1'])
+        rejected_dao.mark_lines.assert_called_once_with(['r2'], 'Invalid data log', BVParser.VERSION)
+        self.assertEqual(jobs_dao.update.call_args[0][1]['state'], 'done')
+
+    @patch.object(reprocess, 'start', return_value='5f4e606058d5443cbafd3f09')
+    def test_start_reprocess(self, mock_start):
+        """ Reprocess jobs start in the background
+        """
+        ret = APIClient().post(self.REPROCESS_URL, {'from': '2013-05-17'}, format='json')
+        self.assertEqual(ret.status_code, 202)
+        self.assertEqual(ret.data, {'result': {'job': '5f4e606058d5443cbafd3f09'}})
+        self.assertEqual(mock_start.call_args[0][3:], ('2013-05-17', None))
+
+    def test_start_invalid_dates(self):
+        """ Invalid dates are rejected before creating the job
+        """
+        with patch.object(views.jobs_dao, 'create') as mock_create:
+            ret = APIClient().post(self.REPROCESS_URL, {'from': 'yesterday'}, format='json')
+        self.assertEqual(ret.status_code, 400)
+        self.assertFalse(mock_create.called)
+
+    def test_get_job(self):
+        """ Job progress is returned, unknown jobs are not found
+        """
+        job_url = reverse('logger-api-reprocess-job', args=['5f4e606058d5443cbafd3f09'])
+        with patch.object(views.jobs_dao, 'get', return_value={'id': '5f4e606058d5443cbafd3f09', 'state': 'done'}):
+            self.assertEqual(self.client.get(job_url).data['result']['state'], 'done')
+        with patch.object(views.jobs_dao, 'get', return_value=None):
+            self.assertEqual(self.client.get(job_url).status_code, 404)
+
+
+class ApiLoggerAsyncTest(unittest.TestCase):
+    """ Asynchronous ingest with tickets
+    """
+    LOG_URL = reverse('logger-api')
+    LOG_LINE = '2013/05/17T02:10:25.335 2013/05/17T02:10:25.548 Microsoft 1e246bb8-1162-46a2-93af-1da64ca9e3cb ' \
+               'FE FrontendTrustedPartner 9/18297 21407 INFOSTATS 201 ["POST /payment/v2/payments HTTP/1.0"]'
+
+    def setUp(self):
+        self.client = Client()
+        self.directory = tempfile.mkdtemp()
+        self.queue = IngestQueue(os.path.join(self.directory, 'ingest.db'))
+        start_patches(self, patch.dict(ingest.ASYNC_INGEST, {'enabled': True}),
+                            patch.object(ingest, 'async_queue', self.queue))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        del self.client
+
+    @patch.object(RequestsDao, 'insert_batch')
+    def test_post_accepted_and_stored(self, mock_insert_batch):
+        """ Logs are answered with a ticket and stored in batches
+        """
+        mock_insert_batch.side_effect = lambda docs: range(100, 100 + len(docs))
+        ret = self.client.post(ApiLoggerAsyncTest.LOG_URL, ApiLoggerAsyncTest.LOG_LINE, content_type='text/plain')
+        self.assertEqual(ret.status_code, 202)
+        ticket = ret.data['result']['ticket']
+        ticket_url = reverse('logger-api-ticket', args=[ticket])
+        self.assertEqual(self.client.get(ticket_url).data, {'result': {'state': 'queued'}})
+
+        self.assertEqual(ingest.process_batch(views.dao, self.queue, 'test'), 1)
+        self.assertEqual(mock_insert_batch.call_args[0][0][0]['origin'], 'FE')
+        ret = self.client.get(ticket_url)
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.data, {'result': {'state': 'stored', 'id': 100}})
+
+    @patch.object(RequestsDao, 'insert_batch')
+    def test_retried_batch_recorded_once(self, mock_insert_batch):
+        """ Logs of a batch whose insert failed are added to the latency and heavy hitter counts when stored
+        """
+        latency, heavy_hitters = LatencyRecorder(), HeavyHittersRecorder(('app',))
+        start_patches(self, patch.dict(ingest.LATENCY, {'enabled': True}),
+                            patch.dict(ingest.HEAVY_HITTERS, {'enabled': True}),
+                            patch.object(ingest, 'latency_recorder', latency),
+                            patch.object(ingest, 'heavy_hitters_recorder', heavy_hitters))
+        mock_insert_batch.side_effect = [AutoReconnect('down'), [100]]
+        self.queue.put(ApiLoggerAsyncTest.LOG_LINE)
+        with self.assertRaises(AutoReconnect):
+            ingest.process_batch(views.dao, self.queue, 'test')
+        self.assertEqual(latency.sketches, {})
+        self.assertEqual(heavy_hitters.summaries, {})
+
+        self.assertEqual(ingest.process_batch(views.dao, self.queue, 'test'), 1)
+        self.assertEqual([sketch.count for sketch in latency.sketches.values()], [1])
+        self.assertEqual([summary.counters for summary in heavy_hitters.summaries.values()],
+                         [{'FrontendTrustedPartner': [1, 0]}])
+
+    def test_post_invalid_rejected_early(self):
+        """ Logs without INFOSTATS are not queued
+        """
+        ret = self.client.post(ApiLoggerAsyncTest.LOG_URL, 'afadfadfadfa', content_type='text/plain')
+        self.assertEqual(ret.status_code, 400)
+        self.assertEqual(self.queue.depth(), 0)
+
+    @patch.object(RequestsDao, 'insert_batch', return_value=[])
+    def test_parse_error_rejects_ticket(self, mock_insert_batch):
+        """ Logs failing to parse are rejected with the parser error
+        """
+        ticket = self.queue.put('2013/05/17T02:10:25.335 2013/05/17T02:10:25.548 INFOSTATS 201')
+        ingest.process_batch(views.dao, self.queue, 'test')
+        self.assertEqual(self.queue.status(ticket), {'state': 'rejected',
+                                                     'reason': 'Send data does not match with log structure'})
+
+    def test_unknown_ticket(self):
+        """ Unknown tickets are not found
+        """
+        ret = self.client.get(reverse('logger-api-ticket', args=['0' * 32]))
+        self.assertEqual(ret.status_code, 404)
+
+
+class ApiLoggerSearchTest(unittest.TestCase):
+    """ Log search api tests
+    """
+    SEARCH_URL = reverse('logger-api-search')
+
+    def setUp(self):
+        self.client = Client()
+
+    def tearDown(self):
+        del self.client
+
+    @patch.object(RequestsDao, 'search', return_value=[{'id': 1, 'exceptionId': 'SVR1007'}])
+    def test_search(self, mock_search):
+        """ Search returns matching logs
+        """
+        ret = self.client.get(ApiLoggerSearchTest.SEARCH_URL, {'q': 'SVR1007', 'from': '2013-05-17', 'limit': 10})
+        mock_search.assert_called_once_with(u'SVR1007', date_from=u'2013-05-17', date_to=None, limit=10)
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.data, {'result': [{'id': 1, 'exceptionId': 'SVR1007'}]})
+
+    @patch.object(RequestsDao, 'search', return_value=[])
+    def test_search_limit_capped(self, mock_search):
+        """ Result limit never exceeds the configured maximum
+        """
+        self.client.get(ApiLoggerSearchTest.SEARCH_URL, {'q': 'SVR1007', 'limit': 100000})
+        self.assertEqual(mock_search.call_args[1]['limit'], 500)
+
+    def test_search_invalid_dates(self):
+        """ Unparseable dates are rejected
+        """
+        ret = self.client.get(ApiLoggerSearchTest.SEARCH_URL, {'q': 'SVR1007', 'from': 'garbage'})
+        self.assertEqual(ret.status_code, 400)
+        self.assertEqual(ret.data, "Invalid search parameters")
+
+    def test_search_empty(self):
+        """ Search without text is rejected
+        """
+        ret = self.client.get(ApiLoggerSearchTest.SEARCH_URL)
+        self.assertEqual(ret.status_code, 400)
+        self.assertEqual(ret.data, "Received search text is empty")
+
+
+class ApiLoggerBulkTest(unittest.TestCase):
+    """ Bulk logger api unit tests
+    """
+    BULK_URL = reverse('logger-api-bulk')
+
+    def setUp(self):
+        self.client = Client()
+
+    def tearDown(self):
+        del self.client
+
+    @patch.object(RequestsDao, 'bulk_delete', return_value={'matched': 3, 'deleted': 3})
+    def test_bulk_delete(self, mock_bulk_delete):
+        """ Deleting logs by filter returns counts
+        """
+        data = json.dumps({"filter": {"ids": [1, 2, 3]}})
+        ret = self.client.delete(ApiLoggerBulkTest.BULK_URL, data, content_type='application/json')
+        mock_bulk_delete.assert_called_once_with({u'ids': [1, 2, 3]}, chunk_size=None, throttle=None)
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.data, {'result': {'matched': 3, 'deleted': 3}})
+
+    def test_bulk_delete_empty_filter(self):
+        """ Bulk delete without filter is rejected
+        """
+        ret = self.client.delete(ApiLoggerBulkTest.BULK_URL, json.dumps({}), content_type='application/json')
+        self.assertEqual(ret.status_code, 400)
+        self.assertEqual(ret.data, "Received bulk filter is empty")
+
+    @patch.object(RequestsDao, 'bulk_update', return_value={'matched': 2, 'updated': 2})
+    def test_bulk_update(self, mock_bulk_update):
+        """ Updating logs by filter returns counts
+        """
+        data = json.dumps({"filter": {"api": "mobileid"}, "update": {"domain": "M2M"}, "chunk_size": 500})
+        ret = self.client.put(ApiLoggerBulkTest.BULK_URL, data, content_type='application/json')
+        mock_bulk_update.assert_called_once_with({u'api': u'mobileid'}, {u'domain': u'M2M'}, chunk_size=500,
+                                                 throttle=None)
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.data, {'result': {'matched': 2, 'updated': 2}})
+
+    @patch.object(RequestsDao, 'bulk_update')
+    def test_bulk_update_invalid_filter(self, mock_bulk_update):
+        """ Unknown filter fields return bad request
+        """
+        mock_bulk_update.side_effect = DBLogException("Bulk filter does not select any log")
+        data = json.dumps({"filter": {"unknown": 1}, "update": {"domain": "M2M"}})
+        ret = self.client.put(ApiLoggerBulkTest.BULK_URL, data, content_type='application/json')
+        self.assertEqual(ret.status_code, 400)
+        self.assertEqual(ret.data, "Bulk filter does not select any log")
+
+    @patch.object(RequestsDao, '_chunked_ids')
+    def test_bulk_invalid_filter_values(self, mock_chunked_ids):
+        """ Filters with invalid ids or dates return bad request before reading any log
+        """
+        for bulk_filter in ({"id_from": "abc"}, {"date_from": "garbage"}, {"ids": "123"}, [1]):
+            data = json.dumps({"filter": bulk_filter})
+            ret = self.client.delete(ApiLoggerBulkTest.BULK_URL, data, content_type='application/json')
+            self.assertEqual(ret.status_code, 400)
+        self.assertFalse(mock_chunked_ids.called)
+
+    @patch.object(RequestsDao, 'bulk_delete')
+    def test_bulk_invalid_body(self, mock_bulk_delete):
+        """ Bodies not being an object or with invalid chunk_size or throttle return bad request
+        """
+        for body in ([{"filter": {"ids": [1]}}], "filter", 1, {"filter": {"ids": [1]}, "chunk_size": "abc"},
+                     {"filter": {"ids": [1]}, "chunk_size": 0}, {"filter": {"ids": [1]}, "throttle": -1}):
+            ret = self.client.delete(ApiLoggerBulkTest.BULK_URL, json.dumps(body), content_type='application/json')
+            self.assertEqual(ret.status_code, 400)
+        self.assertFalse(mock_bulk_delete.called)
+
+    @patch.object(RequestsDao, '_chunked_ids')
+    def test_bulk_update_id(self, mock_chunked_ids):
+        """ Updates touching id or using operators not allowed return bad request
+        """
+        for update in ({"id": 5}, {"$set": {"_id": 1}}, {"$rename": {"api": "x"}}):
+            data = json.dumps({"filter": {"ids": [1]}, "update": update})
+            ret = self.client.put(ApiLoggerBulkTest.BULK_URL, data, content_type='application/json')
+            self.assertEqual(ret.status_code, 400)
+        self.assertFalse(mock_chunked_ids.called)
+
+
 class ApiCollectionTest(unittest.TestCase):
     """ API Collection class unit tests
     """
@@ -371,6 +1093,16 @@ class ApiCollectionTest(unittest.TestCase):
         self.assertEqual(ret.status_code, 200)
         self.assertEqual(ret.data, {'result': ['ids', 'requests']})
 
+    @patch.object(DB, 'stats', return_value={'count': 1})
+    @patch.object(DB, 'get_collection_names', return_value=['ids', 'requests'])
+    def test_get_collections_stats(self, mock_names, mock_stats):
+        """ Stats of every collection by name
+        """
+        ret = self.client.get(ApiCollectionTest.COL_PATH_URL, {'stats': ''})
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.data, {'result': {'ids': {'count': 1}, 'requests': {'count': 1}}})
+        self.assertEqual(mock_stats.call_count, 2)
+
     @patch.object(RequestsDao, 'remove')
     def test_remove_log_collection_status_204(self, mock_request_dao):
         """ Testing calling remove collection in mongo
@@ -382,6 +1114,124 @@ class ApiCollectionTest(unittest.TestCase):
         self.assertEqual(ret.status_text, 'NO CONTENT')
 
 
+class ApiStatsTest(unittest.TestCase):
+    """ Worker counters api tests
+    """
+    def test_get_stats(self):
+        """ Counters are returned by component
+        """
+        metrics.counters('dedup').incr('checks')
+        ret = Client().get(reverse('stats-api'))
+        self.assertEqual(ret.status_code, 200)
+        self.assertIn('dedup', ret.data['result'])
+
+
+class ApiLatencyTest(unittest.TestCase):
+    """ Latency percentiles api tests
+    """
+    @patch.object(LatencyDao, 'sketch')
+    def test_get_percentiles(self, mock_sketch):
+        """ Percentiles of the stored sketches are returned in milliseconds
+        """
+        sketch = LatencySketch()
+        for value in (100, 200, 300):
+            sketch.add(value)
+        mock_sketch.return_value = sketch
+        ret = Client().get(reverse('latency-api'), {'api': 'payment', 'from': '2013-05-17'})
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.data['result']['count'], 3)
+        self.assertAlmostEqual(ret.data['result']['p50'], 200, delta=2)
+        self.assertEqual(mock_sketch.call_args[1]['api'], 'payment')
+        self.assertEqual(mock_sketch.call_args[1]['date_from'], '2013-05-17')
+
+    @patch.object(LatencyDao, 'sketch', side_effect=ValueError('unknown string format'))
+    def test_get_invalid_dates(self, mock_sketch):
+        """ Unparseable dates are rejected
+        """
+        ret = Client().get(reverse('latency-api'), {'from': 'yesterday'})
+        self.assertEqual(ret.status_code, 400)
+
+    def test_get_dates_without_date(self):
+        """ Strings without any date are rejected
+        """
+        ret = Client().get(reverse('latency-api'), {'from': 'garbage'})
+        self.assertEqual(ret.status_code, 400)
+        self.assertEqual(ret.data, "Invalid latency parameters")
+
+
+class ApiHeavyHittersTest(unittest.TestCase):
+    """ Most frequent values api tests
+    """
+    @patch.object(views.heavy_hitters_dao, 'top', return_value=[('SVC1000', 12, 2)])
+    def test_get_top(self, mock_top):
+        """ Values are returned with their count bounds
+        """
+        with patch.dict(views.HEAVY_HITTERS, {'fields': ('exceptionId',)}):
+            ret = Client().get(reverse('top-api', args=['exceptionId']), {'limit': 5, 'from': '2013-05-17'})
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.data['result'], [{'value': 'SVC1000', 'count': 12, 'min_count': 10, 'error': 2}])
+        self.assertEqual(mock_top.call_args[1]['limit'], 5)
+
+    def test_get_untracked_field(self):
+        """ Fields not tracked are not found
+        """
+        ret = Client().get(reverse('top-api', args=['userAgent']))
+        self.assertEqual(ret.status_code, 404)
+
+    def test_get_invalid_dates(self):
+        """ Strings without any date are rejected
+        """
+        with patch.dict(views.HEAVY_HITTERS, {'fields': ('exceptionId',)}):
+            ret = Client().get(reverse('top-api', args=['exceptionId']), {'from': 'garbage'})
+        self.assertEqual(ret.status_code, 400)
+        self.assertEqual(ret.data, "Invalid heavy hitters parameters")
+
+
+class ApiProfilingTest(unittest.TestCase):
+    """ Profiling api tests
+    """
+    URL = reverse('profiling-api')
+
+    def setUp(self):
+        self.client = Client()
+        start_patches(self, patch.dict(views.PROFILING, {'token': 's3cr3t'}),
+                            patch.object(views.profiler, 'directory', tempfile.mkdtemp()),
+                            patch.object(views.profiler, 'sample_rate', views.profiler.sample_rate))
+
+    def tearDown(self):
+        shutil.rmtree(views.profiler.directory)
+        views.profiler.enabled = False
+
+    def test_token_required(self):
+        """ Requests without the profiling token are forbidden
+        """
+        self.assertEqual(self.client.get(self.URL).status_code, 403)
+        self.assertEqual(self.client.get(self.URL, HTTP_X_PROFILING_TOKEN='wrong').status_code, 403)
+
+    def test_toggle(self):
+        """ Profiling is enabled with a sample rate and disabled dumping profiles
+        """
+        ret = self.client.post(self.URL, json.dumps({'enabled': True, 'sample_rate': 1}),
+                               content_type='application/json', HTTP_X_PROFILING_TOKEN='s3cr3t')
+        self.assertEqual(ret.status_code, 200)
+        self.assertTrue(views.profiler.enabled)
+        with patch.object(RequestsDao, 'select', return_value={'id': 1}):
+            self.client.get(reverse('logger-api-detail', args=[1]))
+        ret = self.client.post(self.URL, json.dumps({'enabled': False}), content_type='application/json',
+                               HTTP_X_PROFILING_TOKEN='s3cr3t')
+        self.assertFalse(views.profiler.enabled)
+        self.assertEqual(len(ret.data['result']['dumped']), 1)
+
+    def test_invalid_sample_rate(self):
+        """ Sample rates that are not positive integers are rejected
+        """
+        for sample_rate in ('abc', [1], {'rate': 1}, -5):
+            ret = self.client.post(self.URL, json.dumps({'enabled': True, 'sample_rate': sample_rate}),
+                                   content_type='application/json', HTTP_X_PROFILING_TOKEN='s3cr3t')
+            self.assertEqual(ret.status_code, 400)
+        self.assertFalse(views.profiler.enabled)
+
+
 class ApiCollectionDetailTest(unittest.TestCase):
     """ Api collection detail class tests
     """
@@ -424,6 +1274,328 @@ class ApiCollectionDetailTest(unittest.TestCase):
         self.assertEqual(ret.status_code, 200)
         self.assertEqual(ret.data, {'result': 1})
 
+    @patch.object(DB, 'stats', return_value={'count': 1, 'size': 1000, 'growth': None})
+    def test_get_collection_stats(self, mock_stats):
+        """ Getting storage stats from requests collection
+        """
+        ret = self.client.get(ApiCollectionDetailTest.COL_DETAIL_URL, {'stats': ''})
+        mock_stats.assert_called_once_with('requests')
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.data, {'result': {'count': 1, 'size': 1000, 'growth': None}})
+
+    @patch.object(DB, 'stats', side_effect=DBLogException("Collection requests stats not available"))
+    def test_get_missing_collection_stats(self, mock_stats):
+        """ Stats of a missing collection are not found
+        """
+        ret = self.client.get(ApiCollectionDetailTest.COL_DETAIL_URL, {'stats': ''})
+        self.assertEqual(ret.status_code, 404)
+
+
+class ApiSlowOperationsTest(unittest.TestCase):
+    """ Slow operations api tests
+    """
+    @patch.object(DB, 'slow_operations', return_value=[{'operation': 'search', 'millis': 900}])
+    def test_get_slow_operations(self, mock_slow):
+        """ Recorded slow operations are returned up to max_results
+        """
+        with patch.dict(views.SLOW_OPERATIONS, {'enabled': True, 'max_results': 10}):
+            ret = Client().get(reverse('slow-api'), {'limit': 100})
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.data, {'result': [{'operation': 'search', 'millis': 900}]})
+        mock_slow.assert_called_once_with(10)
+
+    def test_get_disabled(self):
+        """ Slow operations are not found while the log is disabled
+        """
+        ret = Client().get(reverse('slow-api'))
+        self.assertEqual(ret.status_code, 404)
+
+
+class ApiInMemoryIntegrationTest(unittest.TestCase):
+    """ Endpoints over an in memory database, running real queries and updates
+    """
+    LOG_URL = reverse('logger-api')
+    COL_URL = reverse('collection-api')
+    FE_LINE = '2013/05/17T02:10:25.335 2013/05/17T02:10:25.548 Microsoft 1e246bb8-1162-46a2-93af-1da64ca9e3cb FE ' \
+              'FrontendTrustedPartner 9/18297 21407 INFOSTATS 201 ["POST /payment/v2/payments HTTP/1.0"]'
+    BE_LOG = {"origin": "BE", "app": "MobileId", "responseCode": "400", "statType": "INFOSTATS",
+              "transactionId": "5f4e6060-58d5-443c-bafd-3f09ba532f28", "requestDate": "2013-10-11T11:48:50.860Z",
+              "responseDate": "2013-10-11T11:48:50.898Z", "body": [{"MobileId": {"info": {"xff": None}}}]}
+
+    def setUp(self):
+        self.client = Client()
+        self.apiclient = APIClient()
+        dbconn = mongomock.MongoClient()['logs']
+        start_patches(self, patch.object(views, 'dao', RequestsDao(dbconn=dbconn)),
+                            patch.object(views, 'data_base', DB(dbconn=dbconn)),
+                            patch.dict('apilog.mongo.BULK_OPERATIONS', {'throttle': 0}))
+
+    def _detail_url(self, log_id):
+        return reverse('logger-api-detail', args=[log_id])
+
+    def test_log_life_cycle(self):
+        """ A posted log is read, replaced, patched and deleted
+        """
+        ret = self.client.post(self.LOG_URL, self.FE_LINE, content_type='text/plain')
+        self.assertEqual(ret.status_code, 201)
+        log_id = ret.data['result']
+        log = self.client.get(self._detail_url(log_id)).data['result']
+        self.assertEqual((log['api'], log['origin'], log['responseCode']), ('payment', 'FE', '201'))
+        self.assertNotIn('_id', log)
+        self.assertNotIn('search_tokens', log)
+
+        ret = self.apiclient.put(self._detail_url(log_id), {'id': log_id, 'app': 'Microsoft', 'responseCode': '500'},
+                                 format='json')
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(self.client.get(self._detail_url(log_id)).data['result'],
+                         {'id': log_id, 'app': 'Microsoft', 'responseCode': '500'})
+
+        patch_data = {'set': {'responseCode': '404'}, 'expected': {'responseCode': '500'}}
+        self.assertEqual(self.apiclient.patch(self._detail_url(log_id), patch_data, format='json').status_code, 200)
+        self.assertEqual(self.apiclient.patch(self._detail_url(log_id), patch_data, format='json').status_code, 412)
+        self.assertEqual(self.apiclient.put(self._detail_url(log_id + 1), {'app': 'x'}, format='json').status_code,
+                         404)
+
+        self.assertEqual(self.client.delete(self._detail_url(log_id)).status_code, 204)
+        self.assertEqual(self.client.get(self._detail_url(log_id)).status_code, 404)
+        self.assertEqual(self.client.delete(self._detail_url(log_id)).status_code, 404)
+
+    def test_batch_list_search_and_bulk(self):
+        """ Logs posted in a batch get consecutive ids and are listed, searched and bulk deleted
+        """
+        ret = self.apiclient.post(self.LOG_URL, [self.FE_LINE, self.BE_LOG], format='json')
+        self.assertEqual(ret.status_code, 201)
+        self.assertEqual(ret.data, {'result': [1, 2]})
+        self.assertEqual(sorted(log['id'] for log in self.client.get(self.LOG_URL).data['result']), [1, 2])
+
+        ret = self.client.get(reverse('logger-api-search'), {'q': 'payments'})
+        self.assertEqual([log['id'] for log in ret.data['result']], [1])
+
+        ret = self.apiclient.delete(reverse('logger-api-bulk'), {'filter': {'app': 'MobileId'}}, format='json')
+        self.assertEqual(ret.data, {'result': {'matched': 1, 'deleted': 1}})
+        self.assertEqual([log['id'] for log in self.client.get(self.LOG_URL).data['result']], [1])
+
+    def test_collections(self):
+        """ Collections are listed, counted and dropped
+        """
+        self.client.post(self.LOG_URL, self.FE_LINE, content_type='text/plain')
+        requests_url = reverse('collection-api-detail', args=['requests'])
+        self.assertTrue(set(['ids', 'requests']) <= set(self.client.get(self.COL_URL).data['result']))
+        self.assertEqual(self.client.get(requests_url, {'count': ''}).data, {'result': 1})
+
+        self.assertEqual(self.client.delete(self.COL_URL).status_code, 204)
+        self.assertEqual(self.client.get(requests_url, {'count': ''}).data, {'result': 0})
+        self.assertEqual(self.client.delete(reverse('collection-api-detail', args=['ids'])).status_code, 204)
+        self.assertNotIn('ids', self.client.get(self.COL_URL).data['result'])
+
+
+class ApiArchiveTest(unittest.TestCase):
+    """ Archiving of old logs to segment files over an in memory database
+    """
+    LOG_URL = reverse('logger-api')
+    ARCHIVE_URL = reverse('logger-api-archive')
+    FE_LINE = '2013/05/17T02:10:25.335 2013/05/17T02:10:25.548 Microsoft 1e246bb8-1162-46a2-93af-1da64ca9e3cb FE ' \
+              'FrontendTrustedPartner 9/18297 21407 INFOSTATS 201 ["POST /payment/v2/payments HTTP/1.0"]'
+    BE_LINE = '2014/02/11T11:48:50.860 2014/02/11T11:48:50.898 M2M 5f4e6060-58d5-443c-bafd-3f09ba532f28 BE ' \
+              'MobileId / 21407 INFOSTATS 400 [{"MobileId":{"info":{"xff":null}}}]'
+
+    def setUp(self):
+        self.client = Client()
+        self.directory = tempfile.mkdtemp()
+        dbconn = mongomock.MongoClient()['logs']
+        self.dao = RequestsDao(dbconn=dbconn)
+        self.dao.archive = Archive(self.directory)
+        self.jobs_dao = JobsDao(dbconn=dbconn)
+        start_patches(self, patch.object(views, 'dao', self.dao),
+                            patch.object(views, 'jobs_dao', self.jobs_dao),
+                            patch.dict(views.ARCHIVE, {'enabled': True, 'throttle': 0}))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_archived_logs_still_read(self):
+        """ Old logs leave mongo for a segment and are still read by id and request date range
+        """
+        old_id = self.client.post(self.LOG_URL, self.FE_LINE, content_type='text/plain').data['result']
+        new_id = self.client.post(self.LOG_URL, self.BE_LINE, content_type='text/plain').data['result']
+        job_id = self.jobs_dao.create('archive', {})
+        progress = archiver.run(self.dao, self.jobs_dao, job_id, datetime.datetime(2014, 1, 1))
+        self.assertEqual((progress['state'], progress['total'], progress['archived'], progress['removed'],
+                          progress['segments']), ('done', 1, 1, 1, 1))
+        self.assertEqual(self.jobs_dao.get(job_id)['state'], 'done')
+        self.assertFalse(self.dao.exists(old_id))
+
+        log = self.client.get(reverse('logger-api-detail', args=[old_id])).data['result']
+        self.assertEqual((log['id'], log['api'], log['origin']), (old_id, 'payment', 'FE'))
+        ret = self.client.get(self.LOG_URL, {'from': '2013-01-01', 'to': '2014-12-31'})
+        self.assertEqual([doc['id'] for doc in ret.data['result']], [new_id, old_id])
+        self.assertEqual(self.client.get(self.LOG_URL, {'from': 'yesterday'}).status_code, 400)
+
+    @patch.object(archiver, 'start', return_value='5f4e606058d5443cbafd3f09')
+    def test_start_archive(self, mock_start):
+        """ Archive jobs start in the background, only when enabled
+        """
+        ret = APIClient().post(self.ARCHIVE_URL, {'before': '2014-01-01'}, format='json')
+        self.assertEqual(ret.status_code, 202)
+        self.assertEqual(ret.data, {'result': {'job': '5f4e606058d5443cbafd3f09'}})
+        self.assertEqual(mock_start.call_args[0][2], '2014-01-01')
+        with patch.dict(views.ARCHIVE, {'enabled': False}):
+            self.assertEqual(APIClient().post(self.ARCHIVE_URL, {}, format='json').status_code, 404)
+
+    def test_start_invalid_date(self):
+        """ Invalid dates are rejected before creating the job
+        """
+        with patch.object(self.jobs_dao, 'create') as mock_create:
+            ret = APIClient().post(self.ARCHIVE_URL, {'before': 'yesterday'}, format='json')
+        self.assertEqual(ret.status_code, 400)
+        self.assertFalse(mock_create.called)
+
+
+class ApiTraceTest(unittest.TestCase):
+    """ Per transaction traces over an in memory database
+    """
+    LOG_URL = reverse('logger-api')
+    TRACE_URL = reverse('trace-api', args=['1e246bb8-1162-46a2-93af-1da64ca9e3cb'])
+    FE_LINE = '2013/05/17T02:10:25.335 2013/05/17T02:10:25.548 Microsoft 1e246bb8-1162-46a2-93af-1da64ca9e3cb FE ' \
+              'FrontendTrustedPartner 9/18297 21407 INFOSTATS 201 ["POST /payment/v2/payments HTTP/1.0"]'
+    BE_LINE = '2013/05/17T02:10:25.400 2013/05/17T02:10:25.500 M2M 1e246bb8-1162-46a2-93af-1da64ca9e3cb BE ' \
+              'MobileId / 21407 INFOSTATS 400 [{"MobileId":{"info":{"xff":null}}}]'
+
+    def setUp(self):
+        self.client = Client()
+        dbconn = mongomock.MongoClient()['logs']
+        self.recorder = TraceRecorder()
+        start_patches(self, patch.object(views, 'dao', RequestsDao(dbconn=dbconn)),
+                            patch.object(views, 'traces_dao', TracesDao(dbconn=dbconn)),
+                            patch.object(ingest, 'trace_recorder', self.recorder),
+                            patch.dict(views.TRACES, {'enabled': True}))
+
+    def test_trace_joins_fe_and_be(self):
+        """ FE and BE logs stored in different flushes are read as one trace
+        """
+        self.assertEqual(self.client.get(self.TRACE_URL).status_code, 404)
+        be_id = self.client.post(self.LOG_URL, self.BE_LINE, content_type='text/plain').data['result']
+        views.traces_dao.flush(self.recorder.drain())
+        fe_id = self.client.post(self.LOG_URL, self.FE_LINE, content_type='text/plain').data['result']
+        views.traces_dao.flush(self.recorder.drain())
+
+        trace = self.client.get(self.TRACE_URL).data['result']
+        self.assertEqual((trace['fe']['id'], [step['id'] for step in trace['be']]), (fe_id, [be_id]))
+        self.assertEqual((trace['responseCode'], trace['duration']), ('201', 213))
+        self.assertEqual((trace['fe']['latency'], trace['be'][0]['latency']), (213, 100))
+        self.assertEqual(trace['fe']['http_request']['url'], 'payment/v2/payments')
+        with patch.dict(views.TRACES, {'enabled': False}):
+            self.assertEqual(self.client.get(self.TRACE_URL).status_code, 404)
+
+    def test_retried_flush(self):
+        """ Hops of a flush failing after it was stored are not repeated by the next flush
+        """
+        be_id = self.client.post(self.LOG_URL, self.BE_LINE, content_type='text/plain').data['result']
+        flush = views.traces_dao.flush
+
+        def lost_ack(traces):
+            flush(traces)
+            raise AutoReconnect('timed out')
+
+        with patch.object(ingest.gevent, 'sleep', side_effect=[None, StopIteration]), \
+                patch.object(views.traces_dao, 'flush', side_effect=lost_ack):
+            with self.assertRaises(StopIteration):
+                ingest._trace_flusher(views.traces_dao, self.recorder)
+        views.traces_dao.flush(self.recorder.drain())
+        trace = self.client.get(self.TRACE_URL).data['result']
+        self.assertEqual([step['id'] for step in trace['be']], [be_id])
+
+
+class ApiResponseCacheTest(unittest.TestCase):
+    """ Conditional GET and cached responses over an in memory database
+    """
+    LOG_URL = reverse('logger-api')
+    COL_URL = reverse('collection-api')
+    FE_LINE = '2013/05/17T02:10:25.335 2013/05/17T02:10:25.548 Microsoft 1e246bb8-1162-46a2-93af-1da64ca9e3cb FE ' \
+              'FrontendTrustedPartner 9/18297 21407 INFOSTATS 201 ["POST /payment/v2/payments HTTP/1.0"]'
+
+    def setUp(self):
+        self.client = Client()
+        self.apiclient = APIClient()
+        dbconn = mongomock.MongoClient()['logs']
+        self.dao = RequestsDao(dbconn=dbconn)
+        self.cache = ResponseCache(ttl=60, max_age=600)
+        start_patches(self, patch.object(views, 'dao', self.dao),
+                            patch.object(views, 'data_base', DB(dbconn=dbconn)),
+                            patch.object(views, 'response_cache', self.cache),
+                            patch.dict(views.RESPONSE_CACHE, {'enabled': True}))
+        self.client.post(self.LOG_URL, self.FE_LINE, content_type='text/plain')
+
+    def test_not_modified(self):
+        """ Polls sending the ETag or Last-Modified of the last answer get a 304 without body
+        """
+        ret = self.client.get(self.LOG_URL)
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(len(json.loads(ret.content)['result']), 1)
+        self.assertIn('Accept', ret['Vary'])
+        ret = self.client.get(self.LOG_URL, HTTP_IF_NONE_MATCH=ret['ETag'])
+        self.assertEqual((ret.status_code, ret.content), (304, ''))
+        self.assertIn('Accept', ret['Vary'])
+        ret = self.client.get(self.LOG_URL, HTTP_IF_MODIFIED_SINCE=ret['Last-Modified'])
+        self.assertEqual(ret.status_code, 304)
+        self.assertEqual(self.client.get(self.LOG_URL, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_cached_until_logs_change(self):
+        """ Repeated polls skip the query while the version holds, new and changed logs are served at once
+        """
+        with patch.object(self.dao, 'select', wraps=self.dao.select) as mock_select:
+            etag = self.client.get(self.LOG_URL)['ETag']
+            self.client.get(self.LOG_URL)
+            self.assertEqual(mock_select.call_count, 1)
+            self.cache.ttl = 0
+            for entry in self.cache.entries.values():
+                entry['expires'] = 0
+            self.assertEqual(self.client.get(self.LOG_URL, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(mock_select.call_count, 1)
+
+            log_id = self.client.post(self.LOG_URL, self.FE_LINE, content_type='text/plain').data['result']
+            ret = self.client.get(self.LOG_URL, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual((ret.status_code, len(json.loads(ret.content)['result'])), (200, 2))
+            etag = ret['ETag']
+            self.apiclient.patch(reverse('logger-api-detail', args=[log_id]), {'responseCode': '500'}, format='json')
+            ret = self.client.get(self.LOG_URL, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(ret.status_code, 200)
+            self.assertEqual(json.loads(ret.content)['result'][1]['responseCode'], '500')
+            self.assertEqual(mock_select.call_count, 3)
+
+    def test_collections_cached(self):
+        """ Collection names and counts are conditional too
+        """
+        ret = self.client.get(self.COL_URL)
+        self.assertIn('requests', json.loads(ret.content)['result'])
+        self.assertEqual(self.client.get(self.COL_URL, HTTP_IF_NONE_MATCH=ret['ETag']).status_code, 304)
+        count_url = reverse('collection-api-detail', args=['requests']) + '?count'
+        ret = self.client.get(count_url)
+        self.assertEqual(json.loads(ret.content), {'result': 1})
+        self.assertEqual(self.client.get(count_url, HTTP_IF_NONE_MATCH=ret['ETag']).status_code, 304)
+
+    def test_csrf_exempt(self):
+        """ Cached views stay CSRF exempt like the fast ingest path, cookie-less posts are accepted
+        """
+        ret = Client(enforce_csrf_checks=True).post(self.LOG_URL, self.FE_LINE, content_type='text/plain')
+        self.assertEqual(ret.status_code, 201)
+
+
+class FastJSONRendererTest(unittest.TestCase):
+    """ JSON codec renderer tests
+    """
+    def test_render_as_rest_framework(self):
+        """ Rendered logs match the rest framework JSON renderer
+        """
+        data = {"result": [{"id": 1, "requestDate": datetime.datetime(2013, 10, 11, 11, 48, 50, 860000)}]}
+        ret = FastJSONRenderer().render(data)
+        self.assertEqual(json.loads(ret), json.loads(JSONRenderer().render(data)))
+
+    def test_render_none(self):
+        """ Empty responses render nothing
+        """
+        self.assertEqual(FastJSONRenderer().render(None), bytes())
+
 
 class LogParserTest(unittest.TestCase):
     """ Test log parser module
@@ -508,3 +1680,43 @@ class LogParserTest(unittest.TestCase):
         self.assertEqual(ret['exceptionId'], 'SVR1007')
         self.assertEqual(ret['app'], 'FrontendTrustedPartner')
         self.assertEqual(ret['responseCode'], '500')
+
+
+class JSONNormalizerTest(unittest.TestCase):
+    """ JSON log normalization tests
+    """
+    JSON_LOG = {"origin": "BE", "body": [{"MobileId": {"info": {"userAgent": "Apache-HttpClient/4.1.1 (java 1.5)",
+                                                               "contentType": "application/json", "xff": None}}}],
+                "responseDate": "2013-07-30T14:10:09.154Z", "app": "MobileId", "serviceId": "",
+                "requestDate": "2013-07-30T14:10:08.617Z", "responseCode": 400, "statType": "INFOSTATS"}
+
+    def setUp(self):
+        self.normalizer = JSONNormalizer()
+
+    def test_types_as_parsed_lines(self):
+        """ Dates become datetimes and codes strings, as in parsed log lines
+        """
+        ret = self.normalizer.normalize(dict(JSONNormalizerTest.JSON_LOG))
+        self.assertEqual(ret['requestDate'], datetime.datetime(2013, 7, 30, 14, 10, 8, 617000))
+        self.assertEqual(ret['responseDate'], datetime.datetime(2013, 7, 30, 14, 10, 9, 154000))
+        self.assertEqual(ret['responseCode'], '400')
+        self.assertEqual(ret['serviceId'], '')
+
+    def test_derived_fields(self):
+        """ api, body_request and exceptionId are derived from the body when missing
+        """
+        ret = self.normalizer.normalize(dict(JSONNormalizerTest.JSON_LOG))
+        self.assertEqual(ret['api'], 'mobileid')
+        self.assertEqual(ret['body_request'], {})
+        ret = self.normalizer.normalize({"body": [{"error": {"exceptionId": "SVR1007"}}], "api": "payment"})
+        self.assertEqual(ret['exceptionId'], 'SVR1007')
+        self.assertEqual(ret['api'], 'payment')
+        ret = self.normalizer.normalize({"body": ["POST /payment/v2/payments HTTP/1.0"]})
+        self.assertEqual(ret['api'], 'payment')
+        self.assertEqual(ret['http_request']['url'], 'payment/v2/payments')
+
+    def test_unknown_fields_untouched(self):
+        """ Logs without known fields or with unknown date formats are kept as received
+        """
+        self.assertEqual(self.normalizer.normalize({"data": "datas"}), {"data": "datas"})
+        self.assertEqual(self.normalizer.normalize({"requestDate": "yesterday"}), {"requestDate": "yesterday"})
@@ -1,12 +1,31 @@
 from django.conf.urls import patterns, url
 from rest_framework.urlpatterns import format_suffix_patterns
-from .views import Logger, LoggerDetail, Collection, CollectionDetail
+from .views import Logger, LoggerDetail, LoggerBulk, LoggerSearch, LoggerTicket, LoggerTail, LoggerReprocess, \
+    LoggerReprocessJob, LoggerArchive, LoggerArchiveJob, Collection, CollectionDetail, Stats, LatencyPercentiles, \
+    HeavyHitters, Profiling, SlowOperations, SamplingTotals, Trace
 
 urlpatterns = patterns('api.views',
                        url(r'^log/$', Logger.as_view(), name='logger-api'),
                        url(r'^log/(?P<log_id>[0-9]+)/$', LoggerDetail.as_view(), name='logger-api-detail'),
+                       url(r'^log/bulk/$', LoggerBulk.as_view(), name='logger-api-bulk'),
+                       url(r'^log/search/$', LoggerSearch.as_view(), name='logger-api-search'),
+                       url(r'^log/tail/$', LoggerTail.as_view(), name='logger-api-tail'),
+                       url(r'^log/reprocess/$', LoggerReprocess.as_view(), name='logger-api-reprocess'),
+                       url(r'^log/reprocess/(?P<job_id>[0-9a-f]{24})/$', LoggerReprocessJob.as_view(),
+                           name='logger-api-reprocess-job'),
+                       url(r'^log/archive/$', LoggerArchive.as_view(), name='logger-api-archive'),
+                       url(r'^log/archive/(?P<job_id>[0-9a-f]{24})/$', LoggerArchiveJob.as_view(),
+                           name='logger-api-archive-job'),
+                       url(r'^log/ticket/(?P<ticket>[0-9a-f]{32})/$', LoggerTicket.as_view(), name='logger-api-ticket'),
                        url(r'^collection/$', Collection.as_view(), name='collection-api'),
                        url(r'^collection/(?P<name>[a-z0-9]+)/$', CollectionDetail.as_view(),
-                           name='collection-api-detail'),)
+                           name='collection-api-detail'),
+                       url(r'^stats/$', Stats.as_view(), name='stats-api'),
+                       url(r'^slow/$', SlowOperations.as_view(), name='slow-api'),
+                       url(r'^latency/$', LatencyPercentiles.as_view(), name='latency-api'),
+                       url(r'^sampling/$', SamplingTotals.as_view(), name='sampling-api'),
+                       url(r'^trace/(?P<transaction_id>[^/]+)/$', Trace.as_view(), name='trace-api'),
+                       url(r'^top/(?P<field>[a-zA-Z_]+)/$', HeavyHitters.as_view(), name='top-api'),
+                       url(r'^profiling/$', Profiling.as_view(), name='profiling-api'),)
 
 urlpatterns = format_suffix_patterns(urlpatterns)
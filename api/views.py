@@ -1,22 +1,61 @@
+import hmac
+import time
+import gevent
 import logging
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
+from rest_framework.compat import six
+from rest_framework.exceptions import ParseError, PermissionDenied
 from rest_framework.response import Response
 from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
 from rest_framework.views import APIView
 
-from .logparser import BVParser, LoggerException
-from apilog.mongo import RequestsDao, DBLogException, DB
-from pymongo.errors import DuplicateKeyError
+from .ingest import ingest, prepare_result, get_async_queue, get_spool, get_tail_buffer, get_rejected_dao
+from . import reprocess, archiver
+from apilog import jsoncodec, metrics
+from apilog.blocking import offload
+from apilog.profiling import profiler, profiled
+from apilog.httpcache import ResponseCache, headers, not_modified
+from apilog.mongo import RequestsDao, LatencyDao, HeavyHittersDao, SamplingDao, JobsDao, TracesDao, DBLogException, \
+    DB
+from apilog.settings import DEDUP, ASYNC_INGEST, SEARCH, SPOOL, LATENCY, HEAVY_HITTERS, PROFILING, TAIL, \
+    SLOW_OPERATIONS, RAW_LINES, SAMPLING, ARCHIVE, TRACES, RESPONSE_CACHE
 
 logger_api = logging.getLogger("apilog")
 dao = RequestsDao()
 data_base = DB()
-
-
-def _prepare_result(result):
-    """ Prepare result dictionary
-    """
-    return {"result": result}
+latency_dao = LatencyDao()
+heavy_hitters_dao = HeavyHittersDao()
+sampling_dao = SamplingDao()
+jobs_dao = JobsDao()
+traces_dao = TracesDao()
+response_cache = ResponseCache(RESPONSE_CACHE['ttl'], RESPONSE_CACHE['max_age'], RESPONSE_CACHE['max_entries'])
+cache_counters = metrics.counters('response_cache')
+if DEDUP['enabled']:
+    dao.ensure_transaction_index(unique=DEDUP['unique_index'])
+if SEARCH['enabled']:
+    dao.ensure_search_index()
+if LATENCY['enabled']:
+    latency_dao.ensure_index()
+if HEAVY_HITTERS['enabled']:
+    heavy_hitters_dao.ensure_index()
+if SAMPLING['enabled']:
+    sampling_dao.ensure_index()
+if TRACES['enabled']:
+    traces_dao.ensure_index(TRACES['ttl'])
+if SLOW_OPERATIONS['enabled']:
+    data_base.ensure_slow_operations()
+if RAW_LINES['enabled']:
+    get_rejected_dao().ensure_index()
+if RESPONSE_CACHE['enabled']:
+    dao.ensure_id_index()
+if SPOOL['enabled']:
+    # replay segments left by previous workers
+    get_spool(dao)
 
 
 class PlainTextParser(BaseParser):
@@ -30,51 +69,116 @@ class PlainTextParser(BaseParser):
         return stream.read()
 
 
-class Logger(APIView):
+class FastJSONParser(JSONParser):
+    """ JSON parser decoding with apilog.jsoncodec
+    """
+    def parse(self, stream, media_type=None, parser_context=None):
+        """ Return the decoded JSON request body
+        """
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            return jsoncodec.loads(stream.read().decode(encoding))
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % six.text_type(exc))
+
+
+class FastJSONRenderer(JSONRenderer):
+    """ JSON renderer encoding with apilog.jsoncodec
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """ Render data into JSON, indented requests keep the rest framework renderer
+        """
+        if data is None:
+            return bytes()
+        if accepted_media_type and 'indent' in accepted_media_type or (renderer_context or {}).get('indent'):
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        return jsoncodec.dumps(data, default=self.encoder_class().default)
+
+
+class CachedGetMixin(object):
+    """ Conditional GET and rendered responses kept by this worker, see apilog.httpcache
+    """
+    def cache_version(self, request, *args, **kwargs):
+        """ Token of the data of a GET response, None to render it again after RESPONSE_CACHE['ttl']
+        """
+        return None
+
+    # Overriding APIView.dispatch drops its csrf_exempt mark, keep the API exempt as in apilog.fastpath
+    @csrf_exempt
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET' or not RESPONSE_CACHE['enabled']:
+            return super(CachedGetMixin, self).dispatch(request, *args, **kwargs)
+        key = (request.get_full_path(), request.META.get('HTTP_ACCEPT', ''))
+        version = None
+        entry = response_cache.fresh(key)
+        if entry is None:
+            version = self.cache_version(request, *args, **kwargs)
+            entry = response_cache.get(key, version)
+        if entry is None:
+            response = super(CachedGetMixin, self).dispatch(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            response.render()
+            entry = response_cache.put(key, version, response.content, response['Content-Type'])
+            cache_counters.incr('miss')
+        else:
+            response = HttpResponse(entry['content'], content_type=entry['content_type'])
+            cache_counters.incr('hit')
+        if not_modified(entry, request.META.get('HTTP_IF_NONE_MATCH'), request.META.get('HTTP_IF_MODIFIED_SINCE')):
+            cache_counters.incr('not_modified')
+            response = HttpResponseNotModified()
+        for name, value in headers(entry).items():
+            response[name] = value
+        # entries are kept by Accept too
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+
+class Logger(CachedGetMixin, APIView):
     """ Get and post all log information
     """
     # Indicating which content-types are accepted in logger api
-    parser_classes = (JSONParser, PlainTextParser,)
+    parser_classes = (FastJSONParser, PlainTextParser,)
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer,)
+
+    def cache_version(self, request, *args, **kwargs):
+        return dao.version()
 
     def get(self, request, format=None):
         """ Return all logs in a list
+        :request query params from and to, to list the logs of a request date range newest first
         """
-        ret = [doc for doc in dao.select()]
+        params = request.QUERY_PARAMS
+        if params.get('from') or params.get('to'):
+            try:
+                ret = dao.select(date_from=params.get('from'), date_to=params.get('to'))
+            except (ValueError, TypeError, OverflowError) as exc:
+                # python-dateutil 2.2 raises TypeError for strings without any date
+                logger_api.error("Invalid log dates: {}".format(exc))
+                return Response("Invalid log dates", status=status.HTTP_400_BAD_REQUEST)
+        else:
+            ret = [doc for doc in dao.select()]
         logger_api.info(ret)
-        return Response(_prepare_result(ret), status=status.HTTP_200_OK)
+        return Response(prepare_result(ret), status=status.HTTP_200_OK)
 
+    @profiled('logger_post')
     def post(self, request, format=None):
         """ Post a list of logs
         :request data posted to store in data base
         """
-        data = request.DATA
-        if data:
-            try:
-                if isinstance(data, dict):
-                    # direct insert in db
-                    logger_api.info("Data inserted directly {}".format(data))
-                    return Response(_prepare_result(dao.insert(data)), status=status.HTTP_201_CREATED)
-                else:
-                    parser = BVParser()
-                    try:
-                        return Response(_prepare_result(dao.insert(parser.parse_log(data))),
-                                        status=status.HTTP_201_CREATED)
-                    except LoggerException as e:
-                        logger_api.error("POST error: {}".format(e.value))
-                        return Response(e.value, status=status.HTTP_400_BAD_REQUEST)
-            except DuplicateKeyError as dex:
-                logger_api.error("Duplicate key error {}".format(dex.message))
-                return Response(dex.message, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            logger_api.error("Received data is empty")
-            return Response("Received data is empty", status=status.HTTP_400_BAD_REQUEST)
+        data, status_code = ingest(dao, request.DATA)
+        if status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+            return Response(data, status=status_code, headers={'Retry-After': str(data['retry_after'])})
+        return Response(data, status=status_code)
 
 
 class LoggerDetail(APIView):
     """ Logger detail api
     """
     # Indicating which content-types are accepted in logger api
-    parser_classes = (JSONParser, PlainTextParser,)
+    parser_classes = (FastJSONParser, PlainTextParser,)
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer,)
 
     def delete(self, request, log_id, format=None):
         """ Delete log
@@ -87,12 +191,13 @@ class LoggerDetail(APIView):
             logger_api.error("Unknown log {} to delete".format(log_id))
             return Response("Unknown log {} to delete".format(log_id), status=status.HTTP_404_NOT_FOUND)
 
+    @profiled('logger_detail_get')
     def get(self, request, log_id, format=None):
         """ Retrieve log information from received id
         :log_id: id from log to be retrieved
         """
         try:
-            return Response(_prepare_result(dao.select(log_id)), status=status.HTTP_200_OK)
+            return Response(prepare_result(dao.select(log_id)), status=status.HTTP_200_OK)
         except DBLogException as dbex:
             logger_api.error("DB error: {}".format(dbex.value))
             return Response(dbex.value, status=status.HTTP_404_NOT_FOUND)
@@ -112,8 +217,315 @@ class LoggerDetail(APIView):
             logger_api.error("Received data is empty")
             return Response("Received data is empty", status=status.HTTP_400_BAD_REQUEST)
 
+    def patch(self, request, log_id, format=None):
+        """ Partially update log data in database from log_id
+        :request data with set (fields to change), unset (fields to remove) and expected (values the stored
+        log must have). Any other dict is taken as the fields to set
+        """
+        data = request.DATA
+        if data and isinstance(data, dict):
+            if any(key in data for key in ('set', 'unset', 'expected')):
+                fields, unset, expected = data.get('set'), data.get('unset'), data.get('expected')
+            else:
+                fields, unset, expected = data, None, None
+            try:
+                result = dao.patch_doc(log_id, fields=fields, unset=unset, expected=expected)
+            except DBLogException as dbex:
+                logger_api.error("Patch error: {}".format(dbex.value))
+                return Response(dbex.value, status=status.HTTP_400_BAD_REQUEST)
+            if result['updatedExisting']:
+                return Response("Log {} updated correctly".format(log_id), status=status.HTTP_200_OK)
+            elif expected and dao.exists(log_id):
+                logger_api.error("Log {} does not match expected values".format(log_id))
+                return Response("Log {} does not match expected values".format(log_id),
+                                status=status.HTTP_412_PRECONDITION_FAILED)
+            else:
+                logger_api.error("Unknown log {} to update".format(log_id))
+                return Response("Unknown log {} to update".format(log_id), status=status.HTTP_404_NOT_FOUND)
+        else:
+            logger_api.error("Received data is empty")
+            return Response("Received data is empty", status=status.HTTP_400_BAD_REQUEST)
+
+
+class LoggerSearch(APIView):
+    """ Log search api
+    """
+    def get(self, request, format=None):
+        """ Return logs whose exception text, request body or url contain every word of q
+        :request query params q, from and to (request date range) and limit
+        """
+        params = request.QUERY_PARAMS
+        if not params.get('q'):
+            logger_api.error("Received search text is empty")
+            return Response("Received search text is empty", status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(params.get('limit', SEARCH['default_results'])), SEARCH['max_results'])
+            ret = [doc for doc in dao.search(params['q'], date_from=params.get('from'), date_to=params.get('to'),
+                                             limit=limit)]
+            return Response(prepare_result(ret), status=status.HTTP_200_OK)
+        except (ValueError, TypeError, OverflowError) as exc:
+            # python-dateutil 2.2 raises TypeError for strings without any date
+            logger_api.error("Invalid search parameters: {}".format(exc))
+            return Response("Invalid search parameters", status=status.HTTP_400_BAD_REQUEST)
+        except DBLogException as dbex:
+            logger_api.error("Search error: {}".format(dbex.value))
+            return Response(dbex.value, status=status.HTTP_400_BAD_REQUEST)
+
+
+class LatencyPercentiles(APIView):
+    """ Latency percentiles api
+    """
+    QUANTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))
+
+    def get(self, request, format=None):
+        """ Return count, mean and p50/p90/p99 latency in milliseconds of the matching logs
+        :request query params api, app, origin, from and to (time bucket range)
+        """
+        params = request.QUERY_PARAMS
+        try:
+            sketch = latency_dao.sketch(date_from=params.get('from'), date_to=params.get('to'),
+                                        relative_accuracy=LATENCY['relative_accuracy'], api=params.get('api'),
+                                        app=params.get('app'), origin=params.get('origin'))
+        except (ValueError, TypeError, OverflowError) as exc:
+            # python-dateutil 2.2 raises TypeError for strings without any date
+            logger_api.error("Invalid latency parameters: {}".format(exc))
+            return Response("Invalid latency parameters", status=status.HTTP_400_BAD_REQUEST)
+        ret = dict((name, sketch.quantile(fraction)) for name, fraction in LatencyPercentiles.QUANTILES)
+        ret['count'] = sketch.count
+        ret['mean'] = sketch.total / sketch.count if sketch.count else None
+        return Response(prepare_result(ret), status=status.HTTP_200_OK)
 
-class Collection(APIView):
+
+class SamplingTotals(APIView):
+    """ Received and stored log counts api
+    """
+    def get(self, request, format=None):
+        """ Return received and stored logs by api, app and responseCode, with the overall totals
+        :request query params api, app, responseCode, from and to (time bucket range)
+        """
+        params = request.QUERY_PARAMS
+        try:
+            totals = sampling_dao.totals(date_from=params.get('from'), date_to=params.get('to'), api=params.get('api'),
+                                         app=params.get('app'), responseCode=params.get('responseCode'))
+        except (ValueError, TypeError, OverflowError) as exc:
+            # python-dateutil 2.2 raises TypeError for strings without any date
+            logger_api.error("Invalid sampling parameters: {}".format(exc))
+            return Response("Invalid sampling parameters", status=status.HTTP_400_BAD_REQUEST)
+        ret = {'received': sum(total['received'] for total in totals), 'kept': sum(total['kept'] for total in totals),
+               'totals': totals}
+        return Response(prepare_result(ret), status=status.HTTP_200_OK)
+
+
+class Trace(APIView):
+    """ Transaction trace api
+    """
+    def get(self, request, transaction_id, format=None):
+        """ Return the FE and BE hops of a transaction with its duration and final responseCode
+        :transaction_id: transactionId of the logs
+        """
+        if not TRACES['enabled']:
+            return Response("Traces are disabled", status=status.HTTP_404_NOT_FOUND)
+        trace = traces_dao.get(transaction_id)
+        if trace is None:
+            logger_api.error("Unknown transaction {}".format(transaction_id))
+            return Response("Unknown transaction {}".format(transaction_id), status=status.HTTP_404_NOT_FOUND)
+        return Response(prepare_result(trace), status=status.HTTP_200_OK)
+
+
+class HeavyHitters(APIView):
+    """ Most frequent values api
+    """
+    def get(self, request, field, format=None):
+        """ Return the most frequent values of a tracked field with their count and max error
+        :field: tracked field, failed_<field> for failure fields
+        :request query params from and to (time bucket range) and limit
+        """
+        params = request.QUERY_PARAMS
+        tracked = list(HEAVY_HITTERS['fields']) + ['failed_' + name for name in HEAVY_HITTERS['failure_fields']]
+        if field not in tracked:
+            logger_api.error("Field {} is not tracked".format(field))
+            return Response("Field {} is not tracked".format(field), status=status.HTTP_404_NOT_FOUND)
+        try:
+            limit = min(int(params.get('limit', HEAVY_HITTERS['default_results'])), HEAVY_HITTERS['max_results'])
+            top = heavy_hitters_dao.top(field, date_from=params.get('from'), date_to=params.get('to'), limit=limit,
+                                        capacity=HEAVY_HITTERS['capacity'])
+        except (ValueError, TypeError, OverflowError) as exc:
+            # python-dateutil 2.2 raises TypeError for strings without any date
+            logger_api.error("Invalid heavy hitters parameters: {}".format(exc))
+            return Response("Invalid heavy hitters parameters", status=status.HTTP_400_BAD_REQUEST)
+        ret = [{'value': value, 'count': count, 'min_count': count - error, 'error': error}
+               for value, count, error in top]
+        return Response(prepare_result(ret), status=status.HTTP_200_OK)
+
+
+class LoggerTicket(APIView):
+    """ Asynchronous ingest ticket api
+    """
+    def get(self, request, ticket, format=None):
+        """ Return whether a queued log was stored (with its id) or rejected (with the reason)
+        :ticket: ticket returned when the log was posted
+        """
+        if not ASYNC_INGEST['enabled']:
+            return Response("Asynchronous ingest is disabled", status=status.HTTP_404_NOT_FOUND)
+        result = offload(get_async_queue(dao).status, ticket)
+        if result:
+            return Response(prepare_result(result), status=status.HTTP_200_OK)
+        else:
+            logger_api.error("Unknown ticket {}".format(ticket))
+            return Response("Unknown ticket {}".format(ticket), status=status.HTTP_404_NOT_FOUND)
+
+
+class LoggerReprocess(APIView):
+    """ Reprocess api of stored raw lines with the current parser
+    """
+    def post(self, request, format=None):
+        """ Start a job reparsing logs of a request date range and lines rejected in that range
+        :request data from and to, both optional
+        """
+        if not RAW_LINES['enabled']:
+            return Response("Raw lines are not stored", status=status.HTTP_404_NOT_FOUND)
+        data = request.DATA if isinstance(request.DATA, dict) else {}
+        try:
+            job_id = reprocess.start(dao, get_rejected_dao(), jobs_dao, data.get('from'), data.get('to'))
+        except ValueError as exc:
+            logger_api.error("Invalid reprocess dates: {}".format(exc))
+            return Response("Invalid reprocess dates", status=status.HTTP_400_BAD_REQUEST)
+        logger_api.info("Reprocess job {0} started for {1}".format(job_id, data))
+        return Response(prepare_result({"job": job_id}), status=status.HTTP_202_ACCEPTED)
+
+
+class LoggerReprocessJob(APIView):
+    """ Reprocess job progress api
+    """
+    def get(self, request, job_id, format=None):
+        """ Return the state, counts, throughput and estimated seconds left of a job
+        :job_id: job returned when the reprocess was started
+        """
+        job = jobs_dao.get(job_id)
+        if job is None:
+            return Response("Unknown job {}".format(job_id), status=status.HTTP_404_NOT_FOUND)
+        return Response(prepare_result(job), status=status.HTTP_200_OK)
+
+
+class LoggerArchive(APIView):
+    """ Archive api moving old logs to local segment files
+    """
+    def post(self, request, format=None):
+        """ Start a job archiving logs of request dates before a date
+        :request data before, ARCHIVE['max_age_days'] ago when missing
+        """
+        if not ARCHIVE['enabled']:
+            return Response("Archive is disabled", status=status.HTTP_404_NOT_FOUND)
+        data = request.DATA if isinstance(request.DATA, dict) else {}
+        try:
+            job_id = archiver.start(dao, jobs_dao, data.get('before'))
+        except ValueError as exc:
+            logger_api.error("Invalid archive date: {}".format(exc))
+            return Response("Invalid archive date", status=status.HTTP_400_BAD_REQUEST)
+        logger_api.info("Archive job {0} started for {1}".format(job_id, data))
+        return Response(prepare_result({"job": job_id}), status=status.HTTP_202_ACCEPTED)
+
+
+class LoggerArchiveJob(LoggerReprocessJob):
+    """ Archive job progress api
+    """
+
+
+class LoggerTail(APIView):
+    """ Live tail api over the logs stored by every worker of the host
+    """
+    def get(self, request, format=None):
+        """ Return logs stored after cursor, waiting up to timeout seconds for them
+        :request query params cursor (from the previous answer, omit it to get the last logs), api, app,
+        responseCode, timeout and limit
+        """
+        if not TAIL['enabled']:
+            return Response("Live tail is disabled", status=status.HTTP_404_NOT_FOUND)
+        params = request.QUERY_PARAMS
+        try:
+            since = int(params['cursor']) if params.get('cursor') else None
+            timeout = min(float(params.get('timeout', TAIL['timeout'])), TAIL['timeout'])
+            limit = min(int(params.get('limit', TAIL['default_results'])), TAIL['max_results'])
+        except ValueError as exc:
+            logger_api.error("Invalid tail parameters: {}".format(exc))
+            return Response("Invalid tail parameters", status=status.HTTP_400_BAD_REQUEST)
+        buffer = get_tail_buffer()
+        filters = dict((field, params.get(field)) for field in ('api', 'app', 'responseCode'))
+        deadline = time.time() + timeout
+        cursor, logs = offload(buffer.read, since, limit, **filters)
+        while not logs and since is not None and time.time() < deadline:
+            gevent.sleep(TAIL['poll_interval'])
+            cursor, logs = offload(buffer.read, since, limit, **filters)
+        return Response(prepare_result({"cursor": cursor, "logs": logs}), status=status.HTTP_200_OK)
+
+
+class LoggerBulk(APIView):
+    """ Bulk operations over logs selected by a filter
+    """
+    parser_classes = (FastJSONParser,)
+
+    @staticmethod
+    def _options(data):
+        """ Chunk size and throttle of a bulk request
+        :raises ValueError, TypeError or OverflowError if any of them is invalid
+        :return tuple with chunk_size and throttle, None when not received
+        """
+        chunk_size = data.get('chunk_size')
+        throttle = data.get('throttle')
+        if chunk_size is not None:
+            chunk_size = int(chunk_size)
+            if chunk_size <= 0:
+                raise ValueError("chunk_size must be positive")
+        if throttle is not None:
+            throttle = float(throttle)
+            if not 0 <= throttle < float('inf'):
+                raise ValueError("throttle must be zero or positive")
+        return chunk_size, throttle
+
+    def delete(self, request, format=None):
+        """ Delete every log matching the received filter
+        :request data with filter and optional chunk_size and throttle
+        """
+        data = request.DATA
+        if isinstance(data, dict) and data.get('filter'):
+            try:
+                chunk_size, throttle = self._options(data)
+            except (ValueError, TypeError, OverflowError) as exc:
+                logger_api.error("Invalid bulk options: {}".format(exc))
+                return Response("Invalid bulk options", status=status.HTTP_400_BAD_REQUEST)
+            try:
+                result = dao.bulk_delete(data['filter'], chunk_size=chunk_size, throttle=throttle)
+                return Response(prepare_result(result), status=status.HTTP_200_OK)
+            except DBLogException as dbex:
+                logger_api.error("Bulk delete error: {}".format(dbex.value))
+                return Response(dbex.value, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            logger_api.error("Received bulk filter is empty")
+            return Response("Received bulk filter is empty", status=status.HTTP_400_BAD_REQUEST)
+
+    def put(self, request, format=None):
+        """ Update every log matching the received filter
+        :request data with filter, update and optional chunk_size and throttle
+        """
+        data = request.DATA
+        if isinstance(data, dict) and data.get('filter') and data.get('update'):
+            try:
+                chunk_size, throttle = self._options(data)
+            except (ValueError, TypeError, OverflowError) as exc:
+                logger_api.error("Invalid bulk options: {}".format(exc))
+                return Response("Invalid bulk options", status=status.HTTP_400_BAD_REQUEST)
+            try:
+                result = dao.bulk_update(data['filter'], data['update'], chunk_size=chunk_size, throttle=throttle)
+                return Response(prepare_result(result), status=status.HTTP_200_OK)
+            except DBLogException as dbex:
+                logger_api.error("Bulk update error: {}".format(dbex.value))
+                return Response(dbex.value, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            logger_api.error("Received bulk filter or update is empty")
+            return Response("Received bulk filter or update is empty", status=status.HTTP_400_BAD_REQUEST)
+
+
+class Collection(CachedGetMixin, APIView):
     """ Database collection api
     """
     def delete(self, request):
@@ -123,14 +535,28 @@ class Collection(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def get(self, request, format=None):
-        """ Return all collection names from database
+        """ Return all collection names from database, or storage stats by collection name with stats
         """
-        return Response(_prepare_result(data_base.get_collection_names()), status=status.HTTP_200_OK)
+        names = data_base.get_collection_names()
+        if 'stats' in request.QUERY_PARAMS:
+            ret = {}
+            for name in names:
+                try:
+                    ret[name] = data_base.stats(name)
+                except DBLogException as dbex:
+                    # dropped meanwhile
+                    logger_api.error("Collection stats error: {}".format(dbex.value))
+            return Response(prepare_result(ret), status=status.HTTP_200_OK)
+        return Response(prepare_result(names), status=status.HTTP_200_OK)
 
 
-class CollectionDetail(APIView):
+class CollectionDetail(CachedGetMixin, APIView):
     """ Detailed data collection class
     """
+    def cache_version(self, request, name, *args, **kwargs):
+        # other collections change without the api, and storage stats without new logs
+        return dao.version() if name == dao.coll and 'stats' not in request.GET else None
+
     def delete(self, request, name):
         """ Delete requested collection from database
         :name: collection name to be deleted
@@ -139,10 +565,80 @@ class CollectionDetail(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def get(self, request, name):
-        """ Return collection name options or count
+        """ Return collection name options, count or storage stats
         :name: collection name
         """
         if 'count' in request.QUERY_PARAMS:
-            return Response(_prepare_result(data_base.count(name)), status=status.HTTP_200_OK)
+            return Response(prepare_result(data_base.count(name)), status=status.HTTP_200_OK)
+        elif 'stats' in request.QUERY_PARAMS:
+            try:
+                return Response(prepare_result(data_base.stats(name)), status=status.HTTP_200_OK)
+            except DBLogException as dbex:
+                logger_api.error("Collection stats error: {}".format(dbex.value))
+                return Response(dbex.value, status=status.HTTP_404_NOT_FOUND)
         else:
-            return Response(_prepare_result(data_base.get_option(name)), status=status.HTTP_200_OK)
+            return Response(prepare_result(data_base.get_option(name)), status=status.HTTP_200_OK)
+
+
+class SlowOperations(APIView):
+    """ Slow reads of the requests collection recorded by every worker
+    """
+    def get(self, request, format=None):
+        """ Return the last slow operations with their query plan summary, newest first
+        :request query param limit
+        """
+        if not SLOW_OPERATIONS['enabled']:
+            return Response("Slow operations log is disabled", status=status.HTTP_404_NOT_FOUND)
+        try:
+            limit = min(int(request.QUERY_PARAMS.get('limit', SLOW_OPERATIONS['default_results'])),
+                        SLOW_OPERATIONS['max_results'])
+        except ValueError:
+            return Response("Invalid limit", status=status.HTTP_400_BAD_REQUEST)
+        return Response(prepare_result(list(data_base.slow_operations(limit))), status=status.HTTP_200_OK)
+
+
+class Profiling(APIView):
+    """ Profiling api of the worker answering the request
+    """
+    def initial(self, request, *args, **kwargs):
+        super(Profiling, self).initial(request, *args, **kwargs)
+        token = request.META.get('HTTP_X_PROFILING_TOKEN', '')
+        if not PROFILING['token'] or not hmac.compare_digest(str(token), str(PROFILING['token'])):
+            raise PermissionDenied()
+
+    def get(self, request, format=None):
+        """ Return whether profiling is enabled, its sample rate and pending profiles
+        """
+        return Response(prepare_result(profiler.status()), status=status.HTTP_200_OK)
+
+    def post(self, request, format=None):
+        """ Enable or disable profiling
+        :request data enabled and optional positive sample_rate, disabling dumps pending profiles
+        """
+        data = request.DATA if isinstance(request.DATA, dict) else {}
+        if 'enabled' not in data:
+            return Response("Received profiling data has no enabled field", status=status.HTTP_400_BAD_REQUEST)
+        if data['enabled']:
+            try:
+                sample_rate = int(data.get('sample_rate') or 0)
+            except (ValueError, TypeError):
+                sample_rate = -1
+            if sample_rate < 0:
+                logger_api.error("Invalid sample_rate {}".format(data.get('sample_rate')))
+                return Response("Invalid sample_rate", status=status.HTTP_400_BAD_REQUEST)
+            profiler.enable(sample_rate or None)
+            ret = profiler.status()
+        else:
+            ret = profiler.status()
+            ret['dumped'] = profiler.disable()
+        logger_api.info("Profiling {}".format(ret))
+        return Response(prepare_result(ret), status=status.HTTP_200_OK)
+
+
+class Stats(APIView):
+    """ Worker counters api
+    """
+    def get(self, request, format=None):
+        """ Return counters of this worker by component
+        """
+        return Response(prepare_result(metrics.snapshot()), status=status.HTTP_200_OK)
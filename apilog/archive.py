@@ -0,0 +1,134 @@
+""" Local compressed segment files of logs moved out of the requests collection
+
+A segment holds logs ordered by requestDate as zlib compressed BSON documents. Its index file keeps the id, requestDate
+and api of every log plus their bounds, so reads only decompress segments holding the logs asked for. Both files are
+written under a temporary name and renamed, the index last, so segments without an index are never read.
+"""
+import os
+import zlib
+import datetime
+import bson
+from bson import BSON
+from dateutil.tz import tzutc
+
+SEGMENT = '.seg'
+INDEX = '.idx'
+TMP = '.tmp'
+
+
+def _date(doc):
+    value = doc.get('requestDate')
+    return value.replace(tzinfo=None) if isinstance(value, datetime.datetime) else datetime.datetime.min
+
+
+def _naive(value):
+    return value.astimezone(tzutc()).replace(tzinfo=None) if value and value.tzinfo else value
+
+
+def _write(path, data):
+    with open(path + TMP, 'wb') as output:
+        output.write(data)
+        output.flush()
+        os.fsync(output.fileno())
+    os.rename(path + TMP, path)
+
+
+class Archive(object):
+    """ Directory of segment files with their indexes
+    """
+    def __init__(self, directory, compress_level=6):
+        """
+        :directory: where segment files are written
+        :compress_level: zlib level of segments
+        """
+        self.directory = directory
+        self.compress_level = compress_level
+        # Bounds of every segment by name, reloaded when the directory changes
+        self.bounds = {}
+        self.loaded = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def write(self, docs):
+        """ Store logs in a new segment
+        :docs: full documents with their id
+        :return segment name
+        """
+        docs = sorted(docs, key=lambda doc: (_date(doc), doc['id']))
+        ids = [doc['id'] for doc in docs]
+        dates = [_date(doc) for doc in docs]
+        name = '{0}-{1:012d}-{2}'.format(dates[0].strftime('%Y%m%dT%H%M%S%f'), min(ids), os.getpid())
+        index = {'count': len(docs), 'id_min': min(ids), 'id_max': max(ids), 'date_min': dates[0],
+                 'date_max': dates[-1], 'apis': sorted(set(unicode(doc.get('api')) for doc in docs)),
+                 'entries': [[doc['id'], date, doc.get('api')] for doc, date in zip(docs, dates)]}
+        _write(os.path.join(self.directory, name + SEGMENT),
+               zlib.compress(''.join(BSON.encode(doc) for doc in docs), self.compress_level))
+        _write(os.path.join(self.directory, name + INDEX), BSON.encode(index))
+        self.loaded = None
+        return name
+
+    def _read_index(self, name):
+        with open(os.path.join(self.directory, name + INDEX), 'rb') as index:
+            return BSON(index.read()).decode(tz_aware=False)
+
+    def _read_segment(self, name):
+        with open(os.path.join(self.directory, name + SEGMENT), 'rb') as segment:
+            return bson.decode_all(zlib.decompress(segment.read()), dict, False)
+
+    def segments(self):
+        """ Bounds of every indexed segment by name, oldest first
+        """
+        mtime = os.stat(self.directory).st_mtime
+        if mtime != self.loaded:
+            names = set(name[:-len(INDEX)] for name in os.listdir(self.directory) if name.endswith(INDEX))
+            bounds = dict((name, self.bounds[name]) for name in names if name in self.bounds)
+            for name in names - set(bounds):
+                index = self._read_index(name)
+                index.pop('entries')
+                bounds[name] = index
+            self.bounds, self.loaded = bounds, mtime
+        return sorted(self.bounds.items())
+
+    def find(self, log_id):
+        """ Archived log by id
+        :return doc or None
+        """
+        for name, bounds in self.segments():
+            if not bounds['id_min'] <= log_id <= bounds['id_max']:
+                continue
+            positions = [position for position, entry in enumerate(self._read_index(name)['entries'])
+                         if entry[0] == log_id]
+            if positions:
+                return self._read_segment(name)[positions[0]]
+        return None
+
+    def find_range(self, date_from=None, date_to=None, limit=50, api=None, exclude=()):
+        """ Archived logs of a request date range, newest first
+        :date_from: min request date, naive utc datetime
+        :date_to: max request date
+        :limit: max logs returned
+        :api: only logs of this api
+        :exclude: ids not returned, e.g. found in mongo
+        :return list of docs
+        """
+        date_from, date_to = _naive(date_from), _naive(date_to)
+        matches = []
+        for name, bounds in self.segments():
+            if date_from and bounds['date_max'] < date_from or date_to and bounds['date_min'] > date_to or \
+                    api is not None and unicode(api) not in bounds['apis']:
+                continue
+            for position, (log_id, date, log_api) in enumerate(self._read_index(name)['entries']):
+                if (not date_from or date >= date_from) and (not date_to or date <= date_to) and \
+                        (api is None or log_api == api):
+                    matches.append((date, log_id, name, position))
+        # segments of different shards overlap in time
+        matches.sort(reverse=True)
+        seen, selected = set(exclude), []
+        for date, log_id, name, position in matches:
+            if len(selected) >= limit:
+                break
+            if log_id not in seen:
+                seen.add(log_id)
+                selected.append((name, position))
+        segments = dict((name, self._read_segment(name)) for name in set(name for name, _ in selected))
+        return [segments[name][position] for name, position in selected]
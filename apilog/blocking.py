@@ -0,0 +1,25 @@
+""" Blocking sqlite calls run in the native threadpool of the gevent hub
+
+sqlite3 releases the GIL while it waits on a lock, commits or fsyncs, but not the gevent hub, so a BEGIN IMMEDIATE
+waiting for another worker stalls every greenlet of this one. Offloaded calls run in a native thread instead while
+only the calling greenlet waits. Calls of the same object run one at a time, as its connection is shared and a sqlite
+transaction cannot be interleaved.
+"""
+import weakref
+import gevent
+from gevent.lock import Semaphore
+
+_locks = weakref.WeakKeyDictionary()
+
+
+def offload(method, *args, **kwargs):
+    """ Run a bound method in the threadpool, after any other offloaded call of its object
+    :method: bound method of a sqlite backed object
+    :return method result, its exceptions are raised in the calling greenlet
+    """
+    target = method.__self__
+    lock = _locks.get(target)
+    if lock is None:
+        lock = _locks[target] = Semaphore()
+    with lock:
+        return gevent.get_hub().threadpool.apply(method, args, kwargs)
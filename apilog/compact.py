@@ -0,0 +1,207 @@
+""" Compact storage representation of request logs
+
+Long field names are stored as short keys, numeric codes (responseCode, serviceId, appId, ob) as integers,
+low cardinality strings (domain, origin, app, api, statType) as integer codes of a shared dictionary, and the raw
+body may be dropped or zlib compressed. Documents and queries are translated back and forth by Codec.
+"""
+import zlib
+import json
+from bson.binary import Binary
+
+KEYS = {
+    'transactionId': 't',
+    'requestDate': 'rq',
+    'responseDate': 'rs',
+    'responseCode': 'c',
+    'serviceId': 'sv',
+    'appId': 'ai',
+    'ob': 'ob',
+    'domain': 'd',
+    'origin': 'o',
+    'app': 'a',
+    'api': 'p',
+    'statType': 'st',
+    'body': 'b',
+    'body_request': 'br',
+    'http_request': 'h',
+    'exceptionId': 'e',
+    'search_tokens': 'tk',
+    'raw_line': 'rl',
+    'parserVersion': 'pv',
+}
+FIELDS = dict((key, field) for field, key in KEYS.items())
+INTEGER_FIELDS = ('responseCode', 'serviceId', 'appId', 'ob')
+DICTIONARY_FIELDS = ('domain', 'origin', 'app', 'api', 'statType')
+# Code of values missing from the dictionary, never matches a stored log
+UNKNOWN_CODE = -1
+
+
+def pack_line(line):
+    """ Compressed raw log line to store
+    """
+    if isinstance(line, unicode):
+        line = line.encode('utf-8')
+    return Binary(zlib.compress(line))
+
+
+def unpack_line(value):
+    """ Raw log line from a stored one
+    """
+    return zlib.decompress(value).decode('utf-8')
+
+
+class MemoryDictionary(object):
+    """ Per process dictionary, for tests and size reports
+    """
+    def __init__(self):
+        self.codes = {}
+        self.values = {}
+
+    def code(self, field, value, allocate=True):
+        codes = self.codes.setdefault(field, {})
+        if value not in codes:
+            if not allocate:
+                return UNKNOWN_CODE
+            codes[value] = len(codes)
+            self.values.setdefault(field, {})[codes[value]] = value
+        return codes[value]
+
+    def value(self, field, code):
+        return self.values.get(field, {}).get(code)
+
+
+class MongoDictionary(MemoryDictionary):
+    """ Dictionary shared by every worker through a mongo collection, cached in process
+    """
+    def __init__(self, dbconn, coll='dictionary'):
+        super(MongoDictionary, self).__init__()
+        self.dbconn = dbconn
+        self.dbcoll = dbconn[coll]
+
+    def _cache(self, field, value, code):
+        self.codes.setdefault(field, {})[value] = code
+        self.values.setdefault(field, {})[code] = value
+        return code
+
+    def code(self, field, value, allocate=True):
+        codes = self.codes.get(field, {})
+        if value in codes:
+            return codes[value]
+        key = u'{0}:{1}'.format(field, value)
+        entry = self.dbcoll.find_one({'_id': key})
+        if entry is None and not allocate:
+            return UNKNOWN_CODE
+        if entry is None:
+            counter = self.dbconn['ids'].find_and_modify(query={'_id': 'dictionary.' + field},
+                                                         update={'$inc': {'val': 1}}, upsert=True, w=1, new=True)
+            # a concurrent worker may have registered the value first, its code wins
+            entry = self.dbcoll.find_and_modify(query={'_id': key},
+                                                update={'$setOnInsert': {'field': field, 'value': value,
+                                                                         'code': counter['val']}},
+                                                upsert=True, w=1, new=True)
+        return self._cache(field, value, entry['code'])
+
+    def value(self, field, code):
+        cached = super(MongoDictionary, self).value(field, code)
+        if cached is not None:
+            return cached
+        entry = self.dbcoll.find_one({'field': field, 'code': code})
+        return self._cache(field, entry['value'], code) if entry else None
+
+
+class Codec(object):
+    """ Translate logs and queries between the full and the compact schema
+    """
+    def __init__(self, dictionary, raw_body='keep'):
+        """
+        :dictionary: MemoryDictionary or MongoDictionary
+        :raw_body: keep, drop or compress the raw body
+        """
+        self.dictionary = dictionary
+        self.raw_body = raw_body
+
+    def key(self, field):
+        """ Stored key of a field, dotted paths keep their inner keys
+        """
+        head, dot, tail = field.partition('.')
+        return KEYS.get(head, head) + dot + tail
+
+    def encode_value(self, field, value, allocate=True):
+        """ Stored representation of a field value
+        :allocate: register unknown dictionary values, False when translating queries
+        """
+        if field in INTEGER_FIELDS and isinstance(value, basestring) and value.isdigit() and \
+                (value == '0' or not value.startswith('0')):
+            return int(value)
+        if field in DICTIONARY_FIELDS and isinstance(value, basestring):
+            return self.dictionary.code(field, value, allocate)
+        if field == 'body' and self.raw_body == 'compress' and value is not None:
+            return Binary(zlib.compress(json.dumps(value)))
+        return value
+
+    def decode_value(self, field, value):
+        """ Original representation of a stored field value
+        """
+        if field in INTEGER_FIELDS and isinstance(value, (int, long)):
+            return str(value)
+        if field in DICTIONARY_FIELDS and isinstance(value, (int, long)):
+            return self.dictionary.value(field, value)
+        if field == 'body' and isinstance(value, Binary):
+            return json.loads(zlib.decompress(value))
+        return value
+
+    def encode(self, doc):
+        """ Compact document to store
+        """
+        compact = {}
+        for field, value in doc.items():
+            if field == 'body' and self.raw_body == 'drop':
+                continue
+            compact[self.key(field)] = self.encode_value(field, value)
+        return compact
+
+    def decode(self, compact):
+        """ Full document from a stored one
+        """
+        return dict((FIELDS.get(key, key), self.decode_value(FIELDS.get(key, key), value))
+                    for key, value in compact.items())
+
+    def encode_fields(self, fields):
+        """ Fields to set in an update
+        """
+        return dict((self.key(field), value if '.' in field else self.encode_value(field, value))
+                    for field, value in fields.items())
+
+    def encode_update(self, update):
+        """ Update operators over stored documents
+        """
+        return dict((operator, self.encode_fields(fields) if operator == '$set' else
+                     dict((self.key(field), value) for field, value in fields.items()))
+                    for operator, fields in update.items())
+
+    def encode_query(self, query):
+        """ Query over stored documents from a query over full documents
+        """
+        if isinstance(query, list):
+            return [self.encode_query(item) for item in query]
+        if not isinstance(query, dict):
+            return query
+        encoded = {}
+        for field, condition in query.items():
+            if field.startswith('$'):
+                encoded[field] = self.encode_query(condition)
+            else:
+                encoded[self.key(field)] = self._encode_condition(field, condition)
+        return encoded
+
+    def _encode_condition(self, field, condition):
+        if isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition):
+            return dict((operator, [self.encode_value(field, item, allocate=False) for item in operand]
+                         if isinstance(operand, list) else self.encode_value(field, operand, allocate=False))
+                        for operator, operand in condition.items())
+        return self.encode_value(field, condition, allocate=False)
+
+    def encode_projection(self, projection):
+        """ Projection over stored documents
+        """
+        return dict((self.key(field), value) for field, value in projection.items())
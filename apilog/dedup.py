@@ -0,0 +1,77 @@
+""" Time windowed probabilistic filter of already seen keys
+
+Used to spot duplicated log deliveries before reaching mongo. Memory is fixed per worker: two bloom filter
+generations of half the budget each, the older one being dropped every window, so a key is remembered between one
+and two windows. A positive answer may be a false positive and has to be confirmed against the database.
+"""
+import time
+import struct
+import hashlib
+
+
+class BloomFilter(object):
+    """ Fixed size bloom filter
+    """
+    def __init__(self, size_bits, hashes):
+        self.size_bits = max(8, size_bits - size_bits % 8)
+        self.hashes = hashes
+        self.bits = bytearray(self.size_bits // 8)
+
+    def _positions(self, key):
+        """ Bit positions of key, double hashing over a md5 digest
+        """
+        first, second = struct.unpack('<QQ', hashlib.md5(key).digest())
+        return [(first + i * second) % self.size_bits for i in range(self.hashes)]
+
+    def add(self, key):
+        """ Add key to the filter
+        :return True if key was probably already present
+        """
+        present = True
+        for position in self._positions(key):
+            mask = 1 << (position % 8)
+            if not self.bits[position // 8] & mask:
+                present = False
+                self.bits[position // 8] |= mask
+        return present
+
+    def __contains__(self, key):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(key))
+
+
+class DedupFilter(object):
+    """ Remember keys seen during the last window seconds within a memory budget
+    """
+    def __init__(self, window, memory, hashes, clock=time.time):
+        """
+        :window: seconds a key is remembered at least
+        :memory: bytes used by the filter
+        :hashes: hash functions per key
+        :clock: time source
+        """
+        self.window = window
+        self.hashes = hashes
+        self.generation_bits = memory * 8 // 2
+        self.clock = clock
+        self.current = BloomFilter(self.generation_bits, hashes)
+        self.previous = BloomFilter(self.generation_bits, hashes)
+        self.rotated_at = clock()
+
+    def _rotate(self):
+        """ Drop the oldest generation once per window
+        """
+        now = self.clock()
+        elapsed = now - self.rotated_at
+        if elapsed >= self.window:
+            self.previous = self.current if elapsed < 2 * self.window else BloomFilter(self.generation_bits,
+                                                                                         self.hashes)
+            self.current = BloomFilter(self.generation_bits, self.hashes)
+            self.rotated_at = now
+
+    def seen(self, key):
+        """ Register key
+        :key: byte string
+        :return True if key was probably seen within the window
+        """
+        self._rotate()
+        return self.current.add(key) or key in self.previous
@@ -0,0 +1,70 @@
+""" Thin WSGI application for log ingestion
+
+Serves POST /partnerprovisioning/v1/log/ straight through BVParser and RequestsDao, skipping django middleware,
+rest framework dispatch, content negotiation and rendering. Every other request falls through to the wrapped
+django application.
+"""
+from django.http.response import REASON_PHRASES
+
+from api.ingest import ingest
+from . import jsoncodec
+from .profiling import profiler
+
+INGEST_PATH = '/partnerprovisioning/v1/log/'
+JSON_MEDIA_TYPE = 'application/json'
+TEXT_MEDIA_TYPE = 'text/plain'
+
+
+class FastIngestApplication(object):
+    """ WSGI application answering log posts without django, falling back to it otherwise
+    """
+    def __init__(self, fallback, dao=None, path=INGEST_PATH):
+        """
+        :fallback: WSGI application serving any other request
+        :dao: requests dao, the api one by default so both paths share the connection
+        :path: ingest path served by this application
+        """
+        if dao is None:
+            from api.views import dao
+        self.fallback = fallback
+        self.dao = dao
+        self.path = path
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') != 'POST' or environ.get('PATH_INFO') != self.path:
+            return self.fallback(environ, start_response)
+        media_type = environ.get('CONTENT_TYPE', '').split(';')[0].strip()
+        if media_type not in (JSON_MEDIA_TYPE, TEXT_MEDIA_TYPE):
+            # unsupported media types keep the rest framework answer
+            return self.fallback(environ, start_response)
+
+        body = self._read_body(environ)
+        if media_type == JSON_MEDIA_TYPE and body:
+            try:
+                data = jsoncodec.loads(body.decode('utf-8'))
+            except ValueError as exc:
+                return self._respond(start_response, 400, {'detail': 'JSON parse error - {}'.format(exc)})
+        else:
+            data = body
+        result, status_code = profiler.profile('fast_ingest', ingest, self.dao, data)
+        return self._respond(start_response, status_code, result)
+
+    def _read_body(self, environ):
+        """ Read request body honouring content length
+        """
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        return environ['wsgi.input'].read(length) if length > 0 else ''
+
+    def _respond(self, start_response, status_code, data):
+        """ Render data as the rest framework json renderer does
+        """
+        content = jsoncodec.dumps(data)
+        headers = [('Content-Type', JSON_MEDIA_TYPE), ('Content-Length', str(len(content)))]
+        if status_code == 429:
+            headers.append(('Retry-After', str(data['retry_after'])))
+        start_response('{0} {1}'.format(status_code, REASON_PHRASES.get(status_code, 'UNKNOWN STATUS CODE')),
+                       headers)
+        return [content]
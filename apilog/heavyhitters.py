@@ -0,0 +1,140 @@
+""" Most frequent values of log fields with bounded memory
+
+SpaceSaving keeps at most capacity counters. A new value replaces the smallest counter and inherits its count as
+error, so every count is an upper bound and count - error a lower bound of the real frequency. Summaries of several
+workers or time buckets are merged with merge().
+"""
+import heapq
+import datetime
+
+
+class SpaceSaving(object):
+    """ Space saving summary of one stream of values
+    """
+    def __init__(self, capacity=200):
+        self.capacity = capacity
+        # value -> [count, error]
+        self.counters = {}
+        self.heap = []
+
+    def add(self, value, count=1):
+        """ Count value
+        """
+        counter = self.counters.get(value)
+        if counter is None:
+            error = 0
+            if len(self.counters) >= self.capacity:
+                error = self._evict()
+            counter = self.counters[value] = [error, error]
+        counter[0] += count
+        heapq.heappush(self.heap, (counter[0], value))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(counter[0], item) for item, counter in self.counters.items()]
+            heapq.heapify(self.heap)
+
+    def _evict(self):
+        """ Drop the smallest counter
+        :return its count
+        """
+        while True:
+            count, value = heapq.heappop(self.heap)
+            counter = self.counters.get(value)
+            if counter is not None and counter[0] == count:
+                del self.counters[value]
+                return count
+
+    def min_count(self):
+        """ Upper bound of the count of any value without counter
+        """
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(counter[0] for counter in self.counters.values())
+
+    def top(self, limit):
+        """ Most frequent values
+        :return list of (value, count, error)
+        """
+        ordered = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)
+        return [(value, counter[0], counter[1]) for value, counter in ordered[:limit]]
+
+
+def merge(summaries, capacity):
+    """ Merge summaries of several workers or buckets
+    :summaries: list of (counters, min_count), counters being a dict of value -> (count, error)
+    :capacity: counters kept in the merged summary
+    :return SpaceSaving
+    """
+    values = set()
+    for counters, _ in summaries:
+        values.update(counters)
+    merged = SpaceSaving(capacity)
+    totals = {}
+    for value in values:
+        count = error = 0
+        for counters, min_count in summaries:
+            if value in counters:
+                count += counters[value][0]
+                error += counters[value][1]
+            else:
+                # the value may have been evicted, with at most min_count occurrences
+                count += min_count
+                error += min_count
+        totals[value] = [count, error]
+    for value, counter in sorted(totals.items(), key=lambda item: item[1][0], reverse=True)[:capacity]:
+        merged.counters[value] = counter
+    merged.heap = [(counter[0], value) for value, counter in merged.counters.items()]
+    heapq.heapify(merged.heap)
+    return merged
+
+
+class HeavyHittersRecorder(object):
+    """ Summaries of received logs by tracked field and arrival time bucket
+    """
+    def __init__(self, fields, failure_fields=(), capacity=200, bucket=300):
+        """
+        :fields: log fields, top level or in body_request, whose values are counted
+        :failure_fields: fields counted only for logs with responseCode 400 or more, tracked as failed_<field>
+        :capacity: counters per field and bucket
+        :bucket: seconds per time bucket
+        """
+        self.fields = fields
+        self.failure_fields = failure_fields
+        self.capacity = capacity
+        self.bucket = bucket
+        self.summaries = {}
+
+    def _bucket(self):
+        """ Start of the current bucket, by arrival time so finished buckets are never written again
+        """
+        seconds = (datetime.datetime.utcnow() - datetime.datetime(1970, 1, 1)).total_seconds()
+        return datetime.datetime.utcfromtimestamp(seconds - seconds % self.bucket)
+
+    def _summary(self, tracked, bucket):
+        key = (tracked, bucket)
+        if key not in self.summaries:
+            self.summaries[key] = SpaceSaving(self.capacity)
+        return self.summaries[key]
+
+    def record(self, doc):
+        """ Count the tracked values of a log
+        """
+        body_request = doc.get('body_request') or {}
+        bucket = None
+        failed = str(doc.get('responseCode', '')).isdigit() and int(doc['responseCode']) >= 400
+        for fields, prefix in ((self.fields, ''), (self.failure_fields if failed else (), 'failed_')):
+            for field in fields:
+                value = doc.get(field)
+                if value is None and isinstance(body_request, dict):
+                    value = body_request.get(field)
+                if value is None or value == '' or isinstance(value, (dict, list)):
+                    continue
+                bucket = bucket or self._bucket()
+                self._summary(prefix + field, bucket).add(value)
+
+    def pending(self, keep_after):
+        """ Summaries to flush, forgetting buckets older than keep_after
+        :return dict of SpaceSaving by (tracked field, bucket)
+        """
+        summaries = dict(self.summaries)
+        self.summaries = dict((key, summary) for key, summary in self.summaries.items() if key[1] >= keep_after)
+        return summaries
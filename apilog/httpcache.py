@@ -0,0 +1,83 @@
+""" Rendered GET responses of a worker, with the validators of conditional requests
+
+An entry keeps the rendered body of a request key with the data version it was rendered from, its ETag (md5 of the
+body) and the time the body last changed, used as Last-Modified. Entries are served as they are for ttl seconds, then
+while the data version stays the same, and are rendered again at least every max_age seconds.
+"""
+import time
+import hashlib
+
+from django.utils.http import http_date, parse_http_date_safe
+
+
+class ResponseCache(object):
+    """ Rendered responses by request key
+    """
+    def __init__(self, ttl=2, max_age=30, max_entries=1000):
+        """
+        :ttl: seconds an entry is served without checking the data version
+        :max_age: seconds after which an entry is rendered again even if its data version did not change
+        :max_entries: entries kept, the ones closest to max_age are evicted first
+        """
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.entries = {}
+
+    def get(self, key, version=None):
+        """ Entry of key still valid for a data version
+        :version: current data version, None to accept entries within their ttl only
+        :return entry dict or None
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        now = time.time()
+        if now - entry['rendered'] >= self.max_age:
+            return None
+        if now < entry['expires']:
+            return entry
+        if version is None or version != entry['version']:
+            return None
+        entry['expires'] = now + self.ttl
+        return entry
+
+    def fresh(self, key):
+        """ Entry of key within its ttl, None otherwise
+        """
+        entry = self.entries.get(key)
+        return entry if entry and time.time() < entry['expires'] else None
+
+    def put(self, key, version, content, content_type):
+        """ Store a rendered body, keeping the last modified time of an identical one
+        :return entry dict
+        """
+        now = time.time()
+        etag = '"{}"'.format(hashlib.md5(content).hexdigest())
+        previous = self.entries.get(key)
+        modified = previous['modified'] if previous and previous['etag'] == etag else int(now)
+        if previous is None and len(self.entries) >= self.max_entries:
+            del self.entries[min(self.entries, key=lambda name: self.entries[name]['rendered'])]
+        entry = self.entries[key] = {'version': version, 'content': content, 'content_type': content_type,
+                                     'etag': etag, 'modified': modified, 'rendered': now, 'expires': now + self.ttl}
+        return entry
+
+
+def headers(entry):
+    """ Validator headers of an entry
+    """
+    return {'ETag': entry['etag'], 'Last-Modified': http_date(entry['modified'])}
+
+
+def not_modified(entry, if_none_match=None, if_modified_since=None):
+    """ Whether a conditional request already has the body of entry
+    :if_none_match: If-None-Match header, checked instead of If-Modified-Since when sent
+    :if_modified_since: If-Modified-Since header
+    """
+    if if_none_match:
+        etags = [etag.strip() for etag in if_none_match.split(',')]
+        return '*' in etags or entry['etag'] in etags or 'W/' + entry['etag'] in etags
+    if if_modified_since:
+        since = parse_http_date_safe(if_modified_since)
+        return since is not None and entry['modified'] <= since
+    return False
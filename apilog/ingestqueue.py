@@ -0,0 +1,137 @@
+""" Durable local queue of received logs waiting to be stored
+
+Backed by a sqlite file so queued payloads survive worker restarts and every gunicorn worker on the host shares the
+same queue. Each payload is identified by a ticket that keeps its final state (stored with its id or rejected with
+the reason) during a retention period. Writes of several tickets share one transaction, so one commit.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+
+QUEUED = 'queued'
+PROCESSING = 'processing'
+STORED = 'stored'
+REJECTED = 'rejected'
+
+
+class IngestQueue(object):
+    """ Sqlite backed queue of ingest tickets
+    """
+    def __init__(self, path, claim_timeout=60, retention=86400):
+        """
+        :path: sqlite database file
+        :claim_timeout: seconds before a payload claimed by a dead worker is queued again
+        :retention: seconds finished tickets are kept
+        """
+        self.path = path
+        self.claim_timeout = claim_timeout
+        self.retention = retention
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS tickets (ticket TEXT PRIMARY KEY, payload TEXT, state TEXT, '
+                          'result TEXT, owner TEXT, created REAL, updated REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS tickets_state ON tickets (state, created)')
+
+    def _executemany(self, statement, rows):
+        """ Run statement for every row in a single transaction
+        """
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.executemany(statement, rows)
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def put(self, data):
+        """ Queue a payload
+        :data: dict or plain text log
+        :return ticket
+        """
+        return self.put_many([data])[0]
+
+    def put_many(self, payloads):
+        """ Queue payloads with a single commit
+        :payloads: list of dicts or plain text logs
+        :return list with the ticket of each payload
+        """
+        tickets = [uuid.uuid4().hex for _ in payloads]
+        now = time.time()
+        self._executemany('INSERT INTO tickets (ticket, payload, state, created, updated) VALUES (?, ?, ?, ?, ?)',
+                          [(ticket, json.dumps(data), QUEUED, now, now) for ticket, data in zip(tickets, payloads)])
+        return tickets
+
+    def claim(self, batch_size, owner):
+        """ Take the oldest queued payloads
+        :batch_size: max payloads returned
+        :owner: claiming worker identifier
+        :return list of (ticket, data)
+        """
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.execute('UPDATE tickets SET state = ?, owner = NULL, updated = ? WHERE state = ? AND updated < ?',
+                              (QUEUED, now, PROCESSING, now - self.claim_timeout))
+            rows = self.conn.execute('SELECT ticket, payload FROM tickets WHERE state = ? ORDER BY created LIMIT ?',
+                                     (QUEUED, batch_size)).fetchall()
+            self.conn.executemany('UPDATE tickets SET state = ?, owner = ?, updated = ? WHERE ticket = ?',
+                                  [(PROCESSING, owner, now, ticket) for ticket, _ in rows])
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return [(ticket, json.loads(payload)) for ticket, payload in rows]
+
+    def _finish(self, results):
+        now = time.time()
+        self._executemany('UPDATE tickets SET state = ?, result = ?, payload = NULL, updated = ? WHERE ticket = ?',
+                          [(state, json.dumps(result), now, ticket) for ticket, state, result in results])
+
+    def complete(self, tickets_ids):
+        """ Mark payloads as stored
+        :tickets_ids: list of (ticket, log id)
+        """
+        self._finish([(ticket, STORED, log_id) for ticket, log_id in tickets_ids])
+
+    def reject(self, tickets_reasons):
+        """ Mark payloads as rejected
+        :tickets_reasons: list of (ticket, reason)
+        """
+        self._finish([(ticket, REJECTED, reason) for ticket, reason in tickets_reasons])
+
+    def release(self, tickets):
+        """ Queue claimed payloads again
+        """
+        self._executemany('UPDATE tickets SET state = ?, owner = NULL WHERE ticket = ?',
+                          [(QUEUED, ticket) for ticket in tickets])
+
+    def status(self, ticket):
+        """ State of a ticket
+        :return dict with state plus id (stored) or reason (rejected), None for unknown tickets
+        """
+        row = self.conn.execute('SELECT state, result FROM tickets WHERE ticket = ?', (ticket,)).fetchone()
+        if row is None:
+            return None
+        state, result = row
+        if state == STORED:
+            return {'state': state, 'id': json.loads(result)}
+        elif state == REJECTED:
+            return {'state': state, 'reason': json.loads(result)}
+        return {'state': QUEUED}
+
+    def depth(self):
+        """ Payloads waiting to be stored
+        """
+        return self.conn.execute('SELECT COUNT(*) FROM tickets WHERE state IN (?, ?)',
+                                 (QUEUED, PROCESSING)).fetchone()[0]
+
+    def purge(self):
+        """ Forget finished tickets older than retention
+        """
+        self.conn.execute('DELETE FROM tickets WHERE state IN (?, ?) AND updated < ?',
+                          (STORED, REJECTED, time.time() - self.retention))
@@ -0,0 +1,82 @@
+""" JSON codec backed by the fastest installed library
+
+Backends are tried in JSON_CODEC['backends'] order: ujson and simplejson are C accelerated when installed and the
+standard library json module is always available as fallback.
+"""
+import json
+import datetime
+from .settings import JSON_CODEC
+
+
+class Codec(object):
+    """ JSON decode and encode functions from one backend
+    """
+    def __init__(self, name, loads, dumps):
+        self.name = name
+        self._loads = loads
+        self._dumps = dumps
+
+    def loads(self, data):
+        """ Decode a JSON document
+        :raises ValueError with invalid JSON
+        """
+        return self._loads(data)
+
+    def dumps(self, obj, default=None):
+        """ Encode obj as ascii JSON
+        :default: function returning a serializable version of unsupported objects
+        """
+        return self._dumps(obj, default)
+
+
+def _stdlib_codec():
+    return Codec('json', json.loads, lambda obj, default: json.dumps(obj, default=default, ensure_ascii=True))
+
+
+def _simplejson_codec():
+    import simplejson
+    return Codec('simplejson', simplejson.loads,
+                 lambda obj, default: simplejson.dumps(obj, default=default, ensure_ascii=True))
+
+
+def _ujson_codec():
+    import ujson
+    try:
+        # datetimes have to reach default as in the other backends, older ujson versions encode them as numbers
+        handles_default = ujson.dumps(datetime.datetime(2014, 1, 1), default=lambda obj: 'default') == '"default"'
+    except Exception:
+        handles_default = False
+    if handles_default:
+        dumps = lambda obj, default: ujson.dumps(obj, default=default, ensure_ascii=True)
+    else:
+        dumps = _stdlib_codec()._dumps
+    return Codec('ujson', ujson.loads, dumps)
+
+
+_BACKENDS = {
+    'ujson': _ujson_codec,
+    'simplejson': _simplejson_codec,
+    'json': _stdlib_codec,
+}
+
+
+def get_codec(name):
+    """ Build the codec of a backend
+    :name: ujson, simplejson or json
+    :raises ImportError if the backend library is not installed
+    """
+    return _BACKENDS[name]()
+
+
+def _default_codec():
+    for name in JSON_CODEC['backends']:
+        try:
+            return get_codec(name)
+        except ImportError:
+            continue
+    return _stdlib_codec()
+
+
+codec = _default_codec()
+loads = codec.loads
+dumps = codec.dumps
@@ -0,0 +1,50 @@
+""" Per worker counters grouped by component, exposed through the stats api
+"""
+_groups = {}
+
+
+class Counters(object):
+    """ Named counters of one component
+    """
+    def __init__(self):
+        self._values = {}
+
+    def incr(self, name, amount=1):
+        """ Increase counter name by amount
+        """
+        self._values[name] = self._values.get(name, 0) + amount
+
+    def set(self, name, value):
+        """ Set gauge name to value
+        """
+        self._values[name] = value
+
+    def get(self, name):
+        """ Current value of counter name
+        """
+        return self._values.get(name, 0)
+
+    def snapshot(self):
+        """ Copy of every counter value
+        """
+        return dict(self._values)
+
+    def reset(self):
+        """ Set every counter back to zero
+        """
+        self._values.clear()
+
+
+def counters(group):
+    """ Counters of group, created on first use
+    :group: component name
+    """
+    if group not in _groups:
+        _groups[group] = Counters()
+    return _groups[group]
+
+
+def snapshot():
+    """ Values of every counter by group
+    """
+    return dict((group, group_counters.snapshot()) for group, group_counters in _groups.items())
@@ -1,10 +1,46 @@
 from gevent import monkey
 monkey.patch_all()
-from .settings import MONGODB
+import time
+import gevent
+import hashlib
+import logging
+import contextlib
+import calendar
+import datetime
+import itertools
+import dateutil.parser
+from .settings import MONGODB, SHARDING, READ_ROUTING, BULK_OPERATIONS, SEARCH, COMPACT_STORAGE, \
+    COLLECTION_STATS, SLOW_OPERATIONS, RAW_LINES, ARCHIVE, RESPONSE_CACHE
+from . import metrics
+from .search import doc_tokens, tokenize
+from .compact import Codec, MongoDictionary, pack_line
+from .archive import Archive
+from .traces import summarize
+from .sketch import LatencySketch
+from . import heavyhitters
+from bson.objectid import ObjectId
 from pymongo import MongoClient, ReadPreference
-from pymongo.errors import AutoReconnect
+from pymongo.errors import AutoReconnect, DuplicateKeyError, OperationFailure
 
 _connection = None
+_shard_connections = None
+# Replication lag in seconds and time of the last check, by client
+_replication_lag = {}
+read_counters = metrics.counters('reads')
+slow_counters = metrics.counters('slow_operations')
+# Last record time of slow operations by collection, operation and query shape
+_slow_recorded = {}
+# Collection stats and their time, by collection name
+_stats_cache = {}
+logger_mongo = logging.getLogger("apilog")
+
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primary_preferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondary_preferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
+}
 
 
 class DBLogException(Exception):
@@ -17,47 +53,250 @@ class DBLogException(Exception):
         return repr(self.value)
 
 
+def _pymongo_client(host, replicaset):
+    dbconfig = MONGODB
+    if dbconfig['slave_ok']:
+        read_preference = ReadPreference.SECONDARY
+    else:
+        read_preference = ReadPreference.PRIMARY
+    return MongoClient(
+        host,
+        w=dbconfig['operation_ack'],
+        replicaset=replicaset,
+        read_preference=read_preference,
+        auto_start_request=dbconfig["autostart"])
+
+
+def _mongomock_client(host, replicaset):
+    import mongomock
+    return mongomock.MongoClient()
+
+
+_BACKENDS = {
+    'pymongo': _pymongo_client,
+    'mongomock': _mongomock_client,
+}
+
+
+def get_client(backend, host, replicaset=''):
+    """ Client of a backend
+    :backend: pymongo or mongomock
+    :raises ImportError if the backend library is not installed
+    """
+    return _BACKENDS[backend](host, replicaset)
+
+
+def in_memory():
+    """ Whether the configured backend is an in process store, which has no replicas nor read preferences
+    """
+    return MONGODB['backend'] != 'pymongo'
+
+
+def mark_changed(dbconn, name):
+    """ Increase the change counter of collection name in the ids collection, read to revalidate cached responses
+    """
+    if RESPONSE_CACHE['enabled']:
+        dbconn['ids'].update({'_id': name + '_changes'}, {'$inc': {'val': 1}}, upsert=True, w=1)
+
+
+def primary_options():
+    """ Read options of reads that must see the last writes
+    """
+    return {} if in_memory() else {'read_preference': ReadPreference.PRIMARY}
+
+
 class Connection(object):
     """
     Singleton connection
     """
 
+    def _connect(self, hosts, replicaset):
+        """ Client of the first reachable host
+        :hosts: hosts tried in order
+        :replicaset: replica set name
+        """
+        for host in hosts:
+            try:
+                return get_client(MONGODB['backend'], host, replicaset)
+            except AutoReconnect as e:
+                print "Cannot connect to '{0}' trying next host. Error: {1}".format(host, e.message)
+        raise SystemError("Cannot establish connection with hosts {0}".format(hosts))
+
     def get_connection(self):
         global _connection
         dbconfig = MONGODB
 
         if _connection is None:
-            for host in dbconfig['hosts']:
-                if dbconfig['slave_ok']:
-                    read_preference = ReadPreference.SECONDARY
-                else:
-                    read_preference = ReadPreference.PRIMARY
-                try:
-                    _connection = MongoClient(
-                        host,
-                        w=dbconfig['operation_ack'],
-                        replicaset=dbconfig["replicaset"],
-                        read_preference=read_preference,
-                        auto_start_request=dbconfig["autostart"])
-                    return _connection[dbconfig['dbname']]
-                except AutoReconnect as e:
-                    print "Cannot connect to '{0}' trying next host. Error: {1}".format(host, e.message)
-                    _connection = None
-            raise SystemError("Cannot establish connection with hosts {0}".format(dbconfig["hosts"]))
+            _connection = self._connect(dbconfig['hosts'], dbconfig["replicaset"])
         return _connection[dbconfig['dbname']]
 
+    def get_shard_connections(self):
+        """ Database of every shard, in SHARDING['shards'] order
+        """
+        global _shard_connections
+        if _shard_connections is None:
+            _shard_connections = [self._connect(shard['hosts'], shard.get('replicaset', ''))
+                                  for shard in SHARDING['shards']]
+        return [client[MONGODB['dbname']] for client in _shard_connections]
+
     def close(self):
         _connection.close()
 
 
+def replication_lag(client):
+    """ Seconds the slowest healthy secondary is behind the primary, checked every READ_ROUTING['lag_check']
+    :client: MongoClient of a replica set, standalone servers have no lag
+    """
+    lag, checked = _replication_lag.get(id(client), (0, 0))
+    if time.time() - checked < READ_ROUTING['lag_check']:
+        return lag
+    try:
+        members = client.admin.command('replSetGetStatus')['members']
+        primary = [member['optimeDate'] for member in members if member['state'] == 1]
+        secondaries = [member['optimeDate'] for member in members if member['state'] == 2 and member['health']]
+        lag = (primary[0] - min(secondaries)).total_seconds() if primary and secondaries else 0
+    except (OperationFailure, AutoReconnect):
+        lag = 0
+    _replication_lag[id(client)] = (lag, time.time())
+    return lag
+
+
+def read_options(operation, client, fresh=False):
+    """ Keyword arguments choosing where a read operation goes
+    :operation: key of READ_ROUTING['operations']
+    :client: MongoClient the read is sent to
+    :fresh: the read follows a recent write and must see it
+    :return {} to keep the connection read preference when routing is disabled or the backend is in memory
+    """
+    if not READ_ROUTING['enabled'] or in_memory():
+        return {}
+    preference = READ_ROUTING['operations'].get(operation, 'primary')
+    if fresh:
+        preference = 'primary'
+        read_counters.incr('fresh')
+    elif preference != 'primary' and replication_lag(client) > READ_ROUTING['max_staleness']:
+        preference = 'primary'
+        read_counters.incr('stale')
+    read_counters.incr('{0}.{1}'.format(operation, preference))
+    return {'read_preference': READ_PREFERENCES[preference]}
+
+
+def query_shape(query):
+    """ Query with every value replaced by 1, the same for queries that differ only in values
+    """
+    if isinstance(query, dict):
+        return '{' + ', '.join('{0}: {1}'.format(key, query_shape(query[key])) for key in sorted(query)) + '}'
+    if isinstance(query, (list, tuple)):
+        return '[' + ', '.join(sorted(set(query_shape(value) for value in query))) + ']'
+    return '1'
+
+
+def has_operator(value):
+    """ Whether a value holds a key starting with $ at any depth, which mongo would take as a query operator
+    """
+    if isinstance(value, dict):
+        return any(unicode(key).startswith('$') or has_operator(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return any(has_operator(item) for item in value)
+    return False
+
+
+def explain_summary(explain):
+    """ Plan, index and examined counts of a cursor explain, as returned by mongo 2.x or 3.x
+    :return dict, index is None for collection scans
+    """
+    if 'queryPlanner' in explain:
+        stages, index = [], None
+        stage = explain['queryPlanner'].get('winningPlan')
+        while stage:
+            stages.append(stage.get('stage'))
+            index = index or stage.get('indexName')
+            stage = stage.get('inputStage')
+        stats = explain.get('executionStats', {})
+        return {'plan': ' < '.join(stages), 'index': index, 'keys_examined': stats.get('totalKeysExamined'),
+                'docs_examined': stats.get('totalDocsExamined'), 'returned': stats.get('nReturned'),
+                'in_memory_sort': 'SORT' in stages}
+    cursor = explain.get('cursor', '')
+    return {'plan': cursor, 'index': cursor.split(' ', 1)[1] if cursor.startswith('BtreeCursor ') else None,
+            'keys_examined': explain.get('nscanned'), 'docs_examined': explain.get('nscannedObjects'),
+            'returned': explain.get('n'), 'in_memory_sort': bool(explain.get('scanAndOrder'))}
+
+
 class Dao(object):
-    def __init__(self):
+    def __init__(self, dbconn=None):
+        """
+        :dbconn: database to use instead of the configured connection, e.g. an in memory one in tests
+        """
         if self.coll is None:
             raise NotImplementedError("{0}.coll method must defined when overriding".format(self.__class__.__name__))
 
-        client = Connection()
-        self.dbconn = client.get_connection()
+        if dbconn is None:
+            client = Connection()
+            dbconn = client.get_connection()
+        self.dbconn = dbconn
         self.dbcoll = self.dbconn[self.coll]
+        # Write time of recently written ids, read back from the primary
+        self.written = {}
+
+    def _mark_written(self, ids):
+        """ Remember ids written by this worker for READ_ROUTING['read_your_writes'] seconds
+        """
+        if not READ_ROUTING['enabled']:
+            return
+        now = time.time()
+        if len(self.written) > READ_ROUTING['max_written']:
+            self.written = dict((log_id, written) for log_id, written in self.written.items()
+                                if now - written < READ_ROUTING['read_your_writes'])
+        for log_id in ids:
+            self.written[log_id] = now
+
+    def _read_options(self, operation, coll, log_id=None):
+        """ Read preference of an operation over coll
+        :log_id: id read, reads of ids written recently go to the primary
+        """
+        fresh = log_id is not None and \
+            time.time() - self.written.get(int(log_id), 0) < READ_ROUTING['read_your_writes']
+        return read_options(operation, coll.database.connection, fresh)
+
+    @contextlib.contextmanager
+    def _watch(self, operation, coll, query, sort=None, limit=None):
+        """ Time the read of query inside the block, recording it when slower than SLOW_OPERATIONS['threshold']
+        :sort: list of (field, direction) of the read, to explain it as it ran
+        """
+        started = time.time()
+        yield
+        elapsed = time.time() - started
+        if not SLOW_OPERATIONS['enabled'] or elapsed < SLOW_OPERATIONS['threshold']:
+            return
+        slow_counters.incr(operation)
+        shape = query_shape(query)
+        key = (coll.name, operation, shape)
+        if time.time() - _slow_recorded.get(key, 0) < SLOW_OPERATIONS['min_interval']:
+            return
+        _slow_recorded[key] = time.time()
+        logger_mongo.warning("Slow {0} on {1} took {2:.3f}s: {3}".format(operation, coll.name, elapsed, shape))
+        # explained out of the request, running the query again
+        gevent.spawn(self._record_slow, operation, coll, query, shape, elapsed, sort, limit)
+
+    def _record_slow(self, operation, coll, query, shape, elapsed, sort, limit):
+        """ Store a slow operation with the summary of its query plan
+        """
+        try:
+            cursor = coll.find(query, **self._read_options(operation, coll))
+            if sort:
+                cursor = cursor.sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            plan = explain_summary(cursor.explain())
+        except Exception as exc:
+            plan = {'error': str(exc)}
+        try:
+            self.dbconn[SLOW_OPERATIONS['collection']].insert(
+                {'time': datetime.datetime.utcnow(), 'collection': coll.name, 'operation': operation,
+                 'query': shape, 'millis': int(elapsed * 1000), 'sort': sort and [list(key) for key in sort],
+                 'limit': limit, 'plan': plan}, w=0)
+        except Exception as exc:
+            logger_mongo.error("Slow operation not recorded: {}".format(exc))
 
     def _get_id_value(self):
         """Retrieve max new value of the id for DAO collection
@@ -72,76 +311,895 @@ class Dao(object):
                                            new=True)
         return counter_doc['val']
 
+    def _get_id_range(self, count):
+        """Reserve count consecutive ids for DAO collection with a single counter update
+        :param count: number of ids to reserve
+        :return first reserved id
+        """
+        coll = self.dbconn['ids']
+        counter_doc = coll.find_and_modify(query={'_id': self.coll},
+                                           update={'$inc': {'val': count}},
+                                           upsert=True,
+                                           w=1,
+                                           new=True)
+        return counter_doc['val'] - count + 1
+
 
 class RequestsDao(Dao):
     coll = 'requests'
+    # Internal fields never returned to clients
+    projection = {"_id": False, "search_tokens": False, "raw_line": False}
 
     def __init__(self, *args, **kwargs):
         super(RequestsDao, self).__init__(*args, **kwargs)
+        # Collections where logs are stored, the ids counter and the dictionary stay in the main database
+        self.shards = [self.dbcoll]
+        if SHARDING['enabled']:
+            self.shards = [shard[self.coll] for shard in Connection().get_shard_connections()]
+        self.codec = None
+        if COMPACT_STORAGE['enabled']:
+            self.codec = Codec(MongoDictionary(self.dbconn), raw_body=COMPACT_STORAGE['raw_body'])
+        self.archive = None
+        if ARCHIVE['enabled']:
+            self.archive = Archive(ARCHIVE['directory'], ARCHIVE['compress_level'])
+
+    def _encode(self, doc):
+        """Stored representation of a document, compact when enabled
+        """
+        return self.codec.encode(doc) if self.codec else doc
+
+    def _decode(self, doc):
+        """Full representation of a stored document
+        """
+        return self.codec.decode(doc) if self.codec and doc else doc
+
+    def _decode_all(self, cursor):
+        """Full representation of every stored document of a cursor
+        """
+        return (self.codec.decode(doc) for doc in cursor) if self.codec else cursor
+
+    def _query(self, query):
+        """Query over stored documents
+        """
+        return self.codec.encode_query(query) if self.codec else query
+
+    def _key(self, field):
+        """Stored name of a field
+        """
+        return self.codec.key(field) if self.codec else field
+
+    def _projection(self):
+        return self.codec.encode_projection(self.projection) if self.codec else self.projection
 
-    def insert(self, doc, operation_ack=1):
+    def _archived(self, doc):
+        """Archived document without internal fields
+        """
+        return dict((key, value) for key, value in doc.items() if key not in self.projection) if doc else doc
+
+    def _shard_index(self, doc):
+        """Index of the shard where a new document is written
+        Routed by transactionId hash or by requestDate bucket hash, falling back to the id
+        """
+        if len(self.shards) == 1:
+            return 0
+        value = None
+        if SHARDING['key'] == 'time' and isinstance(doc.get('requestDate'), datetime.datetime):
+            value = str(calendar.timegm(doc['requestDate'].utctimetuple()) // SHARDING['time_bucket'])
+        elif SHARDING['key'] == 'transactionId' and doc.get('transactionId'):
+            value = unicode(doc['transactionId']).encode('utf-8')
+        if value is None:
+            value = str(doc['id'])
+        return int(hashlib.md5(value).hexdigest()[:8], 16) % len(self.shards)
+
+    def _find_one(self, query, projection, routed=None, operation='get', log_id=None):
+        """First document found in the shards, starting with the routed one
+        """
+        shards = self.shards if routed is None else [routed] + [shard for shard in self.shards if shard is not routed]
+        for shard in shards:
+            with self._watch(operation, shard, query, limit=1):
+                doc = shard.find_one(query, projection, **self._read_options(operation, shard, log_id))
+            if doc:
+                return doc
+        return None
+
+    def _update_one(self, query, update, operation_ack):
+        """Update a document stored in any shard
+        :return result of the shard holding it, or of the last shard when not found
+        """
+        result = None
+        for shard in self.shards:
+            result = shard.update(query, update, w=operation_ack)
+            if result is None or result.get('updatedExisting'):
+                break
+        return result
+
+    def insert(self, doc, operation_ack=1, keep_object_id=False):
         """Insert document inside collection
         :param doc: document to store to the DB
         :param operation_ack: validate operation (slower)
+        :param keep_object_id: store the _id of doc instead of a new one, so a retried insert is rejected
         :raises DuplicateKeyError with operation_ack=1
         """
-        doc.pop("_id", None)
+        self._pop_object_id(doc, keep_object_id)
         doc["id"] = self._get_id_value()
-        self.dbcoll.insert(doc, w=operation_ack)
+        self._add_search_tokens(doc)
+        self.shards[self._shard_index(doc)].insert(self._encode(doc), w=operation_ack)
+        self._mark_written([doc['id']])
         # Not returning objectId, just our id
         return doc['id']
 
-    def select(self, log_id=None):
-        """ Retrieve log from log_id
+    def _add_search_tokens(self, doc):
+        """Store search tokens of exception texts, request bodies and urls inside the document
+        """
+        if SEARCH['enabled']:
+            tokens = doc_tokens(doc, SEARCH['min_token_length'], SEARCH['max_tokens'])
+            if tokens:
+                doc["search_tokens"] = tokens
+
+    def ensure_search_index(self):
+        """ Index logs by search token and request date
+        """
+        for shard in self.shards:
+            shard.ensure_index([(self._key("search_tokens"), 1), (self._key("requestDate"), -1)], background=True)
+
+    def search(self, text, date_from=None, date_to=None, limit=50):
+        """ Logs containing every word of text, newest first
+        :text: words to look for in exception texts, request bodies and urls
+        :date_from: min request date
+        :date_to: max request date
+        :limit: max logs returned
+        :raises DBLogException without words to look for
+        """
+        tokens = list(set(tokenize(text, SEARCH['min_token_length'])))
+        if not tokens:
+            raise DBLogException("Search text {} has no words".format(text))
+        query = {"search_tokens": {"$all": tokens}}
+        date_range = {}
+        if date_from:
+            date_range['$gte'] = dateutil.parser.parse(date_from)
+        if date_to:
+            date_range['$lte'] = dateutil.parser.parse(date_to)
+        if date_range:
+            query['requestDate'] = date_range
+        query, sort = self._query(query), [(self._key("requestDate"), -1)]
+        cursors = []
+        for shard in self.shards:
+            cursor = shard.find(query, self._projection(), **self._read_options('search', shard)) \
+                .sort(self._key("requestDate"), -1).limit(limit)
+            if SLOW_OPERATIONS['enabled']:
+                # read inside the watch to time it
+                with self._watch('search', shard, query, sort, limit):
+                    cursor = list(cursor)
+            cursors.append(cursor)
+        if len(cursors) == 1:
+            return self._decode_all(cursors[0])
+        merged = sorted(itertools.chain(*cursors), key=lambda doc: doc.get(self._key("requestDate")), reverse=True)
+        return self._decode_all(merged[:limit])
+
+    def _pop_object_id(self, doc, keep_object_id):
+        object_id = doc.pop("_id", None)
+        if keep_object_id and object_id is not None:
+            doc["_id"] = object_id
+
+    def insert_batch(self, docs, operation_ack=1, keep_object_id=False):
+        """Insert several documents reserving all their ids at once
+        :param docs: documents to store to the DB
+        :param operation_ack: validate operation (slower)
+        :param keep_object_id: store the _id of each doc, documents already stored are rejected as duplicated
+        :return list with the id of each document, None for documents rejected as duplicated
+        """
+        if not docs:
+            return []
+        first_id = self._get_id_range(len(docs))
+        ids = []
+        for offset, doc in enumerate(docs):
+            self._pop_object_id(doc, keep_object_id)
+            doc["id"] = first_id + offset
+            self._add_search_tokens(doc)
+            ids.append(doc["id"])
+        self._mark_written(ids)
+        groups = {}
+        for doc in docs:
+            groups.setdefault(self._shard_index(doc), []).append(doc)
+        rejected = set()
+        for index, group in sorted(groups.items()):
+            shard = self.shards[index]
+            try:
+                shard.insert([self._encode(doc) for doc in group], w=operation_ack, continue_on_error=True)
+            except DuplicateKeyError:
+                group_ids = [doc["id"] for doc in group]
+                stored = set(doc['id'] for doc in shard.find({"id": {"$in": group_ids}}, {"_id": False, "id": True},
+                                                             **primary_options()))
+                rejected.update(set(group_ids) - stored)
+        return [None if log_id in rejected else log_id for log_id in ids]
+
+    def select(self, log_id=None, date_from=None, date_to=None, limit=50):
+        """ Retrieve log from log_id, falling back to the archive
         :log_id: id from log to retrieve. If none, get all logs (limit 50)
-        :raises DBLogException
+        :date_from: without log_id, min request date of logs, newest first and completed with archived logs
+        :date_to: max request date
+        :limit: max logs of a request date range
+        :raises DBLogException, ValueError with invalid dates
         :return doc data without ObjectId
         """
         if log_id:
-            doc = self.dbcoll.find_one({"id": int(log_id)}, {"_id": False})
+            doc = self._decode(self._find_one({"id": int(log_id)}, self._projection(), log_id=log_id))
+            if doc is None and self.archive:
+                doc = self._archived(self.archive.find(int(log_id)))
+        elif date_from or date_to:
+            return self._select_range(date_from, date_to, limit)
+        elif len(self.shards) == 1:
+            doc = self._decode_all(self.shards[0].find({}, self._projection(),
+                                                       **self._read_options('list', self.shards[0])).limit(50))
         else:
-            doc = self.dbcoll.find({}, {'_id': False}).limit(50)
+            doc = self._decode_all(list(itertools.islice(
+                itertools.chain(*[shard.find({}, self._projection(), **self._read_options('list', shard)).limit(50)
+                                  for shard in self.shards]), 50)))
 
         if doc:
             return doc
         else:
             raise DBLogException("Data log {} does not exist".format(log_id))
 
+    def _select_range(self, date_from, date_to, limit):
+        """ Logs of a request date range newest first, completed with archived logs up to limit
+        """
+        date_range = {}
+        if date_from:
+            date_range['$gte'] = dateutil.parser.parse(date_from)
+        if date_to:
+            date_range['$lte'] = dateutil.parser.parse(date_to)
+        query, sort = self._query({'requestDate': date_range}), [(self._key("requestDate"), -1)]
+        docs = []
+        for shard in self.shards:
+            with self._watch('list', shard, query, sort, limit):
+                docs.extend(shard.find(query, self._projection(), **self._read_options('list', shard))
+                            .sort(sort).limit(limit))
+        docs.sort(key=lambda doc: doc.get(self._key("requestDate")), reverse=True)
+        docs = list(self._decode_all(docs[:limit]))
+        if len(docs) < limit and self.archive:
+            docs.extend(self._archived(doc) for doc in self.archive.find_range(
+                date_range.get('$gte'), date_range.get('$lte'), limit - len(docs), exclude=[doc['id'] for doc in docs]))
+        return docs
+
     def update_doc(self, log_id, data, operation_ack=1):
         """ Update doc by id
         :log_id: Id from log
         """
-        return self.dbcoll.update({"id": int(log_id)}, data, w=operation_ack)
+        if self.codec:
+            data = self.codec.encode_update(data) if all(key.startswith('$') for key in data) else self._encode(data)
+        self._mark_written([int(log_id)])
+        result = self._update_one({"id": int(log_id)}, data, operation_ack)
+        mark_changed(self.dbconn, self.coll)
+        return result
+
+    def patch_doc(self, log_id, fields=None, unset=None, expected=None, operation_ack=1):
+        """ Partially update doc by id, sending only the changed fields
+        :log_id: Id from log
+        :fields: dict of fields to set
+        :unset: list of fields to remove
+        :expected: dict of field values the stored log must have to be updated
+        :raises DBLogException if there is nothing to update, any argument has another type or expected has operators
+        """
+        if fields is not None and not isinstance(fields, dict) or \
+                expected is not None and not isinstance(expected, dict):
+            raise DBLogException("Log {} set and expected must be objects".format(log_id))
+        if unset is not None and (not isinstance(unset, list) or
+                                  not all(isinstance(field, basestring) for field in unset)):
+            raise DBLogException("Log {} unset must be a list of field names".format(log_id))
+        if has_operator(expected):
+            raise DBLogException("Log {} expected values must not contain $ operators".format(log_id))
+        update = {}
+        if fields:
+            fields = dict((key, value) for key, value in fields.items() if key not in ('id', '_id'))
+            if fields:
+                update['$set'] = fields
+        if unset:
+            update['$unset'] = dict((field, "") for field in unset if field not in ('id', '_id'))
+        if not update.get('$set') and not update.get('$unset'):
+            raise DBLogException("Log {} update does not change any field".format(log_id))
+
+        query = dict(expected or {})
+        query.pop('_id', None)
+        query["id"] = int(log_id)
+        if self.codec:
+            update = self.codec.encode_update(update)
+        self._mark_written([int(log_id)])
+        result = self._update_one(self._query(query), update, operation_ack)
+        mark_changed(self.dbconn, self.coll)
+        return result
+
+    def exists(self, log_id):
+        """ Check if a log is stored
+        :log_id: Id from log
+        """
+        return self._find_one({"id": int(log_id)}, {"_id": False, "id": True}, log_id=log_id) is not None
+
+    def find_by_transaction(self, transaction_id, origin):
+        """ Id of the log stored for a transaction and origin
+        :transaction_id: log transactionId
+        :origin: log origin (FE, BE)
+        :return log id or None
+        """
+        routed = None
+        if SHARDING['key'] == 'transactionId':
+            routed = self.shards[self._shard_index({"transactionId": transaction_id, "id": 0})]
+        doc = self._find_one(self._query({"transactionId": transaction_id, "origin": origin}),
+                             {"_id": False, "id": True}, routed=routed, operation='dedup')
+        return doc['id'] if doc else None
+
+    def ensure_transaction_index(self, unique=False):
+        """ Index logs by transactionId and origin
+        :unique: reject a second log with the same transactionId and origin
+        """
+        for shard in self.shards:
+            shard.ensure_index([(self._key("transactionId"), 1), (self._key("origin"), 1)], unique=unique,
+                               background=True)
 
     def delete_doc(self, log_id, operation_ack=1):
         """ Delete a document
         :log_id: Id from log
         """
-        return self.dbcoll.remove({"id": int(log_id)}, w=operation_ack)
+        self._mark_written([int(log_id)])
+        result = None
+        for shard in self.shards:
+            result = shard.remove({"id": int(log_id)}, w=operation_ack)
+            if result is None or result.get('n'):
+                break
+        mark_changed(self.dbconn, self.coll)
+        return result
 
     def remove(self):
         """ Remove requests collection
         """
-        self.dbcoll.drop()
+        for shard in self.shards:
+            shard.drop()
+
+    def ensure_id_index(self):
+        """ Index logs by id, read by id and for the newest stored id
+        """
+        for shard in self.shards:
+            shard.ensure_index('id', background=True)
+
+    def version(self):
+        """ Token changing when logs are stored, updated or removed
+        :return tuple with the newest stored id of every shard and the change counter
+        """
+        newest = []
+        for shard in self.shards:
+            doc = shard.find_one({}, {'_id': False, 'id': True}, sort=[('id', -1)], **primary_options())
+            newest.append(doc['id'] if doc else None)
+        counter = self.dbconn['ids'].find_one({'_id': self.coll + '_changes'}, **primary_options())
+        return tuple(newest) + (counter['val'] if counter else None,)
+
+    def _build_filter(self, criteria):
+        """ Build a mongo query from a bulk filter
+        :criteria: dict with any of ids, id_from, id_to, transactionId, api, app, date_from, date_to
+        :raises DBLogException if no known criteria is received or any of them is invalid
+        :return mongo query
+        """
+        if not isinstance(criteria, dict):
+            raise DBLogException("Bulk filter {} is not an object".format(criteria))
+        try:
+            return self._filter_query(criteria)
+        # python-dateutil 2.2 raises TypeError for strings without any date
+        except (ValueError, TypeError, OverflowError) as exc:
+            raise DBLogException("Invalid bulk filter {}: {}".format(criteria, exc))
+
+    def _filter_query(self, criteria):
+        query = {}
+        if criteria.get('ids'):
+            if not isinstance(criteria['ids'], list):
+                raise ValueError("ids must be a list")
+            query['id'] = {'$in': [int(log_id) for log_id in criteria['ids']]}
+        id_range = {}
+        if criteria.get('id_from') is not None:
+            id_range['$gte'] = int(criteria['id_from'])
+        if criteria.get('id_to') is not None:
+            id_range['$lte'] = int(criteria['id_to'])
+        if id_range:
+            query.setdefault('id', {}).update(id_range)
+        if criteria.get('transactionId'):
+            transactions = criteria['transactionId']
+            if not isinstance(transactions, list):
+                transactions = [transactions]
+            query['transactionId'] = {'$in': transactions}
+        for field in ('api', 'app'):
+            if criteria.get(field):
+                query[field] = criteria[field]
+        date_range = {}
+        if criteria.get('date_from'):
+            date_range['$gte'] = dateutil.parser.parse(criteria['date_from'])
+        if criteria.get('date_to'):
+            date_range['$lte'] = dateutil.parser.parse(criteria['date_to'])
+        if date_range:
+            query['requestDate'] = date_range
+
+        if not query:
+            raise DBLogException("Bulk filter {} does not select any log".format(criteria))
+        return query
+
+    def _chunked_ids(self, shard, query, chunk_size):
+        """ Yield lists of ids matching query, ordered by id, chunk_size at a time
+        :shard: collection to read
+        :query: mongo query
+        :chunk_size: max ids per list
+        """
+        for docs in self._chunked_docs(shard, query, chunk_size):
+            yield [doc['id'] for doc in docs]
+
+    def _chunked_docs(self, shard, query, chunk_size, fields=()):
+        """ Yield lists of documents matching query, ordered by id, chunk_size at a time
+        :fields: fields read besides id
+        """
+        projection = dict([('_id', False), ('id', True)] + [(self._key(field), True) for field in fields])
+        last_id = None
+        while True:
+            spec = query if last_id is None else {'$and': [query, {'id': {'$gt': last_id}}]}
+            spec = self._query(spec)
+            with self._watch('bulk', shard, spec, [('id', 1)], chunk_size):
+                cursor = shard.find(spec, projection, **self._read_options('bulk', shard))
+                docs = list(self._decode_all(cursor.sort('id', 1).limit(chunk_size)))
+            if not docs:
+                return
+            yield docs
+            if len(docs) < chunk_size:
+                return
+            last_id = docs[-1]['id']
+
+    def _outdated_query(self, version, date_from=None, date_to=None):
+        """ Query of logs with a raw line parsed by a parser version lower than version
+        """
+        query = {'raw_line': {'$exists': True}, 'parserVersion': {'$lt': version}}
+        date_range = {}
+        if date_from:
+            date_range['$gte'] = dateutil.parser.parse(date_from)
+        if date_to:
+            date_range['$lte'] = dateutil.parser.parse(date_to)
+        if date_range:
+            query['requestDate'] = date_range
+        return query
+
+    def count_outdated(self, version, date_from=None, date_to=None):
+        """ Number of logs whose raw line can be reparsed by a parser version
+        :date_from: min request date
+        :date_to: max request date
+        """
+        query = self._query(self._outdated_query(version, date_from, date_to))
+        return sum(shard.find(query, **self._read_options('bulk', shard)).count() for shard in self.shards)
+
+    def outdated_lines(self, version, date_from=None, date_to=None, chunk_size=None):
+        """ Yield tuples with a shard and a list of its logs parsed by an older parser, with id and raw_line
+        :version: current parser version
+        :date_from: min request date
+        :date_to: max request date
+        :chunk_size: logs per list
+        """
+        query = self._outdated_query(version, date_from, date_to)
+        for shard in self.shards:
+            for docs in self._chunked_docs(shard, query, chunk_size or RAW_LINES['chunk_size'], ('raw_line',)):
+                yield shard, docs
+
+    def update_parsed(self, shard, docs, operation_ack=1):
+        """ Replace the parsed fields of logs read from shard by outdated_lines
+        :docs: reparsed documents with their id and parserVersion
+        """
+        for doc in docs:
+            fields = dict((key, value) for key, value in doc.items() if key not in ('_id', 'id', 'raw_line'))
+            self._add_search_tokens(fields)
+            update = {'$set': fields}
+            if self.codec:
+                update = self.codec.encode_update(update)
+            shard.update({'id': doc['id']}, update, w=operation_ack)
+        self._mark_written([doc['id'] for doc in docs])
+        mark_changed(self.dbconn, self.coll)
+
+    def count_archivable(self, before):
+        """ Number of logs with a request date before a date
+        :before: datetime
+        """
+        query = self._query({'requestDate': {'$lt': before}})
+        return sum(shard.find(query, **self._read_options('bulk', shard)).count() for shard in self.shards)
+
+    def archivable_docs(self, before, segment_docs=None):
+        """ Yield tuples with a shard and a list of its full logs with a request date before a date, by id
+        :before: datetime
+        :segment_docs: logs per list
+        """
+        projection = {"_id": False, "search_tokens": False}
+        if self.codec:
+            projection = self.codec.encode_projection(projection)
+        for shard in self.shards:
+            for ids in self._chunked_ids(shard, {'requestDate': {'$lt': before}},
+                                         segment_docs or ARCHIVE['segment_docs']):
+                cursor = shard.find({'id': {'$in': ids}}, projection, **self._read_options('bulk', shard))
+                yield shard, list(self._decode_all(cursor))
+
+    def remove_ids(self, shard, ids, chunk_size=None, throttle=None, operation_ack=1):
+        """ Remove logs of a shard by id in chunks
+        :chunk_size: logs removed per operation
+        :throttle: seconds to wait between chunks
+        :return number of logs removed
+        """
+        chunk_size = chunk_size or ARCHIVE['chunk_size']
+        throttle = ARCHIVE['throttle'] if throttle is None else throttle
+        removed = 0
+        for start in xrange(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            result = shard.remove({'id': {'$in': chunk}}, w=operation_ack)
+            removed += result['n'] if result else len(chunk)
+            time.sleep(throttle)
+        mark_changed(self.dbconn, self.coll)
+        return removed
+
+    def bulk_delete(self, criteria, chunk_size=None, throttle=None, operation_ack=1):
+        """ Delete every log selected by criteria in chunks
+        :criteria: bulk filter (see _build_filter)
+        :chunk_size: documents removed per operation
+        :throttle: seconds to wait between chunks
+        :raises DBLogException
+        :return dict with matched and deleted counts
+        """
+        chunk_size = chunk_size or BULK_OPERATIONS['chunk_size']
+        throttle = BULK_OPERATIONS['throttle'] if throttle is None else throttle
+        query = self._build_filter(criteria)
+        matched = deleted = 0
+        for shard in self.shards:
+            for ids in self._chunked_ids(shard, query, chunk_size):
+                matched += len(ids)
+                result = shard.remove({'id': {'$in': ids}}, w=operation_ack)
+                deleted += result['n'] if result else len(ids)
+                time.sleep(throttle)
+        mark_changed(self.dbconn, self.coll)
+        return {'matched': matched, 'deleted': deleted}
+
+    def _build_update(self, data):
+        """ Build a mongo update from a bulk update
+        :data: fields to set or a dict of update operators in BULK_OPERATIONS operators
+        :raises DBLogException if the update is empty, uses other operators or touches id or _id
+        :return mongo update
+        """
+        if not isinstance(data, dict) or not data:
+            raise DBLogException("Bulk update {} does not change any field".format(data))
+        if all(key.startswith('$') for key in data):
+            update = data
+        elif any(key.startswith('$') for key in data):
+            raise DBLogException("Bulk update {} mixes fields and operators".format(data))
+        else:
+            update = {'$set': data}
+        for operator, fields in update.items():
+            if operator not in BULK_OPERATIONS['operators']:
+                raise DBLogException("Bulk update operator {} is not allowed".format(operator))
+            if not isinstance(fields, dict) or not fields:
+                raise DBLogException("Bulk update operator {} needs an object of fields".format(operator))
+            if any(field.split('.')[0] in ('id', '_id') for field in fields):
+                raise DBLogException("Bulk update {} must not change id or _id".format(data))
+        return update
+
+    def bulk_update(self, criteria, data, chunk_size=None, throttle=None, operation_ack=1):
+        """ Update every log selected by criteria in chunks
+        :criteria: bulk filter (see _build_filter)
+        :data: fields to set or a dict of update operators (see _build_update)
+        :chunk_size: documents updated per operation
+        :throttle: seconds to wait between chunks
+        :raises DBLogException
+        :return dict with matched and updated counts
+        """
+        chunk_size = chunk_size or BULK_OPERATIONS['chunk_size']
+        throttle = BULK_OPERATIONS['throttle'] if throttle is None else throttle
+        update = self._build_update(data)
+        if self.codec:
+            update = self.codec.encode_update(update)
+        query = self._build_filter(criteria)
+        matched = updated = 0
+        for shard in self.shards:
+            for ids in self._chunked_ids(shard, query, chunk_size):
+                matched += len(ids)
+                result = shard.update({'id': {'$in': ids}}, update, multi=True, w=operation_ack)
+                updated += result['n'] if result else len(ids)
+                time.sleep(throttle)
+        mark_changed(self.dbconn, self.coll)
+        return {'matched': matched, 'updated': updated}
+
+
+class LatencyDao(Dao):
+    """ Latency sketches by time bucket, api, app and origin, merged with $inc by every worker
+    """
+    coll = 'latency'
+
+    def flush(self, sketches, operation_ack=1):
+        """ Add pending sketches to the stored ones
+        :sketches: dict of LatencySketch by (bucket, api, app, origin)
+        """
+        for (bucket, api, app, origin), sketch in sketches.items():
+            increments = dict(('bins.{}'.format(index), count) for index, count in sketch.bins.items())
+            increments.update({'zero': sketch.zero, 'total': sketch.total})
+            self.dbcoll.update({'_id': u'{0}|{1}|{2}|{3}'.format(bucket.isoformat(), api, app, origin)},
+                               {'$inc': increments,
+                                '$set': {'bucket': bucket, 'api': api, 'app': app, 'origin': origin}},
+                               upsert=True, w=operation_ack)
+
+    def ensure_index(self):
+        """ Index sketches by bucket
+        """
+        self.dbcoll.ensure_index([('bucket', 1), ('api', 1)], background=True)
+
+    def sketch(self, date_from=None, date_to=None, relative_accuracy=0.01, **fields):
+        """ Merged sketch of a time window
+        :date_from: min bucket start
+        :date_to: max bucket start
+        :fields: api, app or origin values to match
+        """
+        query = dict((field, value) for field, value in fields.items() if value)
+        date_range = {}
+        if date_from:
+            date_range['$gte'] = dateutil.parser.parse(date_from)
+        if date_to:
+            date_range['$lte'] = dateutil.parser.parse(date_to)
+        if date_range:
+            query['bucket'] = date_range
+        merged = LatencySketch(relative_accuracy)
+        for doc in self.dbcoll.find(query, {'_id': False, 'bins': True, 'zero': True, 'total': True},
+                                    **read_options('list', self.dbconn.connection)):
+            merged.merge(LatencySketch(relative_accuracy, dict((int(index), count) for index, count in
+                                                               doc.get('bins', {}).items()),
+                                       doc.get('zero', 0), doc.get('total', 0.0)))
+        return merged
+
+
+class SamplingDao(Dao):
+    """ Received and stored log counts by time bucket, api, app and responseCode, added with $inc by every worker
+    """
+    coll = 'sampling'
+
+    def flush(self, counts, operation_ack=1):
+        """ Add pending counts to the stored ones
+        :counts: dict of [received, kept] by (bucket, api, app, responseCode)
+        """
+        for (bucket, api, app, response_code), (received, kept) in counts.items():
+            self.dbcoll.update({'_id': u'{0}|{1}|{2}|{3}'.format(bucket.isoformat(), api, app, response_code)},
+                               {'$inc': {'received': received, 'kept': kept},
+                                '$set': {'bucket': bucket, 'api': api, 'app': app, 'responseCode': response_code}},
+                               upsert=True, w=operation_ack)
+
+    def ensure_index(self):
+        """ Index counts by bucket
+        """
+        self.dbcoll.ensure_index([('bucket', 1), ('api', 1)], background=True)
+
+    def totals(self, date_from=None, date_to=None, **fields):
+        """ Received and stored logs of a time window by api, app and responseCode
+        :date_from: min bucket start
+        :date_to: max bucket start
+        :fields: api, app or responseCode values to match
+        :return list of dicts, most received first
+        """
+        query = dict((field, value) for field, value in fields.items() if value)
+        date_range = {}
+        if date_from:
+            date_range['$gte'] = dateutil.parser.parse(date_from)
+        if date_to:
+            date_range['$lte'] = dateutil.parser.parse(date_to)
+        if date_range:
+            query['bucket'] = date_range
+        totals = {}
+        for doc in self.dbcoll.find(query, {'_id': False, 'bucket': False},
+                                    **read_options('list', self.dbconn.connection)):
+            key = (doc.get('api'), doc.get('app'), doc.get('responseCode'))
+            total = totals.setdefault(key, {'api': key[0], 'app': key[1], 'responseCode': key[2], 'received': 0,
+                                            'kept': 0})
+            total['received'] += doc.get('received', 0)
+            total['kept'] += doc.get('kept', 0)
+        return sorted(totals.values(), key=lambda total: total['received'], reverse=True)
+
+
+class TracesDao(Dao):
+    """ Per transaction traces keyed by transactionId, upserted with $set by every worker
+    """
+    coll = 'traces'
+
+    def flush(self, traces, operation_ack=1):
+        """ Add pending hops to the stored traces. BE hops are stored by log id, so a retried flush sets them again
+        instead of adding them twice
+        :traces: dict of {'fe': hop or None, 'be': list of hops} by transactionId
+        """
+        now = datetime.datetime.utcnow()
+        for transaction_id, trace in traces.items():
+            update = {'$set': {'updated': now}}
+            if trace['fe']:
+                update['$set']['fe'] = trace['fe']
+            for step in trace['be']:
+                update['$set']['be.{}'.format(step['id'])] = step
+            self.dbcoll.update({'_id': transaction_id}, update, upsert=True, w=operation_ack)
+
+    def ensure_index(self, ttl=None):
+        """ Expire traces ttl seconds after their last update
+        """
+        if ttl:
+            self.dbcoll.ensure_index('updated', expireAfterSeconds=ttl, background=True)
+
+    def get(self, transaction_id):
+        """ Trace of a transaction with its start, end, duration and final responseCode, None when unknown
+        """
+        trace = self.dbcoll.find_one({'_id': transaction_id}, **read_options('get', self.dbconn.connection))
+        if trace:
+            trace['transactionId'] = trace.pop('_id')
+            trace['be'] = trace.get('be', {}).values()
+            summarize(trace)
+        return trace
+
+
+class HeavyHittersDao(Dao):
+    """ Space saving summaries of each worker by tracked field and time bucket
+    """
+    coll = 'heavy_hitters'
+
+    def flush(self, worker, summaries, operation_ack=1):
+        """ Replace the stored summaries of a worker
+        :worker: worker identifier
+        :summaries: dict of SpaceSaving by (tracked field, bucket)
+        """
+        for (field, bucket), summary in summaries.items():
+            self.dbcoll.update({'_id': u'{0}|{1}|{2}'.format(field, bucket.isoformat(), worker)},
+                               {'$set': {'field': field, 'bucket': bucket, 'min': summary.min_count(),
+                                         'counters': [[value, count, error] for value, (count, error) in
+                                                      summary.counters.items()]}},
+                               upsert=True, w=operation_ack)
+
+    def ensure_index(self):
+        """ Index summaries by field and bucket
+        """
+        self.dbcoll.ensure_index([('field', 1), ('bucket', 1)], background=True)
+
+    def top(self, field, date_from=None, date_to=None, limit=10, capacity=200):
+        """ Most frequent values of a field in a time window
+        :field: tracked field
+        :date_from: min bucket start
+        :date_to: max bucket start
+        :return list of (value, count, error), count being an upper bound and count - error a lower bound
+        """
+        query = {'field': field}
+        date_range = {}
+        if date_from:
+            date_range['$gte'] = dateutil.parser.parse(date_from)
+        if date_to:
+            date_range['$lte'] = dateutil.parser.parse(date_to)
+        if date_range:
+            query['bucket'] = date_range
+        summaries = [(dict((value, (count, error)) for value, count, error in doc['counters']), doc['min'])
+                     for doc in self.dbcoll.find(query, {'_id': False, 'counters': True, 'min': True},
+                                                 **read_options('list', self.dbconn.connection))]
+        return heavyhitters.merge(summaries, capacity).top(limit)
+
+
+class RejectedLinesDao(Dao):
+    """ Log lines rejected by the parser, with the parser version that rejected them
+    """
+    coll = RAW_LINES['rejected_collection']
+
+    def insert_line(self, line, reason, version, operation_ack=0):
+        """ Store a rejected line compressed
+        :reason: parser error
+        :version: parser version
+        """
+        self.dbcoll.insert({'time': datetime.datetime.utcnow(), 'raw_line': pack_line(line), 'reason': reason,
+                            'parserVersion': version}, w=operation_ack)
+
+    def ensure_index(self):
+        """ Index rejected lines by parser version and reception time
+        """
+        self.dbcoll.ensure_index([('parserVersion', 1), ('time', 1)], background=True)
+
+    def _query(self, version, date_from=None, date_to=None):
+        query = {'parserVersion': {'$lt': version}}
+        date_range = {}
+        if date_from:
+            date_range['$gte'] = dateutil.parser.parse(date_from)
+        if date_to:
+            date_range['$lte'] = dateutil.parser.parse(date_to)
+        if date_range:
+            query['time'] = date_range
+        return query
+
+    def count_outdated(self, version, date_from=None, date_to=None):
+        """ Number of lines rejected by an older parser version, received between date_from and date_to
+        """
+        return self.dbcoll.find(self._query(version, date_from, date_to)).count()
+
+    def outdated_lines(self, version, date_from=None, date_to=None, chunk_size=None):
+        """ Yield lists of lines rejected by an older parser version, ordered by _id, chunk_size at a time
+        """
+        chunk_size = chunk_size or RAW_LINES['chunk_size']
+        query = self._query(version, date_from, date_to)
+        last_id = None
+        while True:
+            spec = query if last_id is None else {'$and': [query, {'_id': {'$gt': last_id}}]}
+            docs = list(self.dbcoll.find(spec, {'raw_line': True}).sort('_id', 1).limit(chunk_size))
+            if not docs:
+                return
+            yield docs
+            if len(docs) < chunk_size:
+                return
+            last_id = docs[-1]['_id']
+
+    def remove_lines(self, object_ids, operation_ack=1):
+        """ Remove lines stored as logs
+        """
+        return self.dbcoll.remove({'_id': {'$in': object_ids}}, w=operation_ack)
+
+    def mark_lines(self, object_ids, reason, version, operation_ack=1):
+        """ Record the error and version of a parser that rejected lines again
+        """
+        return self.dbcoll.update({'_id': {'$in': object_ids}}, {'$set': {'reason': reason, 'parserVersion': version}},
+                                  multi=True, w=operation_ack)
+
+
+class JobsDao(Dao):
+    """ Progress of background jobs, readable from every worker
+    """
+    coll = 'jobs'
+
+    def create(self, kind, params):
+        """ Store a new job
+        :kind: job type
+        :params: job arguments
+        :return job id
+        """
+        job_id = ObjectId()
+        now = datetime.datetime.utcnow()
+        self.dbcoll.insert({'_id': job_id, 'kind': kind, 'params': params, 'state': 'queued', 'started': now,
+                            'updated': now}, w=1)
+        return str(job_id)
+
+    def update(self, job_id, progress):
+        """ Set progress fields of a job
+        """
+        fields = dict(progress, updated=datetime.datetime.utcnow())
+        return self.dbcoll.update({'_id': ObjectId(job_id)}, {'$set': fields}, w=1)
+
+    def get(self, job_id):
+        """ Job with its progress, None when unknown
+        """
+        if not ObjectId.is_valid(job_id):
+            return None
+        job = self.dbcoll.find_one({'_id': ObjectId(job_id)}, **primary_options())
+        if job:
+            job['id'] = str(job.pop('_id'))
+        return job
 
 
 class DB(object):
     """ DB generic information class
     """
-    def __init__(self):
-        client = Connection()
-        self.dbconn = client.get_connection()
+    def __init__(self, dbconn=None):
+        """
+        :dbconn: database to use instead of the configured connection
+        """
+        if dbconn is None:
+            client = Connection()
+            dbconn = client.get_connection()
+        self.dbconn = dbconn
+        self.stats_indexed = False
 
     def get_collection_names(self, include_system_collections=False):
         """ Return all collections names in database
         """
         return self.dbconn.collection_names(include_system_collections)
 
+    def _databases(self, name):
+        """ Databases holding collection name, every shard for requests when sharding is enabled
+        :name: collection name
+        """
+        if SHARDING['enabled'] and name == RequestsDao.coll:
+            return Connection().get_shard_connections()
+        return [self.dbconn]
+
     def drop_collection(self, name):
-        """ Drop selected collection from database
+        """ Drop selected collection from database, from every shard holding it
         :name: collection name
         """
-        return self.dbconn.drop_collection(name)
+        for database in self._databases(name):
+            database.drop_collection(name)
 
     def get_option(self, name):
         """ Get data options from collection 'name'
@@ -150,7 +1208,87 @@ class DB(object):
         return self.dbconn[name].options()
 
     def count(self, name):
-        """ Get collection count
+        """ Get collection count, adding up every shard holding it
         :name: collection name
         """
-        return self.dbconn[name].count()
+        count = 0
+        for database in self._databases(name):
+            options = read_options('count', database.connection)
+            count += database[name].find(**options).count() if options else database[name].count()
+        return count
+
+    def stats(self, name):
+        """ Storage statistics and growth of collection name, cached for COLLECTION_STATS['cache_ttl'] seconds
+        Requests stats add up every shard when sharding is enabled
+        :name: collection name
+        :raises DBLogException if the collection does not exist
+        :return dict with document count, sizes in bytes, index sizes by name and growth per day
+        """
+        cached = _stats_cache.get(name)
+        if cached and time.time() - cached[0] < COLLECTION_STATS['cache_ttl']:
+            return cached[1]
+        databases = self._databases(name)
+        stats = {'count': 0, 'size': 0, 'storage_size': 0, 'total_index_size': 0, 'index_sizes': {}}
+        for database in databases:
+            try:
+                result = database.command('collstats', name)
+            except OperationFailure as exc:
+                raise DBLogException("Collection {0} stats not available: {1}".format(name, exc))
+            stats['count'] += result.get('count', 0)
+            stats['size'] += result.get('size', 0)
+            stats['storage_size'] += result.get('storageSize', 0)
+            stats['total_index_size'] += result.get('totalIndexSize', 0)
+            for index, size in result.get('indexSizes', {}).items():
+                stats['index_sizes'][index] = stats['index_sizes'].get(index, 0) + size
+        stats['avg_obj_size'] = stats['size'] // stats['count'] if stats['count'] else 0
+        stats['growth'] = self._growth(name, stats)
+        _stats_cache[name] = (time.time(), stats)
+        return stats
+
+    def ensure_stats_index(self):
+        """ Expire size samples after twice the growth window
+        """
+        self.dbconn[COLLECTION_STATS['collection']].ensure_index(
+            'time', expireAfterSeconds=2 * COLLECTION_STATS['growth_window'], background=True)
+
+    def _growth(self, name, stats):
+        """ Store a size sample of collection name for this interval and measure growth from an older one
+        :return dict with bytes and documents per day and the seconds measured, None without an older sample
+        """
+        if not self.stats_indexed:
+            self.ensure_stats_index()
+            self.stats_indexed = True
+        samples = self.dbconn[COLLECTION_STATS['collection']]
+        now = datetime.datetime.utcnow()
+        interval = int(calendar.timegm(now.utctimetuple()) // COLLECTION_STATS['sample_interval'])
+        samples.update({'_id': '{0}:{1}'.format(name, interval)},
+                       {'$setOnInsert': {'name': name, 'time': now, 'size': stats['size'], 'count': stats['count']}},
+                       upsert=True, w=0)
+        since = now - datetime.timedelta(seconds=COLLECTION_STATS['growth_window'])
+        oldest = list(samples.find({'name': name, 'time': {'$gte': since}}).sort('time', 1).limit(1))
+        if not oldest:
+            return None
+        seconds = (now - oldest[0]['time']).total_seconds()
+        if seconds < COLLECTION_STATS['sample_interval']:
+            return None
+        return {'seconds': int(seconds),
+                'bytes_per_day': int((stats['size'] - oldest[0]['size']) * 86400 / seconds),
+                'documents_per_day': int((stats['count'] - oldest[0]['count']) * 86400 / seconds)}
+
+    def slow_operations(self, limit=50):
+        """ Last recorded slow operations, newest first
+        :limit: max operations returned
+        """
+        return self.dbconn[SLOW_OPERATIONS['collection']].find({}, {'_id': False}).sort(
+            '$natural', -1).limit(limit)
+
+    def ensure_slow_operations(self):
+        """ Create the capped collection of slow operations
+        """
+        if SLOW_OPERATIONS['collection'] not in self.dbconn.collection_names():
+            try:
+                self.dbconn.create_collection(SLOW_OPERATIONS['collection'], capped=True,
+                                              size=SLOW_OPERATIONS['size'])
+            except Exception as exc:
+                # created by another worker meanwhile
+                logger_mongo.info("Slow operations collection not created: {}".format(exc))
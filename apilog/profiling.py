@@ -0,0 +1,119 @@
+""" On demand cProfile sampling of live workers
+
+While enabled, one in sample_rate calls of each profiled function runs under cProfile. Profiles are aggregated by
+function name and dumped as pstats files every dump_interval seconds and when profiling is disabled. gevent switches
+greenlets inside the profiled thread, so a sampled call also accounts the greenlets that ran while it waited on I/O,
+and calls made while a sample runs are not sampled, as the interpreter holds one profiler at a time.
+Disabled, a profiled call costs one attribute check.
+"""
+import os
+import time
+import signal
+import pstats
+import cProfile
+import functools
+
+from .settings import PROFILING
+
+
+class Profiler(object):
+    """ Sampling cProfile aggregator
+    """
+    def __init__(self, directory, sample_rate=100, dump_interval=60):
+        """
+        :directory: where pstats files are dumped
+        :sample_rate: one in sample_rate calls is profiled
+        :dump_interval: seconds between dumps
+        """
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.dump_interval = dump_interval
+        self.enabled = False
+        self.calls = 0
+        # a sampled call is running
+        self.active = False
+        self.stats = {}
+        self.last_dump = time.time()
+
+    def enable(self, sample_rate=None):
+        if sample_rate:
+            self.sample_rate = sample_rate
+        self.last_dump = time.time()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        return self.dump()
+
+    def toggle(self, *args):
+        """ Enable or disable profiling, usable as a signal handler
+        """
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def profile(self, name, function, *args, **kwargs):
+        """ Call function, under cProfile for one in sample_rate calls while enabled
+        :name: profile the call is aggregated into
+        """
+        if not self.enabled:
+            return function(*args, **kwargs)
+        self.calls += 1
+        if self.calls % self.sample_rate or self.active:
+            return function(*args, **kwargs)
+        profile = cProfile.Profile()
+        self.active = True
+        try:
+            return profile.runcall(function, *args, **kwargs)
+        finally:
+            self.active = False
+            if name in self.stats:
+                self.stats[name].add(profile)
+            else:
+                self.stats[name] = pstats.Stats(profile)
+            if time.time() - self.last_dump >= self.dump_interval:
+                self.dump()
+
+    def dump(self):
+        """ Write aggregated profiles and start new ones
+        :return list of written files
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        paths = []
+        for name, stats in self.stats.items():
+            path = os.path.join(self.directory, '{0}-{1}-{2}.prof'.format(name, os.getpid(),
+                                                                       time.strftime('%Y%m%dT%H%M%S')))
+            stats.dump_stats(path)
+            paths.append(path)
+        self.stats = {}
+        self.last_dump = time.time()
+        return paths
+
+    def status(self):
+        return {'enabled': self.enabled, 'sample_rate': self.sample_rate, 'profiles': sorted(self.stats),
+                'directory': self.directory}
+
+
+profiler = Profiler(PROFILING['directory'], PROFILING['sample_rate'], PROFILING['dump_interval'])
+if PROFILING['enabled']:
+    profiler.enable()
+
+
+def profiled(name):
+    """ Decorator sampling calls of a function into profile name
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return profiler.profile(name, function, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def install_signal(signal_name):
+    """ Toggle profiling of this worker with a signal, e.g. kill -USR2 <worker pid>
+    :signal_name: signal module attribute name
+    """
+    signal.signal(getattr(signal, signal_name), profiler.toggle)
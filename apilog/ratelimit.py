@@ -0,0 +1,72 @@
+""" Token bucket rate limits shared by every worker of the host
+
+Buckets live in a sqlite file, so gunicorn workers draw from the same tokens. Each acquire refills the buckets for
+the elapsed time and takes the requested tokens of all of them, or of none, inside one immediate transaction. The api
+runs acquires through apilog.blocking.offload, so a worker waiting for the lock of another one does not stall its other
+greenlets.
+"""
+import os
+import time
+import sqlite3
+
+
+class TokenBuckets(object):
+    """ Sqlite backed token buckets by key
+    """
+    def __init__(self, path):
+        """
+        :path: sqlite database file, ':memory:' for buckets of a single process
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+
+    def acquire(self, key, rate, burst, cost=1):
+        """ Take cost tokens from the bucket of key
+        :rate: tokens added per second
+        :burst: bucket size, tokens of a new bucket. Larger costs take a full bucket
+        :return 0 when taken, otherwise seconds until cost tokens are available
+        """
+        return self.acquire_many([(key, rate, burst, cost)])[0]
+
+    def acquire_many(self, requests):
+        """ Take tokens from several buckets, from all of them or from none
+        :requests: list of tuples (key, rate, burst, cost) as taken by acquire
+        :return list with the wait of each request, all 0 when the tokens were taken
+        """
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            buckets, waits = [], []
+            for key, rate, burst, cost in requests:
+                cost = min(cost, burst)
+                row = self.conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                buckets.append((key, tokens, cost))
+                waits.append(0 if tokens >= cost else (cost - tokens) / float(rate))
+            taken = not any(waits)
+            self.conn.executemany('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                                  [(key, tokens - cost if taken else tokens, now) for key, tokens, cost in buckets])
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return waits
+
+
+def log_key(data):
+    """ App and origin of a log without parsing it
+    :data: dict or plain text log line, whose sixth and fifth words are app and origin
+    :return tuple (app, origin), empty strings when unknown
+    """
+    if isinstance(data, dict):
+        return data.get('app') or '', data.get('origin') or ''
+    if isinstance(data, basestring):
+        words = data.split(None, 6)
+        if len(words) > 5:
+            return words[5], words[4]
+    return '', ''
@@ -0,0 +1,84 @@
+""" Status aware sampling of received logs
+
+Rules are checked in order and the first one matching the api, app and responseCode of a log sets the fraction of
+those logs stored; logs no rule matches are stored. responseCode matches an exact code or a class such as '2xx'.
+The decision hashes the transactionId, so the FE and BE logs of a transaction are kept or dropped together. Every
+received log is counted by time bucket, api, app and responseCode before sampling, so totals stay exact.
+"""
+import random
+import hashlib
+import datetime
+
+FIELDS = ('api', 'app', 'responseCode')
+
+
+def _matches(expected, value):
+    """ Whether a rule value (a string, a code class such as '2xx' or a list of them) matches a log value
+    """
+    if isinstance(expected, (list, tuple)):
+        return any(_matches(item, value) for item in expected)
+    value = u'' if value is None else unicode(value)
+    expected = unicode(expected)
+    if len(expected) == 3 and expected.endswith('xx'):
+        return len(value) == 3 and value[0] == expected[0]
+    return value == expected
+
+
+class Sampler(object):
+    """ Sampling decisions and pre-sampling counts by time bucket, api, app and responseCode, waiting to be flushed
+    """
+    def __init__(self, rules, keep_exceptions=True, bucket=300):
+        """
+        :rules: list of dicts with a rate and any of api, app and responseCode to match
+        :keep_exceptions: store every log with an exceptionId
+        :bucket: seconds per time bucket of the counts
+        """
+        self.rules = rules
+        self.keep_exceptions = keep_exceptions
+        self.bucket = bucket
+        self.counts = {}
+
+    def rate(self, doc):
+        """ Fraction of logs like doc that are stored
+        """
+        if self.keep_exceptions and doc.get('exceptionId'):
+            return 1.0
+        for rule in self.rules:
+            if all(_matches(rule[field], doc.get(field)) for field in FIELDS if field in rule):
+                return float(rule['rate'])
+        return 1.0
+
+    def _draw(self, doc):
+        """ Number in [0, 1) fixed by the transactionId, random without it
+        """
+        transaction_id = doc.get('transactionId')
+        if not transaction_id:
+            return random.random()
+        return int(hashlib.md5(unicode(transaction_id).encode('utf-8')).hexdigest()[:8], 16) / float(0x100000000)
+
+    def keep(self, doc):
+        """ Count a received log and decide whether it is stored, setting its sampleRate when it is
+        """
+        rate = self.rate(doc)
+        kept = rate >= 1 or self._draw(doc) < rate
+        request_date = doc.get('requestDate')
+        if isinstance(request_date, datetime.datetime):
+            start = request_date.replace(tzinfo=None)
+        else:
+            start = datetime.datetime.utcnow()
+        seconds = (start - datetime.datetime(1970, 1, 1)).total_seconds()
+        bucket = datetime.datetime.utcfromtimestamp(seconds - seconds % self.bucket)
+        key = (bucket,) + tuple(doc.get(field) for field in FIELDS)
+        counts = self.counts.setdefault(key, [0, 0])
+        counts[0] += 1
+        if kept:
+            counts[1] += 1
+            doc['sampleRate'] = rate
+        return kept
+
+    def drain(self):
+        """ Take every pending count
+        :return dict of [received, kept] by (bucket, api, app, responseCode)
+        """
+        counts, self.counts = self.counts, {}
+        return counts
@@ -0,0 +1,54 @@
+""" Ingest time token index over exception texts, request bodies and FE urls
+"""
+import re
+
+_TOKEN_REGEXP = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text, min_length=2):
+    """ Lowercase word tokens of text
+    :text: any value, non strings are converted
+    :min_length: shorter tokens are dropped
+    """
+    if not isinstance(text, basestring):
+        text = unicode(text)
+    return [token.lower() for token in _TOKEN_REGEXP.findall(text) if len(token) >= min_length]
+
+
+def _values(value):
+    """ Leaf values of nested dicts and lists
+    """
+    if isinstance(value, dict):
+        for item in value.values():
+            for leaf in _values(item):
+                yield leaf
+    elif isinstance(value, list):
+        for item in value:
+            for leaf in _values(item):
+                yield leaf
+    elif value is not None:
+        yield value
+
+
+def doc_tokens(doc, min_length=2, max_tokens=64):
+    """ Distinct search tokens of a log
+    :doc: log document
+    :return list with at most max_tokens tokens, in order of appearance
+    """
+    sources = [doc.get('exceptionId'), doc.get('exceptionText')]
+    sources.extend(_values(doc.get('body_request') or {}))
+    http_request = doc.get('http_request') or {}
+    if isinstance(http_request, dict):
+        sources.append(http_request.get('url'))
+    tokens = []
+    seen = set()
+    for source in sources:
+        if source is None:
+            continue
+        for token in tokenize(source, min_length):
+            if token not in seen:
+                seen.add(token)
+                tokens.append(token)
+                if len(tokens) >= max_tokens:
+                    return tokens
+    return tokens
@@ -42,7 +42,294 @@ MONGODB = {
     'operation_ack': 0,
     'slave_ok': True,
     'replicaset': '',
-    'autostart': True
+    'autostart': True,
+    # pymongo, or mongomock for an in process store without mongod (tests and offline benchmarks)
+    'backend': os.environ.get('MONGODB_BACKEND', 'pymongo')
+}
+
+# Read preference by dao operation, replacing the global MONGODB['slave_ok'] preference when enabled
+READ_ROUTING = {
+    'enabled': False,
+    # primary, primary_preferred, secondary, secondary_preferred or nearest; missing operations read the primary
+    'operations': {
+        'get': 'primary_preferred',
+        'list': 'secondary_preferred',
+        'search': 'secondary_preferred',
+        'bulk': 'secondary_preferred',
+        'count': 'secondary_preferred',
+        'dedup': 'primary',
+    },
+    # Seconds after a worker writes a log during which its reads of that log go to the primary
+    'read_your_writes': 10,
+    # Recently written ids remembered per worker before pruning
+    'max_written': 100000,
+    # Secondaries lagging more seconds than this are skipped, reads go to the primary
+    'max_staleness': 30,
+    # Seconds between replication lag checks
+    'lag_check': 5
+}
+
+# Client side sharding of the requests collection, ids and dictionary stay in MONGODB
+SHARDING = {
+    'enabled': False,
+    # Order matters, appending shards keeps every stored log reachable through fan-out reads
+    'shards': [
+        {'hosts': ['localhost:27017', ], 'replicaset': ''},
+    ],
+    # 'transactionId' keeps FE and BE logs of a transaction together, 'time' routes by requestDate bucket
+    'key': 'transactionId',
+    # Seconds per requestDate bucket when key is 'time'
+    'time_bucket': 3600
+}
+
+# Log ingestion
+INGEST = {
+    # Logs accepted in one POST as a JSON list
+    'max_batch': 1000,
+    # Give JSON logs the field types and derived fields of parsed log lines, see api.logparser.JSONNormalizer
+    'normalize_json': True
+}
+
+# Bulk operations over the requests collection
+BULK_OPERATIONS = {
+    # Documents touched per multi-document operation
+    'chunk_size': 1000,
+    # Seconds to sleep between chunks so ingestion is not starved
+    'throttle': 0.05,
+    # Update operators accepted by bulk updates, none of them may touch id or _id
+    'operators': ('$set', '$unset', '$inc', '$push', '$pull', '$addToSet')
+}
+
+# JSON libraries used to decode requests and log bodies and to encode responses, first installed one wins
+JSON_CODEC = {
+    'backends': ('ujson', 'simplejson', 'json')
+}
+
+# Compact schema of stored logs (short keys, integer codes, dictionary encoded strings), see apilog.compact
+# Logs stored before enabling it are not converted
+COMPACT_STORAGE = {
+    'enabled': False,
+    # keep, drop or compress the raw body of BE logs
+    'raw_body': 'keep'
+}
+
+# Search tokens stored on every log for the search api, see apilog.search
+SEARCH = {
+    'enabled': True,
+    'min_token_length': 2,
+    'max_tokens': 64,
+    'default_results': 50,
+    'max_results': 500
+}
+
+# Duplicated deliveries filter keyed on transactionId and origin, see apilog.dedup
+DEDUP = {
+    'enabled': False,
+    # Seconds a delivered log is remembered at least
+    'window': 3600,
+    # Bytes of filter per worker
+    'memory': 4 * 1024 * 1024,
+    'hashes': 5,
+    # 409 rejects duplicates, 200 answers with the stored log id
+    'duplicate_status': 409,
+    # Make transactionId and origin index unique, existing duplicates have to be removed first
+    'unique_index': False
+}
+
+# Answer log posts with 202 and a ticket, storing them in batches from a local durable queue
+ASYNC_INGEST = {
+    'enabled': False,
+    # Sqlite queue shared by every worker in the host
+    'path': '/opt/bvp/spool/ingest-queue.db',
+    # Greenlets storing queued logs per worker
+    'workers': 2,
+    'batch_size': 200,
+    # Seconds to wait when the queue is empty
+    'poll_interval': 0.2,
+    # Seconds before logs claimed by a dead worker are queued again
+    'claim_timeout': 60,
+    # Seconds tickets of stored or rejected logs are kept
+    'retention': 86400
+}
+
+# Write logs to local segment files when mongo is unreachable or slow, replaying them once it recovers
+SPOOL = {
+    'enabled': False,
+    'directory': '/opt/bvp/spool/segments',
+    # Seconds an insert may take before the log is spooled instead
+    'insert_timeout': 2,
+    # Segment size at which a new segment is started
+    'segment_bytes': 8 * 1024 * 1024,
+    # Size of the whole spool at which logs are refused with 503
+    'max_bytes': 1024 * 1024 * 1024,
+    # Seconds without appends before a segment is sealed for replay
+    'seal_after': 5,
+    # Seconds between replay attempts while the spool is empty or mongo is down
+    'replay_interval': 1,
+    # Logs per insert when replaying
+    'batch_size': 500,
+    # Seconds before a segment claimed by a dead replayer is replayed again
+    'claim_timeout': 300
+}
+
+# Latency (responseDate - requestDate) quantile sketches by api, app, origin and time bucket
+LATENCY = {
+    'enabled': False,
+    # Seconds per time bucket, the finest window the api can answer
+    'bucket': 300,
+    # Max relative error of returned percentiles
+    'relative_accuracy': 0.01,
+    # Seconds between flushes of each worker sketches
+    'flush_interval': 10
+}
+
+# Store a fraction of high volume logs by api, app and responseCode, counting every received log, see apilog.sampling
+SAMPLING = {
+    'enabled': False,
+    # First rule matching api, app and responseCode (a code, a class such as '2xx' or a list of them) sets the
+    # stored fraction, missing fields match any value and logs no rule matches are stored
+    'rules': [
+        {'responseCode': '2xx', 'rate': 0.01},
+    ],
+    # Store every log with an exceptionId
+    'keep_exceptions': True,
+    # Seconds per time bucket of received and stored counts
+    'bucket': 300,
+    # Seconds between flushes of each worker counts
+    'flush_interval': 10
+}
+
+# Most frequent values of log fields, top level or from BVParser.INTERESTING_FIELDS in body_request
+HEAVY_HITTERS = {
+    'enabled': False,
+    'fields': ('exceptionId', 'msisdn', 'merchantId', 'app'),
+    # Fields counted only in logs with responseCode >= 400, served as failed_<field>
+    'failure_fields': ('app', 'api'),
+    # Counters per field, time bucket and worker
+    'capacity': 200,
+    # Seconds per time bucket
+    'bucket': 300,
+    # Seconds between flushes of each worker summaries
+    'flush_interval': 30,
+    # Values returned by default and at most by the api
+    'default_results': 10,
+    'max_results': 100
+}
+
+# Token bucket limits of received logs per app and origin, shared by the workers of a host
+RATE_LIMIT = {
+    'enabled': False,
+    'path': '/opt/bvp/spool/rate-limit.db',
+    # Logs per second and bucket size of apps without their own limits, None for no limit
+    'default': {'rate': 500, 'burst': 1000},
+    # Limits by 'app|origin' or by 'app'
+    'limits': {
+        # 'FrontendBasic|FE': {'rate': 50, 'burst': 100},
+    }
+}
+
+# Sampled cProfile of log posts and reads, toggled per worker with a signal or the profiling api
+PROFILING = {
+    'enabled': False,
+    'directory': '/opt/bvp/profiles',
+    # One in sample_rate calls is profiled
+    'sample_rate': 100,
+    # Seconds between dumps of aggregated profiles
+    'dump_interval': 60,
+    # Signal toggling profiling in a worker, None to disable
+    'signal': 'SIGUSR2',
+    # X-Profiling-Token of the profiling api, which is forbidden while empty
+    'token': os.environ.get('PROFILING_TOKEN', '')
+}
+
+# Ring of the last stored logs served by the live tail api, shared by the workers of a host
+TAIL = {
+    'enabled': False,
+    'path': '/opt/bvp/spool/tail.db',
+    # Logs kept in the ring
+    'size': 10000,
+    # Seconds between appends of each worker stored logs to the ring
+    'flush_interval': 0.2,
+    # Seconds a tail request waits for new logs, and between checks
+    'timeout': 25,
+    'poll_interval': 0.25,
+    # Logs returned by default and at most per request
+    'default_results': 100,
+    'max_results': 1000
+}
+
+# Keep the compressed raw line and parser version of parsed logs, and the lines the parser rejects, to reparse them
+# with newer BVParser versions through the reprocess api
+RAW_LINES = {
+    'enabled': False,
+    'rejected_collection': 'rejected',
+    # Logs reparsed per chunk and seconds to sleep between chunks so ingestion is not starved
+    'chunk_size': 500,
+    'throttle': 0.05
+}
+
+# Per transaction traces of the stored FE and BE logs, upserted by each worker every flush_interval, see apilog.traces
+TRACES = {
+    'enabled': False,
+    'flush_interval': 5,
+    # Transactions each worker keeps between flushes, logs of new ones are not traced beyond it
+    'max_pending': 100000,
+    # Seconds traces are kept after their last update, None to keep them forever
+    'ttl': 30 * 86400
+}
+
+# Storage statistics of the collection api, sampled when requested to measure growth
+COLLECTION_STATS = {
+    # Seconds collstats results are served from the worker cache
+    'cache_ttl': 60,
+    # Collection keeping one size sample per collection and interval, expired after twice the growth window
+    'collection': 'collstats',
+    'sample_interval': 3600,
+    # Seconds back to the sample growth is measured from, the oldest sample when there is none that old
+    'growth_window': 86400
+}
+
+# Log reads of the requests collection slower than threshold seconds with a summary of their query plan
+SLOW_OPERATIONS = {
+    'enabled': False,
+    'threshold': 0.5,
+    # Capped collection where slow operations are recorded and its size in bytes
+    'collection': 'slowops',
+    'size': 16 * 1024 * 1024,
+    # Seconds before another operation with the same query shape is explained and recorded
+    'min_interval': 60,
+    # Slow operations returned by default and at most by the slow operations api
+    'default_results': 50,
+    'max_results': 500
+}
+
+# Move logs older than max_age_days from the requests collection to compressed segment files of directory through the
+# archive api. Reads by id or request date range fall back to the segments of this host
+ARCHIVE = {
+    'enabled': False,
+    'directory': '/opt/bvp/archive',
+    'max_age_days': 90,
+    # Logs per segment file, logs removed from mongo per operation and seconds to sleep between removes
+    'segment_docs': 10000,
+    'chunk_size': 500,
+    'throttle': 0.05,
+    'compress_level': 6
+}
+
+# Conditional GET (ETag, Last-Modified and 304 answers) of the log list and collection apis, whose rendered responses
+# each worker serves for ttl seconds. Log list responses are then served while the newest stored id and the change
+# counter of the requests collection stay the same, and every response is rendered again after max_age seconds
+RESPONSE_CACHE = {
+    'enabled': False,
+    'ttl': 2,
+    'max_age': 30,
+    'max_entries': 1000
+}
+
+# Serve POST log ingestion through the thin WSGI application in apilog.fastpath
+FAST_INGEST = {
+    'enabled': False,
+    'path': '/partnerprovisioning/v1/log/'
 }
 
 # Hosts/domain names that are valid for this site; required if DEBUG is False
@@ -0,0 +1,104 @@
+""" Mergeable latency quantile sketches
+
+LatencySketch keeps counts in logarithmic bins (as DDSketch does), so any quantile is returned with a bounded relative
+error and two sketches are merged by adding their bin counts. That makes them cheap to keep per worker and to store
+with $inc, merging workers and time buckets in mongo.
+"""
+import math
+import datetime
+from dateutil.tz import tzutc
+
+
+class LatencySketch(object):
+    """ Quantile sketch of positive values with relative_accuracy error
+    """
+    def __init__(self, relative_accuracy=0.01, bins=None, zero=0, total=0.0):
+        """
+        :relative_accuracy: max relative error of returned quantiles
+        :bins: counts by bin index
+        :zero: count of values too small to be binned
+        :total: sum of every value
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = dict(bins or {})
+        self.zero = zero
+        self.total = total
+
+    @property
+    def count(self):
+        return self.zero + sum(self.bins.values())
+
+    def add(self, value):
+        """ Add one value
+        """
+        self.total += value
+        if value < 1e-9:
+            self.zero += 1
+        else:
+            index = int(math.ceil(math.log(value) / self.log_gamma))
+            self.bins[index] = self.bins.get(index, 0) + 1
+
+    def merge(self, other):
+        """ Add the values of other, a sketch with the same accuracy
+        """
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero += other.zero
+        self.total += other.total
+
+    def quantile(self, fraction):
+        """ Value at fraction (0 to 1) of the sorted values, None for empty sketches
+        """
+        count = self.count
+        if not count:
+            return None
+        rank = fraction * (count - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+
+class LatencyRecorder(object):
+    """ Sketches of received logs by time bucket, api, app and origin, waiting to be flushed
+    """
+    def __init__(self, bucket=300, relative_accuracy=0.01):
+        """
+        :bucket: seconds per time bucket
+        :relative_accuracy: sketch accuracy
+        """
+        self.bucket = bucket
+        self.relative_accuracy = relative_accuracy
+        self.sketches = {}
+
+    def record(self, doc):
+        """ Add the latency of a log, logs without both dates are ignored
+        :return latency in milliseconds or None
+        """
+        request_date, response_date = doc.get('requestDate'), doc.get('responseDate')
+        if not isinstance(request_date, datetime.datetime) or not isinstance(response_date, datetime.datetime):
+            return None
+        # buckets are naive utc, as stored dates
+        request_date, response_date = [value.astimezone(tzutc()).replace(tzinfo=None) if value.tzinfo else value
+                                       for value in (request_date, response_date)]
+        latency = max((response_date - request_date).total_seconds() * 1000, 0)
+        seconds = (request_date - datetime.datetime(1970, 1, 1)).total_seconds()
+        bucket = datetime.datetime.utcfromtimestamp(seconds - seconds % self.bucket)
+        key = (bucket, doc.get('api'), doc.get('app'), doc.get('origin'))
+        if key not in self.sketches:
+            self.sketches[key] = LatencySketch(self.relative_accuracy)
+        self.sketches[key].add(latency)
+        return latency
+
+    def drain(self):
+        """ Take every pending sketch
+        :return dict of sketches by (bucket, api, app, origin)
+        """
+        sketches, self.sketches = self.sketches, {}
+        return sketches
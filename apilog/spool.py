@@ -0,0 +1,172 @@
+""" Local append-only spool of logs that could not be stored in mongo
+
+Each worker appends to its own open segment file. A record is the crc32 of a BSON document followed by the document,
+so a torn write at the end of a segment is detected and skipped on replay. Full or idle segments are sealed and then
+claimed by one replayer at a time through atomic renames.
+"""
+import os
+import time
+import zlib
+import struct
+from bson import BSON
+
+OPEN = '.open'
+SEALED = '.sealed'
+REPLAYING = '.replaying'
+_CRC = struct.Struct('<I')
+_LENGTH = struct.Struct('<i')
+
+
+class SpoolFull(Exception):
+    """ The spool reached its size limit
+    """
+
+
+class Spool(object):
+    """ Directory of segment files
+    """
+    def __init__(self, directory, segment_bytes=8 * 1024 * 1024, max_bytes=1024 * 1024 * 1024, seal_after=5,
+                 claim_timeout=300):
+        """
+        :directory: where segment files are written
+        :segment_bytes: size at which a segment is sealed
+        :max_bytes: size of every segment together at which appends are refused
+        :seal_after: seconds without appends before the open segment is sealed
+        :claim_timeout: seconds before a segment claimed by a dead replayer is sealed again
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.seal_after = seal_after
+        self.claim_timeout = claim_timeout
+        self.segment = None
+        self.segment_size = 0
+        self.last_append = 0
+        self.sequence = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _paths(self, suffix):
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.endswith(suffix))
+
+    def _size(self):
+        return sum(os.path.getsize(path) for path in self._paths(OPEN) + self._paths(SEALED) +
+                   self._paths(REPLAYING))
+
+    def append(self, doc):
+        """ Append a document to the open segment of this worker
+        :doc: log document, any BSON type
+        :raises SpoolFull when max_bytes is reached
+        """
+        self.extend([doc])
+
+    def extend(self, docs):
+        """ Append documents to the open segment of this worker with a single write, either all of them or none
+        :docs: log documents, any BSON type
+        :raises SpoolFull before writing any of them when max_bytes is reached
+        """
+        data = ''.join(_CRC.pack(zlib.crc32(record) & 0xffffffff) + record
+                       for record in (BSON.encode(doc) for doc in docs))
+        if (self.segment is None or self.segment_size + len(data) > self.segment_bytes) and \
+                self._size() + len(data) > self.max_bytes:
+            raise SpoolFull("Spool {} is full".format(self.directory))
+        if self.segment is None:
+            self.sequence += 1
+            self.segment = os.path.join(self.directory, '{0:017.6f}-{1}-{2}{3}'.format(
+                time.time(), os.getpid(), self.sequence, OPEN))
+            self.segment_size = 0
+        with open(self.segment, 'ab') as segment:
+            segment.write(data)
+            segment.flush()
+            os.fsync(segment.fileno())
+        self.segment_size += len(data)
+        self.last_append = time.time()
+        if self.segment_size >= self.segment_bytes:
+            self.seal()
+
+    def seal(self):
+        """ Close the open segment of this worker so it can be replayed
+        """
+        if self.segment is not None:
+            os.rename(self.segment, self.segment[:-len(OPEN)] + SEALED)
+            self.segment = None
+
+    def seal_idle(self):
+        """ Seal the open segment of this worker when idle, and segments left open by dead processes
+        """
+        if self.segment is not None and time.time() - self.last_append >= self.seal_after:
+            self.seal()
+        for path in self._paths(OPEN):
+            pid = int(os.path.basename(path).split('-')[1])
+            if path != self.segment and not _alive(pid):
+                _rename(path, path[:-len(OPEN)] + SEALED)
+
+    def claim(self):
+        """ Take the oldest sealed segment
+        :return path of the claimed segment or None
+        """
+        for path in self._paths(REPLAYING):
+            if time.time() - os.path.getmtime(path) > self.claim_timeout:
+                _rename(path, path[:-len(REPLAYING)] + SEALED)
+        for path in self._paths(SEALED):
+            claimed = path[:-len(SEALED)] + REPLAYING
+            if _rename(path, claimed):
+                os.utime(claimed, None)
+                return claimed
+        return None
+
+    def read(self, path):
+        """ Documents of a segment, stopping at the first torn or corrupt record
+        :return tuple with the list of documents and the number of unreadable bytes
+        """
+        with open(path, 'rb') as segment:
+            data = segment.read()
+        docs = []
+        offset = 0
+        while offset + _CRC.size + _LENGTH.size <= len(data):
+            crc, = _CRC.unpack_from(data, offset)
+            length, = _LENGTH.unpack_from(data, offset + _CRC.size)
+            record = data[offset + _CRC.size:offset + _CRC.size + length]
+            if length < _LENGTH.size or len(record) < length or zlib.crc32(record) & 0xffffffff != crc:
+                break
+            docs.append(BSON(record).decode())
+            offset += _CRC.size + length
+        return docs, len(data) - offset
+
+    def release(self, path):
+        """ Seal a claimed segment again after a failed replay
+        """
+        _rename(path, path[:-len(REPLAYING)] + SEALED)
+
+    def remove(self, path):
+        """ Forget a replayed segment
+        """
+        os.remove(path)
+
+    def depth(self):
+        """ Segments and bytes waiting to be replayed
+        :return dict with segments, bytes and age in seconds of the oldest segment
+        """
+        paths = self._paths(OPEN) + self._paths(SEALED) + self._paths(REPLAYING)
+        created = [float(os.path.basename(path).split('-')[0]) for path in paths]
+        return {'segments': len(paths), 'bytes': sum(os.path.getsize(path) for path in paths),
+                'age': time.time() - min(created) if created else 0}
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _rename(source, target):
+    """ Atomic rename, False when another process renamed source first
+    """
+    try:
+        os.rename(source, target)
+    except OSError:
+        return False
+    return True
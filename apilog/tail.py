@@ -0,0 +1,103 @@
+""" Ring buffer of the last stored logs, read by the live tail api
+
+Each worker keeps the logs it stores in a deque and appends them every flush interval to a sqlite ring shared by the
+workers of the host, trimmed to size logs. Readers wait for logs newer than their cursor without reading mongo.
+Flushes and reads may run in another thread (see apilog.blocking) while greenlets keep appending.
+"""
+import os
+import sqlite3
+import datetime
+from collections import deque
+
+from . import jsoncodec
+
+FILTERS = ('api', 'app', 'responseCode')
+
+
+def _default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+class TailBuffer(object):
+    """ Shared ring of stored logs with a per worker write buffer
+    """
+    def __init__(self, path, size=10000, pending=10000):
+        """
+        :path: sqlite database file
+        :size: logs kept in the ring
+        :pending: logs buffered by this worker between flushes, older ones are dropped
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.size = size
+        self.pending = deque(maxlen=pending)
+        self.conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS tail (seq INTEGER PRIMARY KEY AUTOINCREMENT, api TEXT, app TEXT, '
+                          '"responseCode" TEXT, doc TEXT)')
+
+    def append(self, doc):
+        """ Buffer a stored log
+        """
+        self.pending.append(dict((key, value) for key, value in doc.items()
+                                 if key not in ('_id', 'search_tokens', 'raw_line')))
+
+    def flush(self):
+        """ Write buffered logs to the ring and trim it
+        :return number of logs written
+        """
+        # logs appended meanwhile are kept for the next flush
+        docs = [self.pending.popleft() for _ in range(len(self.pending))]
+        if not docs:
+            return 0
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.executemany('INSERT INTO tail (api, app, "responseCode", doc) VALUES (?, ?, ?, ?)',
+                                  [tuple(_text(doc.get(field)) for field in FILTERS) +
+                                   (jsoncodec.dumps(doc, default=_default),) for doc in docs])
+            self.conn.execute('DELETE FROM tail WHERE seq <= (SELECT MAX(seq) FROM tail) - ?', (self.size,))
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return len(docs)
+
+    def cursor(self):
+        """ Sequence of the newest log in the ring
+        """
+        return self.conn.execute('SELECT COALESCE(MAX(seq), 0) FROM tail').fetchone()[0]
+
+    def read(self, since=None, limit=100, **filters):
+        """ Logs newer than since matching every filter
+        :since: cursor returned by a previous read, None for the last limit logs
+        :filters: api, app or responseCode values
+        :return tuple with the new cursor and the list of logs, oldest first
+        """
+        conditions, params = [], []
+        for field in FILTERS:
+            if filters.get(field):
+                conditions.append('"{}" = ?'.format(field))
+                params.append(filters[field])
+        if since is not None:
+            conditions.append('seq > ?')
+            params.append(since)
+            order = 'ASC'
+        else:
+            order = 'DESC'
+        where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+        rows = self.conn.execute('SELECT seq, doc FROM tail {0} ORDER BY seq {1} LIMIT ?'.format(where, order),
+                                 params + [limit]).fetchall()
+        if order == 'DESC':
+            rows.reverse()
+        cursor = rows[-1][0] if rows else (since if since is not None else self.cursor())
+        if since is None and rows:
+            cursor = max(cursor, self.cursor())
+        return cursor, [jsoncodec.loads(doc) for _, doc in rows]
+
+
+def _text(value):
+    return None if value is None else unicode(value)
@@ -1,6 +1,32 @@
+import os
+import shutil
+import tempfile
 import unittest
-from apilog import mongo
-from mock import patch, create_autospec
+import datetime
+import json
+import dateutil.parser
+from dateutil.tz import tzoffset
+import gevent
+from gevent import monkey
+from StringIO import StringIO
+from apilog import mongo, jsoncodec, metrics
+from apilog.blocking import offload
+from apilog.dedup import BloomFilter, DedupFilter
+from apilog.ingestqueue import IngestQueue
+from apilog.spool import Spool, SpoolFull
+from apilog.archive import Archive
+from apilog.ratelimit import TokenBuckets, log_key
+from apilog.tail import TailBuffer
+from apilog.search import doc_tokens
+from apilog.sketch import LatencySketch, LatencyRecorder
+from apilog.heavyhitters import SpaceSaving, HeavyHittersRecorder, merge
+from apilog.sampling import Sampler
+from apilog.traces import TraceRecorder, summarize
+from apilog.compact import Codec, MemoryDictionary, pack_line, unpack_line
+from apilog.fastpath import FastIngestApplication
+from apilog.profiling import Profiler
+from apilog.httpcache import ResponseCache, not_modified
+from mock import patch, create_autospec, Mock, MagicMock
 from pymongo.cursor import Cursor
 
 
@@ -16,6 +42,63 @@ class RequestDaoTest(unittest.TestCase):
     def tearDown(self):
         del self.dao
 
+    def test_insert_batch(self):
+        """ Batch insert reserves consecutive ids with one counter update
+        """
+        docs = [{'_id': 'a', 'data': 1}, {'data': 2}]
+        with patch.object(self.dao, '_get_id_range', return_value=10) as mock_range:
+            with patch.object(self.dao.dbcoll, 'insert') as mock_insert:
+                result = self.dao.insert_batch(docs)
+                self.assertEqual(result, [10, 11])
+                mock_range.assert_called_once_with(2)
+                mock_insert.assert_called_once_with([{'id': 10, 'data': 1}, {'id': 11, 'data': 2}], w=1,
+                                                    continue_on_error=True)
+
+    def test_insert_batch_duplicated(self):
+        """ Documents rejected in a batch have no id
+        """
+        with patch.object(self.dao, '_get_id_range', return_value=10):
+            with patch.object(self.dao.dbcoll, 'insert', side_effect=mongo.DuplicateKeyError('dup', code=11000)):
+                with patch.object(self.dao.dbcoll, 'find', return_value=[{'id': 11}]):
+                    self.assertEqual(self.dao.insert_batch([{'data': 1}, {'data': 2}]), [None, 11])
+
+    def test_search(self):
+        """ Search looks for every word in the token index
+        """
+        cursor = create_autospec(Cursor)
+        cursor.sort.return_value = cursor
+        with patch.object(self.dao.dbcoll, 'find', return_value=cursor) as mock_find:
+            self.dao.search('SVR1007 paymentcallback', date_from='2013-05-17', limit=10)
+            query = mock_find.call_args[0][0]
+            self.assertEqual(sorted(query['search_tokens']['$all']), ['paymentcallback', 'svr1007'])
+            self.assertEqual(query['requestDate'], {'$gte': datetime.datetime(2013, 5, 17)})
+            cursor.sort.assert_called_once_with('requestDate', -1)
+            cursor.limit.assert_called_once_with(10)
+
+    def test_search_without_words(self):
+        """ Search text without words is rejected
+        """
+        with self.assertRaises(mongo.DBLogException):
+            self.dao.search(' - ')
+
+    def test_insert_compact(self):
+        """ Compact schema is written and expanded on read
+        """
+        self.dao.codec = Codec(MemoryDictionary())
+        doc = {'responseCode': '400', 'domain': 'M2M', 'transactionId': 'abc'}
+        with patch.object(self.dao, '_get_id_value', return_value=5):
+            with patch.object(self.dao.dbcoll, 'insert') as mock_insert:
+                self.dao.insert(doc)
+        stored = mock_insert.call_args[0][0]
+        self.assertEqual(stored['c'], 400)
+        self.assertEqual(stored['d'], 0)
+        self.assertEqual(stored['id'], 5)
+        with patch.object(self.dao.dbcoll, 'find_one', return_value=stored) as mock_find_one:
+            self.assertEqual(self.dao.select(5)['domain'], 'M2M')
+            projection = dict((self.dao.codec.key(field), False) for field in mongo.RequestsDao.projection)
+            self.assertEqual(projection['tk'], False)
+            mock_find_one.assert_called_once_with({'id': 5}, projection)
+
     def test_select_log(self):
         """ Find all data (limit 50)
         """
@@ -42,7 +125,8 @@ class RequestDaoTest(unittest.TestCase):
         with patch.object(self.dao.dbcoll, 'find_one', return_value=None) as mock_find_one:
             with self.assertRaises(mongo.DBLogException) as exc:
                 self.dao.select(1)
-            mock_find_one.assert_called_once_with(RequestDaoTest.ID, {'_id': False})
+            mock_find_one.assert_called_once_with(RequestDaoTest.ID, {'_id': False, 'search_tokens': False,
+                                                                      'raw_line': False})
             ret_except = exc.exception
             self.assertEqual(ret_except.value, "Data log 1 does not exist")
 
@@ -68,6 +152,34 @@ class RequestDaoTest(unittest.TestCase):
             self.assertTrue(result['updatedExisting'])
             mock_update.assert_called_once_with(RequestDaoTest.ID, RequestDaoTest.DATA, w=1)
 
+    def test_patch_request_dao(self):
+        """ Partial update sends $set/$unset with expected values in the query
+        """
+        with patch.object(self.dao.dbcoll, 'update', return_value={u'updatedExisting': True, u'n': 1}) as mock_update:
+            result = self.dao.patch_doc(1, fields={'domain': 'M2M'}, unset=['body'], expected={'domain': 'Bluevia'})
+            self.assertTrue(result['updatedExisting'])
+            mock_update.assert_called_once_with({'id': 1, 'domain': 'Bluevia'},
+                                                {'$set': {'domain': 'M2M'}, '$unset': {'body': ''}}, w=1)
+
+    def test_patch_nothing_to_update(self):
+        """ Partial update without fields raises
+        """
+        with self.assertRaises(mongo.DBLogException):
+            self.dao.patch_doc(1, fields={'id': 3})
+
+    def test_patch_invalid_arguments(self):
+        """ Partial update with set or expected not being objects, unset not being a list of names or expected
+        holding $ operators raises
+        """
+        with patch.object(self.dao.dbcoll, 'update') as mock_update:
+            for kwargs in ({'fields': [1]}, {'fields': {'a': 1}, 'expected': 'abc'}, {'unset': 'abc'},
+                           {'unset': [1]}, {'unset': {'abc': 1}}, {'fields': {'a': 1}, 'expected': {'$where': '1'}},
+                           {'fields': {'a': 1}, 'expected': {'domain': {'$ne': 'M2M'}}},
+                           {'fields': {'a': 1}, 'expected': {'body': [{'$gt': ''}]}}):
+                with self.assertRaises(mongo.DBLogException):
+                    self.dao.patch_doc(1, **kwargs)
+            self.assertFalse(mock_update.called)
+
     def test_delete_request_dao(self):
         """ Delete log
         """
@@ -86,6 +198,148 @@ class RequestDaoTest(unittest.TestCase):
             mock_drop.assert_called_once_with()
 
 
+    def test_build_filter(self):
+        """ Bulk filter translated to mongo query
+        """
+        query = self.dao._build_filter({'id_from': 10, 'id_to': '20', 'transactionId': 'abc', 'api': 'mobileid',
+                                        'date_from': '2013-10-11T00:00:00'})
+        self.assertEqual(query['id'], {'$gte': 10, '$lte': 20})
+        self.assertEqual(query['transactionId'], {'$in': ['abc']})
+        self.assertEqual(query['api'], 'mobileid')
+        self.assertEqual(query['requestDate'], {'$gte': datetime.datetime(2013, 10, 11)})
+
+    def test_build_empty_filter(self):
+        """ Empty bulk filter must never select the whole collection
+        """
+        with self.assertRaises(mongo.DBLogException):
+            self.dao._build_filter({'unknown': 1})
+
+    def test_build_invalid_filter(self):
+        """ Bulk filters with invalid values or not being an object raise DBLogException
+        """
+        for criteria in ({'id_from': 'abc'}, {'ids': '123'}, {'ids': [{}]}, {'date_to': 'garbage'}, [1], 'api'):
+            with self.assertRaises(mongo.DBLogException):
+                self.dao._build_filter(criteria)
+
+    def test_bulk_delete_chunks(self):
+        """ Bulk delete removes every chunk and counts documents
+        """
+        with patch.object(self.dao, '_chunked_ids', return_value=iter([[1, 2], [3]])):
+            with patch.object(self.dao.dbcoll, 'remove', side_effect=[{'n': 2}, {'n': 1}]) as mock_remove:
+                result = self.dao.bulk_delete({'ids': [1, 2, 3]}, chunk_size=2, throttle=0)
+                self.assertEqual(result, {'matched': 3, 'deleted': 3})
+                mock_remove.assert_called_with({'id': {'$in': [3]}}, w=1)
+
+    def test_bulk_update_set_fields(self):
+        """ Bulk update wraps plain fields in $set
+        """
+        with patch.object(self.dao, '_chunked_ids', return_value=iter([[1, 2]])):
+            with patch.object(self.dao.dbcoll, 'update', return_value={'n': 2}) as mock_update:
+                result = self.dao.bulk_update({'ids': [1, 2]}, {'domain': 'M2M'}, throttle=0)
+                self.assertEqual(result, {'matched': 2, 'updated': 2})
+                mock_update.assert_called_once_with({'id': {'$in': [1, 2]}}, {'$set': {'domain': 'M2M'}},
+                                                    multi=True, w=1)
+
+    def test_bulk_update_rejected(self):
+        """ Bulk updates touching id or _id, using other operators or mixing fields and operators are rejected
+        """
+        with patch.object(self.dao.dbcoll, 'update') as mock_update:
+            for data in ({'domain': 'M2M', 'id': 5}, {'$set': {'_id': 1}}, {'$inc': {'id': 1}},
+                         {'$unset': {'id.x': ''}}, {'$rename': {'domain': 'x'}}, {'$where': 'true'},
+                         {'$set': {'domain': 'M2M'}, 'app': 'x'}, {'$set': []}, [], {}):
+                with self.assertRaises(mongo.DBLogException):
+                    self.dao.bulk_update({'ids': [1, 2]}, data, throttle=0)
+            self.assertFalse(mock_update.called)
+
+
+class ShardedRequestsDaoTest(unittest.TestCase):
+    """ Client side sharding over stand-in shard collections
+    """
+    def setUp(self):
+        self.dao = mongo.RequestsDao()
+        self.dao.shards = [Mock(name='shard0'), Mock(name='shard1')]
+
+    def test_insert_routes_by_transaction(self):
+        """ Logs of a transaction are written to the same shard
+        """
+        indexes = set()
+        for origin in ('FE', 'BE'):
+            with patch.object(self.dao, '_get_id_value', return_value=7):
+                self.dao.insert({'transactionId': 'a9b8c7', 'origin': origin})
+            indexes.add(self.dao._shard_index({'transactionId': 'a9b8c7', 'id': 1}))
+        self.assertEqual(len(indexes), 1)
+        self.assertEqual(self.dao.shards[indexes.pop()].insert.call_count, 2)
+
+    def test_shard_index_time_bucket(self):
+        """ Logs of the same requestDate bucket share a shard
+        """
+        with patch.dict(mongo.SHARDING, {'key': 'time', 'time_bucket': 3600}):
+            first = self.dao._shard_index({'id': 1, 'requestDate': datetime.datetime(2013, 5, 17, 2, 10)})
+            second = self.dao._shard_index({'id': 2, 'requestDate': datetime.datetime(2013, 5, 17, 2, 50)})
+        self.assertEqual(first, second)
+
+    def test_insert_batch_groups_by_shard(self):
+        """ Batch insert writes one list per shard and keeps ids in received order
+        """
+        docs = [{'transactionId': str(index)} for index in range(20)]
+        with patch.object(self.dao, '_get_id_range', return_value=1):
+            ids = self.dao.insert_batch(docs)
+        self.assertEqual(ids, range(1, 21))
+        inserted = [doc['id'] for shard in self.dao.shards for doc in shard.insert.call_args[0][0]]
+        self.assertEqual(sorted(inserted), range(1, 21))
+
+    def test_select_fans_out(self):
+        """ A log written before a shard was added is still found
+        """
+        self.dao.shards[0].find_one.return_value = None
+        self.dao.shards[1].find_one.return_value = {'id': 5}
+        self.assertEqual(self.dao.select(5), {'id': 5})
+        self.dao.shards.append(Mock(name='shard2', **{'find_one.return_value': None}))
+        self.assertEqual(self.dao.select(5), {'id': 5})
+
+    def test_update_stops_at_holding_shard(self):
+        """ Updates go through shards until one holds the log
+        """
+        self.dao.shards[0].update.return_value = {'updatedExisting': True, 'n': 1}
+        self.dao.update_doc(3, {'$set': {'domain': 'M2M'}})
+        self.assertFalse(self.dao.shards[1].update.called)
+
+    def test_bulk_delete_every_shard(self):
+        """ Bulk delete adds up the counts of every shard
+        """
+        with patch.object(self.dao, '_chunked_ids', side_effect=[iter([[1, 2]]), iter([[3]])]):
+            self.dao.shards[0].remove.return_value = {'n': 2}
+            self.dao.shards[1].remove.return_value = {'n': 1}
+            result = self.dao.bulk_delete({'ids': [1, 2, 3]}, throttle=0)
+        self.assertEqual(result, {'matched': 3, 'deleted': 3})
+
+    def test_select_single_shard(self):
+        """ Listing logs of a single shard reads that shard, not the main database
+        """
+        shard = MagicMock(name='shard0')
+        shard.find.return_value.limit.return_value = [{'id': 5}]
+        self.dao.shards = [shard]
+        with patch.object(self.dao, 'dbcoll') as mock_dbcoll:
+            self.assertEqual(list(self.dao.select()), [{'id': 5}])
+        self.assertFalse(mock_dbcoll.find.called)
+
+    def test_count_and_drop_every_shard(self):
+        """ Requests counts add up every shard and drops reach all of them, other collections stay in the main one
+        """
+        databases = [MagicMock(name='shard0'), MagicMock(name='shard1')]
+        databases[0].__getitem__.return_value.count.return_value = 2
+        databases[1].__getitem__.return_value.count.return_value = 3
+        db = mongo.DB(dbconn=MagicMock(name='main'))
+        with patch.dict(mongo.SHARDING, {'enabled': True}), patch.dict(mongo.READ_ROUTING, {'enabled': False}), \
+                patch.object(mongo.Connection, 'get_shard_connections', return_value=databases):
+            self.assertEqual(db.count('requests'), 5)
+            db.drop_collection('requests')
+            db.drop_collection('ids')
+        for database in databases:
+            database.drop_collection.assert_called_once_with('requests')
+        db.dbconn.drop_collection.assert_called_once_with('ids')
+
+
 class DaoTest(unittest.TestCase):
     """ Dao class testing
     """
@@ -96,3 +350,1026 @@ class DaoTest(unittest.TestCase):
             mongo.Dao()
         ret_except = exc.exception
         self.assertEqual(ret_except.message, "'Dao' object has no attribute 'coll'")
+
+
+class JsonCodecTest(unittest.TestCase):
+    """ JSON codec testing
+    """
+    def test_stdlib_codec(self):
+        """ Standard library backend decodes and encodes using default
+        """
+        codec = jsoncodec.get_codec('json')
+        self.assertEqual(codec.loads('{"id": 1}'), {'id': 1})
+        self.assertEqual(codec.dumps({'date': datetime.date(2014, 1, 1)}, default=lambda obj: obj.isoformat()),
+                         '{"date": "2014-01-01"}')
+
+    def test_fallback_to_stdlib(self):
+        """ Missing libraries fall back to the next backend
+        """
+        def missing():
+            raise ImportError("No module named ujson")
+
+        with patch.dict(jsoncodec._BACKENDS, {'ujson': missing, 'simplejson': missing}):
+            self.assertEqual(jsoncodec._default_codec().name, 'json')
+
+
+class DedupFilterTest(unittest.TestCase):
+    """ Duplicated deliveries filter testing
+    """
+    def test_bloom_filter(self):
+        """ Added keys are always found
+        """
+        bloom = BloomFilter(8 * 1024, 4)
+        self.assertFalse(bloom.add('5f4e6060|BE'))
+        self.assertTrue(bloom.add('5f4e6060|BE'))
+        self.assertIn('5f4e6060|BE', bloom)
+        self.assertNotIn('5f4e6060|FE', bloom)
+
+    def test_keys_expire_after_two_windows(self):
+        """ Keys are remembered during a full window and forgotten after two
+        """
+        now = [0]
+        dedup = DedupFilter(60, 1024, 4, clock=lambda: now[0])
+        self.assertFalse(dedup.seen('key'))
+        now[0] = 59
+        self.assertTrue(dedup.seen('key'))
+        now[0] = 100
+        self.assertTrue(dedup.seen('key'))
+        now[0] = 300
+        self.assertFalse(dedup.seen('key'))
+
+
+class OffloadTest(unittest.TestCase):
+    """ Blocking calls run in the threadpool
+    """
+    class Blocking(object):
+        def __init__(self):
+            self.running = 0
+            self.overlapped = False
+
+        def wait(self, seconds):
+            self.running += 1
+            self.overlapped = self.overlapped or self.running > 1
+            monkey.get_original('time', 'sleep')(seconds)
+            self.running -= 1
+            return monkey.get_original('thread', 'get_ident')()
+
+        def fail(self):
+            raise ValueError('failed')
+
+    def test_other_greenlets_run(self):
+        """ Greenlets keep running while a call blocks its native thread
+        """
+        ticks = []
+        ticker = gevent.spawn(lambda: [ticks.append(gevent.sleep(0.01)) for _ in range(5)])
+        ident = offload(self.Blocking().wait, 0.2)
+        self.assertNotEqual(ident, monkey.get_original('thread', 'get_ident')())
+        self.assertEqual(len(ticks), 5)
+        ticker.join()
+
+    def test_calls_of_an_object_in_turn(self):
+        """ Calls of the same object never overlap and exceptions reach the caller
+        """
+        target = self.Blocking()
+        gevent.joinall([gevent.spawn(offload, target.wait, 0.05) for _ in range(3)])
+        self.assertFalse(target.overlapped)
+        with patch.object(gevent.get_hub(), 'print_exception'):
+            self.assertRaises(ValueError, offload, target.fail)
+
+
+class IngestQueueTest(unittest.TestCase):
+    """ Durable ingest queue testing
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.queue = IngestQueue(os.path.join(self.directory, 'queue', 'ingest.db'), claim_timeout=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_store_ticket(self):
+        """ Claimed payloads are not claimed twice and keep their final state
+        """
+        ticket = self.queue.put({'data': 'datas'})
+        other = self.queue.put('log line')
+        self.assertEqual(self.queue.status(ticket), {'state': 'queued'})
+        self.assertEqual(self.queue.claim(10, 'worker'), [(ticket, {'data': 'datas'}), (other, 'log line')])
+        self.assertEqual(self.queue.claim(10, 'worker'), [])
+        self.queue.complete([(ticket, 81)])
+        self.queue.reject([(other, 'Invalid data log')])
+        self.assertEqual(self.queue.status(ticket), {'state': 'stored', 'id': 81})
+        self.assertEqual(self.queue.status(other), {'state': 'rejected', 'reason': 'Invalid data log'})
+        self.assertEqual(self.queue.depth(), 0)
+        self.assertIsNone(self.queue.status('unknown'))
+
+    def test_release_and_claim_timeout(self):
+        """ Released and abandoned payloads are queued again
+        """
+        ticket = self.queue.put({'data': 'datas'})
+        self.queue.claim(10, 'worker')
+        self.queue.release([ticket])
+        self.assertEqual(len(self.queue.claim(10, 'worker')), 1)
+        self.queue.claim_timeout = -1
+        self.assertEqual(len(self.queue.claim(10, 'other')), 1)
+
+    def test_put_many(self):
+        """ Payloads queued together get a ticket each, in order
+        """
+        tickets = self.queue.put_many([{'data': 'datas'}, 'log line'])
+        self.assertEqual(len(set(tickets)), 2)
+        self.assertEqual(self.queue.claim(10, 'worker'), [(tickets[0], {'data': 'datas'}), (tickets[1], 'log line')])
+
+
+class SpoolTest(unittest.TestCase):
+    """ Local segment spool testing
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = Spool(os.path.join(self.directory, 'segments'), segment_bytes=1024, max_bytes=4096)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_claim_read(self):
+        """ Sealed segments are claimed once and keep every BSON type
+        """
+        doc = {'_id': 1, 'requestDate': datetime.datetime(2013, 5, 17, 2, 10, 25), 'origin': 'FE'}
+        self.spool.append(doc)
+        self.assertIsNone(self.spool.claim())
+        self.spool.seal()
+        segment = self.spool.claim()
+        self.assertIsNone(self.spool.claim())
+        self.assertEqual(self.spool.read(segment), ([doc], 0))
+        self.spool.remove(segment)
+        self.assertEqual(self.spool.depth()['segments'], 0)
+
+    def test_torn_record(self):
+        """ A partially written record ends the segment
+        """
+        self.spool.append({'origin': 'FE'})
+        self.spool.append({'origin': 'BE'})
+        with open(self.spool.segment, 'r+b') as segment:
+            segment.truncate(os.path.getsize(self.spool.segment) - 3)
+        self.spool.seal()
+        docs, corrupt = self.spool.read(self.spool.claim())
+        self.assertEqual(docs, [{'origin': 'FE'}])
+        self.assertTrue(corrupt > 0)
+
+    def test_rotation_and_limit(self):
+        """ Full segments are sealed and appends stop at max_bytes
+        """
+        with self.assertRaises(SpoolFull):
+            for _ in range(100):
+                self.spool.append({'body': 'x' * 200})
+        depth = self.spool.depth()
+        self.assertTrue(depth['segments'] > 1)
+        self.assertTrue(depth['bytes'] < 4096 + 2048)
+
+    def test_extend_all_or_nothing(self):
+        """ A batch filling the spool partway is not written at all
+        """
+        self.spool.extend([{'body': 'x' * 200}] * 3)
+        written = self.spool.depth()['bytes']
+        with self.assertRaises(SpoolFull):
+            self.spool.extend([{'body': 'x' * 200}] * 20)
+        self.assertEqual(self.spool.depth()['bytes'], written)
+        self.spool.seal()
+        self.assertEqual(len(self.spool.read(self.spool.claim())[0]), 3)
+
+    def test_release_and_claim_timeout(self):
+        """ Released and abandoned segments are claimed again
+        """
+        self.spool.append({'origin': 'FE'})
+        self.spool.seal()
+        self.spool.release(self.spool.claim())
+        self.assertIsNotNone(self.spool.claim())
+        self.spool.claim_timeout = -1
+        self.assertIsNotNone(self.spool.claim())
+
+
+class ArchiveTest(unittest.TestCase):
+    """ Archived segment files testing
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.archive = Archive(os.path.join(self.directory, 'archive'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _doc(self, log_id, day, api='payment'):
+        return {'id': log_id, 'requestDate': datetime.datetime(2013, 5, day, 2, 10, 25), 'api': api, 'origin': 'FE'}
+
+    def test_write_find(self):
+        """ Logs are read back by id from compressed segments
+        """
+        docs = [self._doc(log_id, 10 + log_id) for log_id in range(1, 6)]
+        self.archive.write(docs)
+        self.assertEqual(self.archive.find(3), docs[2])
+        self.assertIsNone(self.archive.find(9))
+        self.assertEqual(len([name for name in os.listdir(self.archive.directory) if name.endswith('.seg')]), 1)
+
+    def test_find_range(self):
+        """ Range reads merge overlapping segments newest first, by api and without excluded ids
+        """
+        self.archive.write([self._doc(1, 10), self._doc(3, 12), self._doc(5, 14, 'sms')])
+        self.archive.write([self._doc(2, 11), self._doc(4, 13)])
+        self.assertEqual([doc['id'] for doc in self.archive.find_range()], [5, 4, 3, 2, 1])
+        docs = self.archive.find_range(datetime.datetime(2013, 5, 11), datetime.datetime(2013, 5, 13, 23), limit=2)
+        self.assertEqual([doc['id'] for doc in docs], [4, 3])
+        self.assertEqual([doc['id'] for doc in self.archive.find_range(api='payment', exclude=[4])], [3, 2, 1])
+        date_from = dateutil.parser.parse('2013-05-13T00:00:00Z')
+        self.assertEqual([doc['id'] for doc in self.archive.find_range(date_from)], [5, 4])
+
+    def test_segment_without_index_ignored(self):
+        """ Segments are read only once their index is written
+        """
+        name = self.archive.write([self._doc(1, 10)])
+        os.remove(os.path.join(self.archive.directory, name + '.idx'))
+        self.assertIsNone(self.archive.find(1))
+        self.assertEqual(self.archive.find_range(), [])
+
+    def test_select_falls_back_to_archive(self):
+        """ Logs no longer in mongo are read from the archive without internal fields
+        """
+        self.archive.write([dict(self._doc(7, 10), raw_line='line')])
+        dao = mongo.RequestsDao()
+        dao.archive = self.archive
+        with patch.object(dao, '_find_one', return_value=None):
+            self.assertEqual(dao.select(7), self._doc(7, 10))
+            self.assertRaises(mongo.DBLogException, dao.select, 8)
+
+
+class TokenBucketsTest(unittest.TestCase):
+    """ Shared token bucket testing
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'rate-limit.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_buckets(self):
+        """ Every worker takes tokens from the same bucket
+        """
+        first, second = TokenBuckets(self.path), TokenBuckets(self.path)
+        self.assertEqual(first.acquire('MobileId|BE', 1, 2), 0)
+        self.assertEqual(second.acquire('MobileId|BE', 1, 2), 0)
+        self.assertTrue(0 < first.acquire('MobileId|BE', 1, 2) <= 1)
+        self.assertEqual(second.acquire('FrontendBasic|FE', 1, 2), 0)
+
+    def test_refill(self):
+        """ Buckets refill with time and batches wait for their cost
+        """
+        buckets = TokenBuckets(self.path)
+        with patch('time.time', return_value=1000.0):
+            self.assertEqual(buckets.acquire('app', 10, 20, cost=20), 0)
+            self.assertEqual(buckets.acquire('app', 10, 20, cost=5), 0.5)
+        with patch('time.time', return_value=1001.0):
+            self.assertEqual(buckets.acquire('app', 10, 20, cost=5), 0)
+
+    def test_acquire_many(self):
+        """ Tokens are taken from every bucket or, when one is exhausted, from none
+        """
+        buckets = TokenBuckets(self.path)
+        with patch('time.time', return_value=1000.0):
+            self.assertEqual(buckets.acquire('FrontendBasic|FE', 1, 1), 0)
+            self.assertEqual(buckets.acquire_many([('MobileId|BE', 1, 2, 2), ('FrontendBasic|FE', 1, 1, 1)]),
+                             [0, 1])
+            self.assertEqual(buckets.acquire('MobileId|BE', 1, 2, cost=2), 0)
+
+    def test_log_key(self):
+        """ App and origin are read from dicts and from log lines without parsing
+        """
+        line = '2013/05/17T02:10:25.335 2013/05/17T02:10:25.548 Microsoft 1e246bb8 FE FrontendTrustedPartner ' \
+               '9/18297 21407 INFOSTATS 201 ["POST /payment/v2/payments HTTP/1.0"]'
+        self.assertEqual(log_key(line), ('FrontendTrustedPartner', 'FE'))
+        self.assertEqual(log_key({'app': 'MobileId', 'origin': 'BE'}), ('MobileId', 'BE'))
+        self.assertEqual(log_key('short line'), ('', ''))
+
+
+class TailBufferTest(unittest.TestCase):
+    """ Live tail ring testing
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tail.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_workers_share_ring(self):
+        """ Logs flushed by every worker are read in order after the cursor
+        """
+        first, second = TailBuffer(self.path), TailBuffer(self.path)
+        cursor, logs = first.read()
+        self.assertEqual((cursor, logs), (0, []))
+        first.append({'_id': 'oid', 'id': 1, 'api': 'payment', 'requestDate': datetime.datetime(2013, 5, 17)})
+        self.assertEqual(first.read(cursor), (0, []))
+        first.flush()
+        second.append({'id': 2, 'api': 'mobileid', 'responseCode': '400'})
+        second.flush()
+        cursor, logs = second.read(cursor)
+        self.assertEqual(logs, [{'id': 1, 'api': 'payment', 'requestDate': '2013-05-17T00:00:00'},
+                                {'id': 2, 'api': 'mobileid', 'responseCode': '400'}])
+        self.assertEqual(first.read(cursor), (cursor, []))
+        self.assertEqual([log['id'] for log in first.read(0, responseCode='400')[1]], [2])
+
+    def test_ring_size(self):
+        """ Only the last size logs are kept
+        """
+        buffer = TailBuffer(self.path, size=3)
+        for log_id in range(5):
+            buffer.append({'id': log_id})
+        buffer.flush()
+        self.assertEqual([log['id'] for log in buffer.read(limit=10)[1]], [2, 3, 4])
+
+
+class SearchTokensTest(unittest.TestCase):
+    """ Search tokens testing
+    """
+    def test_doc_tokens(self):
+        """ Tokens come from exception, request body and url
+        """
+        doc = {'exceptionId': 'SVR1007', 'exceptionText': 'Server Error in Request',
+               'body_request': {'msisdn': '34600000000', 'info': {'partnerName': 'Microsoft'}},
+               'http_request': {'url': 'payment/v2/payments'}, 'app': 'NotIndexed'}
+        tokens = doc_tokens(doc)
+        self.assertEqual(tokens[:5], ['svr1007', 'server', 'error', 'in', 'request'])
+        for token in ('34600000000', 'microsoft', 'payment', 'v2', 'payments'):
+            self.assertIn(token, tokens)
+        self.assertNotIn('notindexed', tokens)
+        self.assertEqual(len(doc_tokens(doc, max_tokens=3)), 3)
+
+
+class CompactCodecTest(unittest.TestCase):
+    """ Compact storage schema testing
+    """
+    DOC = {'id': 17, 'origin': 'BE', 'app': 'MobileId', 'api': 'mobileid', 'domain': 'M2M', 'responseCode': '400',
+           'serviceId': '', 'appId': '0405', 'ob': '21407', 'statType': 'INFOSTATS',
+           'transactionId': '5f4e6060-58d5-443c-bafd-3f09ba532f28', 'body': [{'MobileId': {'info': {'xff': None}}}],
+           'body_request': {'msisdn': ''}, 'requestDate': datetime.datetime(2013, 10, 11, 11, 48, 50)}
+
+    def test_round_trip(self):
+        """ Encoded logs decode to the original ones
+        """
+        codec = Codec(MemoryDictionary())
+        compact = codec.encode(dict(CompactCodecTest.DOC))
+        self.assertEqual(compact['c'], 400)
+        self.assertEqual(compact['ob'], 21407)
+        # empty and zero padded codes stay strings
+        self.assertEqual(compact['sv'], '')
+        self.assertEqual(compact['ai'], '0405')
+        self.assertIsInstance(compact['o'], int)
+        self.assertEqual(codec.decode(compact), CompactCodecTest.DOC)
+
+    def test_raw_body_modes(self):
+        """ Raw body can be compressed or dropped
+        """
+        compressed = Codec(MemoryDictionary(), raw_body='compress')
+        self.assertEqual(compressed.decode(compressed.encode(dict(CompactCodecTest.DOC)))['body'],
+                         CompactCodecTest.DOC['body'])
+        self.assertNotIn('b', Codec(MemoryDictionary(), raw_body='drop').encode(dict(CompactCodecTest.DOC)))
+
+    def test_encode_query(self):
+        """ Queries use short keys and stored values, unknown dictionary values never match
+        """
+        codec = Codec(MemoryDictionary())
+        codec.encode(dict(CompactCodecTest.DOC))
+        query = codec.encode_query({'$and': [{'api': 'mobileid', 'app': 'Unknown'},
+                                             {'responseCode': {'$in': ['400', '500']}, 'id': {'$gt': 3}}]})
+        self.assertEqual(query, {'$and': [{'p': 0, 'a': -1}, {'c': {'$in': [400, 500]}, 'id': {'$gt': 3}}]})
+        self.assertEqual(codec.encode_update({'$set': {'responseCode': '500'}, '$unset': {'body': ''}}),
+                         {'$set': {'c': 500}, '$unset': {'b': ''}})
+
+
+class RawLinesTest(unittest.TestCase):
+    """ Raw line storage and reprocessing reads testing
+    """
+    LINE = u'2013/05/17T02:10:25.335 2013/05/17T02:10:25.548 Microsoft 1e246bb8 FE App 9/18297 21407 INFOSTATS 201'
+
+    def setUp(self):
+        self.dao = mongo.RequestsDao()
+
+    def test_pack_line(self):
+        """ Packed lines are compressed and unpack to the original text
+        """
+        packed = pack_line(RawLinesTest.LINE * 10)
+        self.assertLess(len(packed), len(RawLinesTest.LINE * 10))
+        self.assertEqual(unpack_line(packed), RawLinesTest.LINE * 10)
+
+    def test_outdated_lines(self):
+        """ Logs parsed by older parsers are read with their raw line by id
+        """
+        cursor = create_autospec(Cursor)
+        cursor.sort.return_value = cursor
+        cursor.limit.return_value = [{'id': 3, 'raw_line': pack_line(RawLinesTest.LINE)}]
+        with patch.object(self.dao.dbcoll, 'find', return_value=cursor) as mock_find:
+            chunks = list(self.dao.outdated_lines(2, date_from='2013-05-17', chunk_size=10))
+        self.assertEqual(chunks, [(self.dao.dbcoll, cursor.limit.return_value)])
+        query, projection = mock_find.call_args[0]
+        self.assertEqual(query['parserVersion'], {'$lt': 2})
+        self.assertEqual(query['raw_line'], {'$exists': True})
+        self.assertEqual(query['requestDate'], {'$gte': datetime.datetime(2013, 5, 17)})
+        self.assertEqual(projection, {'_id': False, 'id': True, 'raw_line': True})
+        cursor.limit.assert_called_once_with(10)
+
+    def test_update_parsed(self):
+        """ Reparsed fields are set by id, keeping the raw line
+        """
+        doc = {'id': 3, 'api': 'payment', 'raw_line': pack_line(RawLinesTest.LINE), 'parserVersion': 2}
+        with patch.dict(mongo.SEARCH, {'enabled': False}):
+            with patch.object(self.dao.dbcoll, 'update') as mock_update:
+                self.dao.update_parsed(self.dao.dbcoll, [doc])
+        mock_update.assert_called_once_with({'id': 3}, {'$set': {'api': 'payment', 'parserVersion': 2}}, w=1)
+
+    def test_insert_rejected_line(self):
+        """ Rejected lines are stored compressed with the parser error and version
+        """
+        rejected_dao = mongo.RejectedLinesDao()
+        with patch.object(rejected_dao.dbcoll, 'insert') as mock_insert:
+            rejected_dao.insert_line(RawLinesTest.LINE, 'Invalid data log', 1)
+        doc = mock_insert.call_args[0][0]
+        self.assertEqual(unpack_line(doc['raw_line']), RawLinesTest.LINE)
+        self.assertEqual((doc['reason'], doc['parserVersion']), ('Invalid data log', 1))
+
+
+class ReadRoutingTest(unittest.TestCase):
+    """ Per operation read preference testing
+    """
+    def setUp(self):
+        self.dao = mongo.RequestsDao()
+        self.routing = patch.dict(mongo.READ_ROUTING, {'enabled': True})
+        self.routing.start()
+        # routing applies to replica sets, in memory backends have none
+        self.backend = patch.dict(mongo.MONGODB, {'backend': 'pymongo'})
+        self.backend.start()
+        mongo.read_counters.reset()
+
+    def tearDown(self):
+        self.routing.stop()
+        self.backend.stop()
+
+    def test_disabled_keeps_connection_preference(self):
+        """ Without routing reads keep the connection read preference
+        """
+        with patch.dict(mongo.READ_ROUTING, {'enabled': False}):
+            self.assertEqual(mongo.read_options('list', Mock()), {})
+
+    def test_list_reads_secondaries(self):
+        """ Listing goes to secondaries while they are fresh enough
+        """
+        with patch.object(mongo, 'replication_lag', return_value=1):
+            options = mongo.read_options('list', Mock())
+        self.assertEqual(options, {'read_preference': mongo.ReadPreference.SECONDARY_PREFERRED})
+        self.assertEqual(mongo.read_counters.get('list.secondary_preferred'), 1)
+
+    def test_stale_secondaries_read_primary(self):
+        """ Lag over max_staleness sends reads to the primary
+        """
+        with patch.object(mongo, 'replication_lag', return_value=mongo.READ_ROUTING['max_staleness'] + 1):
+            options = mongo.read_options('list', Mock())
+        self.assertEqual(options, {'read_preference': mongo.ReadPreference.PRIMARY})
+        self.assertEqual(mongo.read_counters.get('stale'), 1)
+
+    def test_read_after_write_reads_primary(self):
+        """ A log written by this worker is read back from the primary
+        """
+        with patch.object(self.dao, '_get_id_value', return_value=42):
+            with patch.object(self.dao.dbcoll, 'insert'):
+                self.dao.insert({'origin': 'FE'})
+        with patch.object(self.dao.dbcoll, 'find_one', return_value={'id': 42}) as mock_find_one:
+            self.dao.select(42)
+        self.assertEqual(mock_find_one.call_args[1], {'read_preference': mongo.ReadPreference.PRIMARY})
+        self.assertEqual(mongo.read_counters.get('fresh'), 1)
+
+    def test_replication_lag(self):
+        """ Lag is the distance between the primary and the slowest healthy secondary
+        """
+        client = Mock()
+        client.admin.command.return_value = {'members': [
+            {'state': 1, 'health': 1, 'optimeDate': datetime.datetime(2014, 1, 1, 0, 0, 30)},
+            {'state': 2, 'health': 1, 'optimeDate': datetime.datetime(2014, 1, 1, 0, 0, 20)},
+            {'state': 2, 'health': 0, 'optimeDate': datetime.datetime(2014, 1, 1)}]}
+        self.assertEqual(mongo.replication_lag(client), 10)
+        self.assertEqual(mongo.replication_lag(client), 10)
+        client.admin.command.assert_called_once_with('replSetGetStatus')
+
+
+class CollectionStatsTest(unittest.TestCase):
+    """ Collection storage statistics testing
+    """
+    COLLSTATS = {'count': 4, 'size': 4000, 'storageSize': 8192, 'totalIndexSize': 2048,
+                 'indexSizes': {'_id_': 1024, 'id_1': 1024}}
+
+    def setUp(self):
+        self.db = mongo.DB()
+        mongo._stats_cache.clear()
+
+    def test_stats_cached(self):
+        """ Sizes are read once per cache ttl
+        """
+        with patch.object(self.db.dbconn, 'command', return_value=self.COLLSTATS) as mock_command:
+            with patch.object(self.db, '_growth', return_value=None):
+                stats = self.db.stats('requests')
+                self.assertEqual(self.db.stats('requests'), stats)
+        mock_command.assert_called_once_with('collstats', 'requests')
+        self.assertEqual(stats['avg_obj_size'], 1000)
+        self.assertEqual(stats['storage_size'], 8192)
+        self.assertEqual(stats['index_sizes'], {'_id_': 1024, 'id_1': 1024})
+
+    def test_missing_collection(self):
+        """ Stats of unknown collections raise a dao exception
+        """
+        with patch.object(self.db.dbconn, 'command', side_effect=mongo.OperationFailure('ns not found')):
+            self.assertRaises(mongo.DBLogException, self.db.stats, 'unknown')
+
+    def test_growth_per_day(self):
+        """ Growth is measured from the oldest sample of the window
+        """
+        sample = {'time': datetime.datetime.utcnow() - datetime.timedelta(hours=12), 'size': 1000, 'count': 1}
+        with patch.object(self.db, 'dbconn') as mock_dbconn:
+            samples = mock_dbconn.__getitem__.return_value
+            samples.find.return_value.sort.return_value.limit.return_value = [sample]
+            growth = self.db._growth('requests', {'size': 4000, 'count': 4})
+        self.assertEqual(samples.update.call_args[1], {'upsert': True, 'w': 0})
+        self.assertAlmostEqual(growth['bytes_per_day'], 6000, delta=1)
+        self.assertAlmostEqual(growth['documents_per_day'], 6, delta=1)
+
+    def test_no_growth_without_older_sample(self):
+        """ Growth is unknown until a sample interval has passed
+        """
+        with patch.object(self.db, 'dbconn') as mock_dbconn:
+            mock_dbconn.__getitem__.return_value.find.return_value.sort.return_value.limit.return_value = []
+            self.assertIsNone(self.db._growth('requests', {'size': 4000, 'count': 4}))
+
+
+class SlowOperationsTest(unittest.TestCase):
+    """ Slow operation log testing
+    """
+    def setUp(self):
+        self.dao = mongo.RequestsDao()
+        self.slow = patch.dict(mongo.SLOW_OPERATIONS, {'enabled': True, 'threshold': 0})
+        self.slow.start()
+        mongo._slow_recorded.clear()
+        mongo.slow_counters.reset()
+
+    def tearDown(self):
+        self.slow.stop()
+
+    def test_query_shape(self):
+        """ Queries differing only in values have the same shape
+        """
+        shape = mongo.query_shape({'search_tokens': {'$all': ['svr1007', 'payment']},
+                                   'requestDate': {'$gte': datetime.datetime(2013, 5, 17)}})
+        self.assertEqual(shape, '{requestDate: {$gte: 1}, search_tokens: {$all: [1]}}')
+        self.assertEqual(mongo.query_shape({'id': {'$in': [1, 2]}}), mongo.query_shape({'id': {'$in': [3]}}))
+
+    def test_explain_summary(self):
+        """ Plans of mongo 2.x and 3.x explains are summarized alike
+        """
+        summary = mongo.explain_summary({'cursor': 'BasicCursor', 'n': 1, 'nscanned': 1000,
+                                         'nscannedObjects': 1000, 'scanAndOrder': True})
+        self.assertEqual(summary, {'plan': 'BasicCursor', 'index': None, 'keys_examined': 1000,
+                                   'docs_examined': 1000, 'returned': 1, 'in_memory_sort': True})
+        summary = mongo.explain_summary({
+            'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN',
+                                                                              'indexName': 'id_1'}}},
+            'executionStats': {'totalKeysExamined': 1, 'totalDocsExamined': 1, 'nReturned': 1}})
+        self.assertEqual(summary['plan'], 'FETCH < IXSCAN')
+        self.assertEqual(summary['index'], 'id_1')
+        self.assertFalse(summary['in_memory_sort'])
+
+    def test_slow_read_recorded_once_per_interval(self):
+        """ Slow reads are counted, and explained once per query shape and interval
+        """
+        with patch.object(self.dao.dbcoll, 'find_one', return_value={'id': 1}):
+            with patch.object(mongo.gevent, 'spawn') as mock_spawn:
+                self.assertTrue(self.dao.exists(1))
+                self.assertTrue(self.dao.exists(2))
+        mock_spawn.assert_called_once_with(self.dao._record_slow, 'get', self.dao.dbcoll, {'id': 1}, '{id: 1}',
+                                           mock_spawn.call_args[0][5], None, 1)
+        self.assertEqual(mongo.slow_counters.get('get'), 2)
+
+    def test_fast_read_not_recorded(self):
+        """ Reads under the threshold are not recorded
+        """
+        with patch.dict(mongo.SLOW_OPERATIONS, {'threshold': 60}):
+            with patch.object(self.dao.dbcoll, 'find_one', return_value=None):
+                with patch.object(mongo.gevent, 'spawn') as mock_spawn:
+                    self.assertFalse(self.dao.exists(1))
+        self.assertFalse(mock_spawn.called)
+
+    def test_record_slow(self):
+        """ Slow operations are stored with their plan summary
+        """
+        cursor = create_autospec(Cursor)
+        cursor.sort.return_value = cursor
+        cursor.limit.return_value = cursor
+        cursor.explain.return_value = {'cursor': 'BasicCursor', 'n': 0, 'nscanned': 10, 'nscannedObjects': 10}
+        with patch.object(self.dao.dbcoll, 'find', return_value=cursor):
+            with patch.object(self.dao, 'dbconn') as mock_dbconn:
+                self.dao._record_slow('bulk', self.dao.dbcoll, {'app': 'MobileId'}, '{app: 1}', 1.5, [('id', 1)],
+                                      1000)
+        doc = mock_dbconn.__getitem__.return_value.insert.call_args[0][0]
+        self.assertEqual(doc['millis'], 1500)
+        self.assertEqual(doc['sort'], [['id', 1]])
+        self.assertEqual(doc['plan']['plan'], 'BasicCursor')
+        self.assertIsNone(doc['plan']['index'])
+        cursor.limit.assert_called_once_with(1000)
+
+
+class LatencySketchTest(unittest.TestCase):
+    """ Latency quantile sketch testing
+    """
+    def test_quantiles_within_accuracy(self):
+        """ Quantiles keep the relative error of the sketch
+        """
+        sketch = LatencySketch(0.01)
+        for value in range(1, 1001):
+            sketch.add(value)
+        for fraction, expected in ((0.5, 500), (0.9, 900), (0.99, 990)):
+            self.assertAlmostEqual(sketch.quantile(fraction), expected, delta=expected * 0.011)
+        self.assertIsNone(LatencySketch().quantile(0.5))
+
+    def test_merge(self):
+        """ Merged sketches answer like a sketch of every value
+        """
+        first, second, every = LatencySketch(), LatencySketch(), LatencySketch()
+        for value in range(1, 501):
+            first.add(value)
+            every.add(value)
+        for value in range(501, 1001):
+            second.add(value)
+            every.add(value)
+        first.merge(second)
+        self.assertEqual(first.bins, every.bins)
+        self.assertEqual(first.count, 1000)
+
+    def test_recorder_buckets(self):
+        """ Latencies are grouped by time bucket, api, app and origin
+        """
+        recorder = LatencyRecorder(bucket=300)
+        doc = {'requestDate': datetime.datetime(2013, 5, 17, 2, 10, 25, 335000),
+               'responseDate': datetime.datetime(2013, 5, 17, 2, 10, 25, 548000),
+               'api': 'payment', 'app': 'FrontendTrustedPartner', 'origin': 'FE'}
+        self.assertAlmostEqual(recorder.record(doc), 213, places=3)
+        self.assertIsNone(recorder.record({'requestDate': '2013-05-17'}))
+        sketches = recorder.drain()
+        self.assertEqual(sketches.keys(), [(datetime.datetime(2013, 5, 17, 2, 10), 'payment',
+                                            'FrontendTrustedPartner', 'FE')])
+        self.assertEqual(recorder.drain(), {})
+
+    def test_recorder_utc_buckets(self):
+        """ Dates with an offset are bucketed by their utc time
+        """
+        recorder = LatencyRecorder(bucket=300)
+        doc = {'requestDate': datetime.datetime(2013, 5, 17, 4, 10, 25, 335000, tzinfo=tzoffset(None, 7200)),
+               'responseDate': datetime.datetime(2013, 5, 17, 2, 10, 25, 548000),
+               'api': 'payment', 'app': 'FrontendTrustedPartner', 'origin': 'FE'}
+        self.assertAlmostEqual(recorder.record(doc), 213, places=3)
+        self.assertEqual(recorder.drain().keys(), [(datetime.datetime(2013, 5, 17, 2, 10), 'payment',
+                                                    'FrontendTrustedPartner', 'FE')])
+
+    def test_flush_and_read(self):
+        """ Sketches are stored with $inc and merged back on read
+        """
+        latency_dao = mongo.LatencyDao()
+        sketch = LatencySketch()
+        sketch.add(100)
+        bucket = datetime.datetime(2013, 5, 17, 2, 10)
+        with patch.object(latency_dao.dbcoll, 'update') as mock_update:
+            latency_dao.flush({(bucket, 'payment', 'FrontendBasic', 'FE'): sketch})
+        update = mock_update.call_args[0][1]
+        self.assertEqual(update['$inc']['zero'], 0)
+        stored = {'bins': dict((str(index), count) for index, count in sketch.bins.items()), 'zero': 0,
+                  'total': 100.0}
+        with patch.object(latency_dao.dbcoll, 'find', return_value=[stored, stored]) as mock_find:
+            merged = latency_dao.sketch(date_from='2013-05-17', api='payment')
+        self.assertEqual(mock_find.call_args[0][0], {'api': 'payment',
+                                                     'bucket': {'$gte': datetime.datetime(2013, 5, 17)}})
+        self.assertEqual(merged.count, 2)
+        self.assertAlmostEqual(merged.quantile(0.5), 100, delta=1)
+
+
+class HeavyHittersTest(unittest.TestCase):
+    """ Space saving summaries testing
+    """
+    def test_top_with_error_bounds(self):
+        """ Frequent values survive evictions and their real count is within the error
+        """
+        summary = SpaceSaving(capacity=10)
+        real = {}
+        for index in range(2000):
+            value = 'SVC{}'.format(index % 3) if index % 2 else 'rare{}'.format(index)
+            real[value] = real.get(value, 0) + 1
+            summary.add(value)
+        self.assertEqual(len(summary.counters), 10)
+        for value, count, error in summary.top(3):
+            self.assertTrue(value.startswith('SVC'))
+            self.assertTrue(count - error <= real[value] <= count)
+
+    def test_merge(self):
+        """ Values missing in a full summary get its min count as error
+        """
+        first, second = SpaceSaving(capacity=2), SpaceSaving(capacity=2)
+        for value in ('a', 'a', 'a', 'b'):
+            first.add(value)
+        for value in ('c', 'c', 'a'):
+            second.add(value)
+        merged = merge([(dict((value, tuple(counter)) for value, counter in summary.counters.items()),
+                         summary.min_count()) for summary in (first, second)], capacity=10)
+        self.assertEqual(merged.top(1), [('a', 4, 0)])
+        self.assertEqual(dict((value, (count, error)) for value, count, error in merged.top(3))['b'], (2, 1))
+
+    def test_recorder(self):
+        """ Fields are read from the log or its body_request, failure fields only for errors
+        """
+        recorder = HeavyHittersRecorder(('exceptionId', 'msisdn'), ('app',), capacity=5)
+        recorder.record({'exceptionId': 'SVC1000', 'body_request': {'msisdn': '34600000000'}, 'app': 'MobileId',
+                         'responseCode': '400'})
+        recorder.record({'app': 'MobileId', 'responseCode': '200'})
+        pending = recorder.pending(datetime.datetime(1970, 1, 1))
+        self.assertEqual(sorted(field for field, _ in pending), ['exceptionId', 'failed_app', 'msisdn'])
+        self.assertEqual([summary.top(1) for (field, _), summary in pending.items() if field == 'failed_app'],
+                         [[('MobileId', 1, 0)]])
+        self.assertEqual(recorder.pending(datetime.datetime.utcnow() + datetime.timedelta(days=1)), pending)
+        self.assertEqual(recorder.summaries, {})
+
+
+class SamplerTest(unittest.TestCase):
+    """ Status aware sampling testing
+    """
+    RULES = [{'api': 'payment', 'responseCode': ['2xx', '304'], 'rate': 0.1}, {'responseCode': '2xx', 'rate': 0}]
+
+    def test_first_matching_rule(self):
+        """ The first rule matching every field sets the rate, unmatched logs and exceptions are stored
+        """
+        sampler = Sampler(SamplerTest.RULES)
+        self.assertEqual(sampler.rate({'api': 'payment', 'responseCode': '201'}), 0.1)
+        self.assertEqual(sampler.rate({'api': 'payment', 'responseCode': '304'}), 0.1)
+        self.assertEqual(sampler.rate({'api': 'mobileid', 'responseCode': '200'}), 0)
+        self.assertEqual(sampler.rate({'api': 'mobileid', 'responseCode': '500'}), 1)
+        self.assertEqual(sampler.rate({'api': 'mobileid', 'responseCode': '200', 'exceptionId': 'SVC1000'}), 1)
+
+    def test_counts_before_sampling(self):
+        """ Every log is counted, kept ones carry their sample rate
+        """
+        sampler = Sampler(SamplerTest.RULES, bucket=300)
+        date = datetime.datetime(2013, 5, 17, 2, 10, 25)
+        docs = [{'api': 'payment', 'app': 'Microsoft', 'responseCode': '201', 'requestDate': date,
+                 'transactionId': str(index)} for index in range(1000)]
+        kept = [doc for doc in docs if sampler.keep(doc)]
+        self.assertTrue(50 < len(kept) < 150)
+        self.assertTrue(all(doc['sampleRate'] == 0.1 for doc in kept))
+        self.assertEqual(sum('sampleRate' in doc for doc in docs), len(kept))
+        key = (datetime.datetime(2013, 5, 17, 2, 10), 'payment', 'Microsoft', '201')
+        self.assertEqual(sampler.drain(), {key: [1000, len(kept)]})
+        self.assertEqual(sampler.counts, {})
+
+    def test_transaction_decision(self):
+        """ FE and BE logs of a transaction are kept or dropped together
+        """
+        sampler = Sampler([{'rate': 0.5}])
+        for index in range(100):
+            transaction_id = 'tx{}'.format(index)
+            self.assertEqual(sampler.keep({'origin': 'FE', 'transactionId': transaction_id}),
+                             sampler.keep({'origin': 'BE', 'transactionId': transaction_id}))
+
+    def test_flush(self):
+        """ Counts are added to the stored ones by bucket and fields
+        """
+        sampling_dao = mongo.SamplingDao()
+        bucket = datetime.datetime(2013, 5, 17, 2, 10)
+        with patch.object(sampling_dao.dbcoll, 'update') as mock_update:
+            sampling_dao.flush({(bucket, 'payment', 'Microsoft', '201'): [10, 1]})
+        mock_update.assert_called_once_with({'_id': u'2013-05-17T02:10:00|payment|Microsoft|201'},
+                                            {'$inc': {'received': 10, 'kept': 1},
+                                             '$set': {'bucket': bucket, 'api': 'payment', 'app': 'Microsoft',
+                                                      'responseCode': '201'}}, upsert=True, w=1)
+
+
+class TraceRecorderTest(unittest.TestCase):
+    """ Per transaction trace testing
+    """
+    def _doc(self, origin, second, response_code, app='MobileId'):
+        return {'transactionId': 't1', 'origin': origin, 'app': app, 'responseCode': response_code,
+                'requestDate': datetime.datetime(2013, 5, 17, 2, 10, second),
+                'responseDate': datetime.datetime(2013, 5, 17, 2, 10, second, 250000),
+                'http_request': {'method': 'POST'}, 'body_request': {'msisdn': '34600000000'}}
+
+    def test_record_hops(self):
+        """ FE and BE logs of a transaction become its hops, logs without transactionId are skipped
+        """
+        recorder = TraceRecorder()
+        recorder.record(self._doc('BE', 2, '400'), 2)
+        recorder.record(self._doc('FE', 1, '201'), 1)
+        recorder.record({'origin': 'FE'}, 3)
+        traces = recorder.drain()
+        self.assertEqual(traces.keys(), ['t1'])
+        self.assertEqual((traces['t1']['fe']['id'], traces['t1']['fe']['latency']), (1, 250))
+        self.assertEqual(traces['t1']['fe']['http_request'], {'method': 'POST'})
+        self.assertEqual(traces['t1']['be'][0]['body_request'], {'msisdn': '34600000000'})
+        self.assertNotIn('body_request', traces['t1']['fe'])
+        self.assertEqual(recorder.drain(), {})
+
+    def test_max_pending(self):
+        """ Logs of new transactions are not traced beyond max_pending, known ones still are
+        """
+        recorder = TraceRecorder(max_pending=1)
+        recorder.record(self._doc('FE', 1, '201'), 1)
+        recorder.record(dict(self._doc('FE', 1, '201'), transactionId='t2'), 2)
+        recorder.record(self._doc('BE', 2, '400'), 3)
+        self.assertEqual((recorder.traces.keys(), recorder.dropped), (['t1'], 1))
+        self.assertEqual(len(recorder.traces['t1']['be']), 1)
+
+    def test_summarize(self):
+        """ Traces span their hops, the final responseCode is the FE one or the last BE one
+        """
+        recorder = TraceRecorder()
+        for log_id, (origin, second, response_code) in enumerate([('BE', 3, '500'), ('BE', 2, '400')]):
+            recorder.record(self._doc(origin, second, response_code), log_id)
+        trace = summarize(recorder.drain()['t1'])
+        self.assertEqual(([step['id'] for step in trace['be']], trace['responseCode'], trace['duration']),
+                         ([1, 0], '500', 1250))
+        trace['fe'] = dict(trace['be'][0], responseCode='201')
+        self.assertEqual(summarize(trace)['responseCode'], '201')
+
+    def test_flush_upserts(self):
+        """ Each transaction is upserted once per flush, setting the FE hop and the BE hops by log id
+        """
+        recorder = TraceRecorder()
+        recorder.record(self._doc('BE', 2, '400'), 2)
+        recorder.record(self._doc('BE', 3, '500'), 3)
+        traces_dao = mongo.TracesDao()
+        with patch.object(traces_dao.dbcoll, 'update') as mock_update:
+            traces_dao.flush(recorder.drain())
+        self.assertEqual(mock_update.call_count, 1)
+        query, update = mock_update.call_args[0]
+        self.assertEqual(query, {'_id': 't1'})
+        self.assertNotIn('fe', update['$set'])
+        self.assertEqual((update['$set']['be.2']['id'], update['$set']['be.3']['id']), (2, 3))
+        self.assertTrue(mock_update.call_args[1]['upsert'])
+
+
+class ProfilerTest(unittest.TestCase):
+    """ Sampling profiler testing
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.profiler = Profiler(os.path.join(self.directory, 'profiles'), sample_rate=2, dump_interval=3600)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_disabled(self):
+        """ Disabled profiler only calls the function
+        """
+        self.assertEqual(self.profiler.profile('sum', sum, [1, 2]), 3)
+        self.assertEqual(self.profiler.stats, {})
+
+    def test_sample_and_dump(self):
+        """ One in sample_rate calls is aggregated and dumped when disabled
+        """
+        self.profiler.enable()
+        for _ in range(4):
+            self.assertEqual(self.profiler.profile('sum', sum, [1, 2]), 3)
+        self.assertEqual(self.profiler.stats['sum'].total_calls, 4)
+        paths = self.profiler.disable()
+        self.assertEqual(len(paths), 1)
+        self.assertTrue(os.path.basename(paths[0]).startswith('sum-'))
+        self.assertEqual(self.profiler.stats, {})
+
+    def test_one_sample_at_a_time(self):
+        """ Calls made while a sampled call runs are not sampled
+        """
+        self.profiler.enable(sample_rate=1)
+        nested = lambda: self.profiler.profile('inner', sum, [1, 2])
+        self.assertEqual(self.profiler.profile('outer', nested), 3)
+        self.assertEqual(sorted(self.profiler.stats), ['outer'])
+        self.assertFalse(self.profiler.active)
+        self.profiler.profile('inner', sum, [1, 2])
+        self.assertEqual(sorted(self.profiler.stats), ['inner', 'outer'])
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """ Rendered response cache testing
+    """
+    @patch('apilog.httpcache.time')
+    def test_ttl_version_max_age(self, mock_time):
+        """ Entries are served within ttl, then while their version holds, until max_age
+        """
+        mock_time.time.return_value = 1000
+        cache = ResponseCache(ttl=2, max_age=30)
+        cache.put('list', (5, 1), '{"result": []}', 'application/json')
+        self.assertIsNotNone(cache.fresh('list'))
+        self.assertIsNotNone(cache.get('list', (6, 1)))
+        mock_time.time.return_value = 1003
+        self.assertIsNone(cache.fresh('list'))
+        self.assertIsNone(cache.get('list', (6, 1)))
+        self.assertIsNone(cache.get('list'))
+        self.assertIsNotNone(cache.get('list', (5, 1)))
+        self.assertIsNotNone(cache.fresh('list'))
+        mock_time.time.return_value = 1030
+        self.assertIsNone(cache.get('list', (5, 1)))
+
+    @patch('apilog.httpcache.time')
+    def test_etag_and_last_modified(self, mock_time):
+        """ Identical bodies keep their ETag and last modified time
+        """
+        mock_time.time.return_value = 1000
+        cache = ResponseCache()
+        first = cache.put('list', 1, '{"result": []}', 'application/json')
+        mock_time.time.return_value = 1100
+        second = cache.put('list', 2, '{"result": []}', 'application/json')
+        self.assertEqual((second['etag'], second['modified']), (first['etag'], 1000))
+        third = cache.put('list', 3, '{"result": [1]}', 'application/json')
+        self.assertNotEqual(third['etag'], first['etag'])
+        self.assertEqual(third['modified'], 1100)
+
+    def test_max_entries(self):
+        """ The oldest rendered entry is evicted
+        """
+        cache = ResponseCache(max_entries=2)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, None, key, 'text/plain')
+        self.assertEqual(sorted(cache.entries), ['b', 'c'])
+
+    def test_not_modified(self):
+        """ If-None-Match is checked before If-Modified-Since
+        """
+        entry = ResponseCache().put('list', None, 'body', 'text/plain')
+        entry['modified'] = 784111777
+        self.assertTrue(not_modified(entry, entry['etag']))
+        self.assertTrue(not_modified(entry, '"other", ' + entry['etag']))
+        self.assertFalse(not_modified(entry, '"other"', 'Sun, 06 Nov 1994 08:49:37 GMT'))
+        self.assertTrue(not_modified(entry, None, 'Sun, 06 Nov 1994 08:49:37 GMT'))
+        self.assertFalse(not_modified(entry, None, 'Sun, 06 Nov 1994 08:49:36 GMT'))
+        self.assertFalse(not_modified(entry))
+
+
+class MetricsTest(unittest.TestCase):
+    """ Worker counters testing
+    """
+    def test_counters_snapshot(self):
+        """ Counters are grouped by component
+        """
+        counters = metrics.counters('test')
+        counters.reset()
+        counters.incr('hits')
+        counters.incr('hits', 2)
+        self.assertEqual(counters.get('hits'), 3)
+        self.assertEqual(metrics.snapshot()['test'], {'hits': 3})
+
+
+class FastIngestApplicationTest(unittest.TestCase):
+    """ WSGI ingest fast path testing
+    """
+    LOG_PATH = '/partnerprovisioning/v1/log/'
+
+    def setUp(self):
+        self.fallback = Mock(return_value=['fallback'])
+        self.dao = create_autospec(mongo.RequestsDao)
+        self.dao.insert.return_value = 7
+        self.application = FastIngestApplication(self.fallback, dao=self.dao)
+        self.start_response = Mock()
+
+    def _environ(self, method, path, body='', content_type='application/json'):
+        return {'REQUEST_METHOD': method, 'PATH_INFO': path, 'CONTENT_TYPE': content_type,
+                'CONTENT_LENGTH': str(len(body)), 'wsgi.input': StringIO(body)}
+
+    def test_other_requests_fall_through(self):
+        """ GET requests and other paths are served by django
+        """
+        environ = self._environ('GET', FastIngestApplicationTest.LOG_PATH)
+        self.assertEqual(self.application(environ, self.start_response), ['fallback'])
+        environ = self._environ('POST', '/partnerprovisioning/v1/log/1/')
+        self.assertEqual(self.application(environ, self.start_response), ['fallback'])
+        self.assertEqual(self.fallback.call_count, 2)
+        self.assertFalse(self.dao.insert.called)
+
+    def test_post_json(self):
+        """ JSON dict posts are inserted directly
+        """
+        environ = self._environ('POST', FastIngestApplicationTest.LOG_PATH, json.dumps({"data": "datas"}))
+        ret = self.application(environ, self.start_response)
+        self.dao.insert.assert_called_once_with({u'data': u'datas'})
+        self.assertEqual(json.loads(''.join(ret)), {'result': 7})
+        self.assertEqual(self.start_response.call_args[0][0], '201 CREATED')
+
+    def test_post_invalid_text(self):
+        """ Invalid plain text logs are rejected as in the rest api
+        """
+        environ = self._environ('POST', FastIngestApplicationTest.LOG_PATH, 'afadfadfadfa', 'text/plain')
+        ret = self.application(environ, self.start_response)
+        self.assertEqual(json.loads(''.join(ret)), 'Invalid data log')
+        self.assertEqual(self.start_response.call_args[0][0], '400 BAD REQUEST')
+
+    def test_post_empty(self):
+        """ Empty posts are rejected
+        """
+        environ = self._environ('POST', FastIngestApplicationTest.LOG_PATH, '', 'text/plain')
+        ret = self.application(environ, self.start_response)
+        self.assertEqual(json.loads(''.join(ret)), 'Received data is empty')
+        self.assertFalse(self.dao.insert.called)
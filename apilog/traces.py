@@ -0,0 +1,81 @@
+""" Per transaction traces joining the FE log and the BE logs of a transactionId
+
+Each worker merges the stored logs of a transaction between flushes, then upserts one trace document per transaction
+keyed by transactionId: the FE hop is set, BE hops are set by log id. A hop keeps the log id, app, dates, latency and
+responseCode, plus the FE http_request or the BE body_request.
+"""
+import datetime
+
+HOP_FIELDS = ('app', 'requestDate', 'responseDate', 'responseCode')
+
+
+def hop(doc, log_id):
+    """ Trace hop of a stored log
+    :return dict with the log id, HOP_FIELDS, latency in milliseconds and the request of its origin
+    """
+    step = dict((field, doc.get(field)) for field in HOP_FIELDS)
+    step['id'] = log_id
+    request_date, response_date = doc.get('requestDate'), doc.get('responseDate')
+    if isinstance(request_date, datetime.datetime) and isinstance(response_date, datetime.datetime):
+        step['latency'] = int((response_date - request_date).total_seconds() * 1000)
+    if doc.get('origin') == 'FE':
+        step['http_request'] = doc.get('http_request')
+    else:
+        step['body_request'] = doc.get('body_request')
+    return step
+
+
+def summarize(trace):
+    """ Add the start, end, duration in milliseconds and final responseCode of a stored trace
+    The final responseCode is the FE one, or the one of the last BE hop before the FE log arrives
+    """
+    trace['be'] = sorted(trace.get('be', []), key=lambda step: step.get('requestDate'))
+    hops = ([trace['fe']] if trace.get('fe') else []) + trace.get('be', [])
+    starts = [step['requestDate'] for step in hops if isinstance(step.get('requestDate'), datetime.datetime)]
+    ends = [step['responseDate'] for step in hops if isinstance(step.get('responseDate'), datetime.datetime)]
+    trace['start'] = min(starts) if starts else None
+    trace['end'] = max(ends) if ends else None
+    trace['duration'] = int((trace['end'] - trace['start']).total_seconds() * 1000) if starts and ends else None
+    if trace.get('fe'):
+        trace['responseCode'] = trace['fe'].get('responseCode')
+    elif trace.get('be'):
+        trace['responseCode'] = trace['be'][-1].get('responseCode')
+    else:
+        trace['responseCode'] = None
+    return trace
+
+
+class TraceRecorder(object):
+    """ Hops of stored logs by transactionId, waiting to be flushed
+    """
+    def __init__(self, max_pending=100000):
+        """
+        :max_pending: transactions kept between flushes, logs of new ones are not traced beyond it
+        """
+        self.max_pending = max_pending
+        self.traces = {}
+        self.dropped = 0
+
+    def record(self, doc, log_id):
+        """ Add the hop of a stored log to the trace of its transactionId
+        """
+        transaction_id = doc.get('transactionId')
+        if not transaction_id:
+            return
+        trace = self.traces.get(transaction_id)
+        if trace is None:
+            if len(self.traces) >= self.max_pending:
+                self.dropped += 1
+                return
+            trace = self.traces[transaction_id] = {'fe': None, 'be': []}
+        if doc.get('origin') == 'FE':
+            trace['fe'] = hop(doc, log_id)
+        else:
+            trace['be'].append(hop(doc, log_id))
+
+    def drain(self):
+        """ Take every pending trace
+        :return dict of {'fe': hop or None, 'be': list of hops} by transactionId
+        """
+        traces, self.traces = self.traces, {}
+        return traces
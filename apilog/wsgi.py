@@ -26,3 +26,14 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "apilog.settings")
 # setting points here.
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
+
+# Optional fast path serving log ingestion outside django, see apilog.fastpath
+from django.conf import settings
+if settings.FAST_INGEST['enabled']:
+    from .fastpath import FastIngestApplication
+    application = FastIngestApplication(application, path=settings.FAST_INGEST['path'])
+
+# Toggle sampled profiling of a worker with kill -USR2 <worker pid>, see apilog.profiling
+if settings.PROFILING['signal']:
+    from .profiling import install_signal
+    install_signal(settings.PROFILING['signal'])
@@ -0,0 +1,99 @@
+""" Bytes per document and index sizes of the full versus the compact storage schema
+
+Generates FE and BE logs through BVParser, encodes them with every raw body mode of apilog.compact and reports BSON
+bytes per document. With --mongo both schemas are also written to scratch collections of the configured database to
+report collection and index sizes from collStats.
+
+Usage: python benchmarks/compact_report.py [-n 20000] [--mongo]
+"""
+import os
+import sys
+import uuid
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET", "benchmark")
+
+from bson import BSON
+from api.logparser import BVParser
+from apilog.compact import Codec, MemoryDictionary
+from apilog.search import doc_tokens
+
+FE_LINE = '2013/05/17T02:10:25.335 2013/05/17T02:10:25.548 {domain} {transaction} FE {app} 9/{app_id} {ob} ' \
+          'INFOSTATS {code} ["POST /{api}/v2/payments HTTP/1.0"]'
+BE_LINE = '2013/10/11T11:48:50.860 2013/10/11T11:48:50.898 {domain} {transaction} BE MobileId / {ob} INFOSTATS ' \
+          '{code} [{{"MobileId":{{"info":{{"userAgent":"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_8_4) ' \
+          'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/30.0.1599.69 Safari/537.36","xff":"10.70.15.127, ' \
+          '46.233.72.114","contentType":null,"partnerName":"microsoft"}}}}}}]'
+
+
+def generate(count):
+    """ Parsed logs with realistic cardinalities
+    """
+    parser = BVParser()
+    for log_id in xrange(1, count + 1):
+        values = {'domain': random.choice(('M2M', 'Microsoft', 'Bluevia')), 'transaction': uuid.uuid4(),
+                  'app': random.choice(('FrontendTrustedPartner', 'FrontendBasic')),
+                  'app_id': random.randint(10000, 99999), 'ob': random.choice((21407, 21405, 21401)),
+                  'code': random.choice((200, 200, 200, 201, 400, 500)), 'api': random.choice(('payment', 'sms'))}
+        line = FE_LINE if random.random() < 0.5 else BE_LINE
+        doc = parser.parse_log(line.format(**values))
+        doc['id'] = log_id
+        doc['search_tokens'] = doc_tokens(doc)
+        yield doc
+
+
+def bson_size(doc):
+    return len(BSON.encode(doc))
+
+
+def mongo_report(docs, codec):
+    """ Collection and index sizes of both schemas in scratch collections
+    """
+    from apilog.mongo import Connection
+    dbconn = Connection().get_connection()
+    rows = []
+    for name, encode in (('full', lambda doc: doc), ('compact', codec.encode)):
+        coll = dbconn['compact_report_' + name]
+        coll.drop()
+        for start in xrange(0, len(docs), 1000):
+            coll.insert([encode(dict(doc)) for doc in docs[start:start + 1000]], w=1)
+        key = (lambda field: field) if name == 'full' else codec.key
+        coll.ensure_index([('id', 1)], unique=True)
+        coll.ensure_index([(key('search_tokens'), 1), (key('requestDate'), -1)])
+        coll.ensure_index([(key('transactionId'), 1), (key('origin'), 1)])
+        stats = dbconn.command('collstats', coll.name)
+        rows.append((name, stats['size'], stats['avgObjSize'], stats['storageSize'], stats['totalIndexSize']))
+        coll.drop()
+    print
+    print "{0:<10} {1:>12} {2:>12} {3:>14} {4:>16}".format('schema', 'size', 'avgObjSize', 'storageSize',
+                                                           'totalIndexSize')
+    for row in rows:
+        print "{0:<10} {1:>12} {2:>12.0f} {3:>14} {4:>16}".format(*row)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('-n', '--documents', type=int, default=20000)
+    arg_parser.add_argument('--mongo', action='store_true', help='report collStats from the configured mongo')
+    args = arg_parser.parse_args()
+
+    docs = list(generate(args.documents))
+    full = sum(bson_size(doc) for doc in docs)
+    print "{0:<24} {1:>14} {2:>10}".format('schema', 'bytes/doc', 'ratio')
+    print "{0:<24} {1:>14.1f} {2:>10.2f}".format('full', float(full) / len(docs), 1.0)
+    for raw_body in ('keep', 'compress', 'drop'):
+        codec = Codec(MemoryDictionary(), raw_body=raw_body)
+        compact = sum(bson_size(codec.encode(dict(doc))) for doc in docs)
+        print "{0:<24} {1:>14.1f} {2:>10.2f}".format('compact, body ' + raw_body, float(compact) / len(docs),
+                                                     float(compact) / full)
+    if args.mongo:
+        mongo_report(docs, Codec(MemoryDictionary()))
+    else:
+        print
+        print "Collection and index sizes skipped, run with --mongo to write both schemas to the configured mongo"
+
+
+if __name__ == '__main__':
+    main()
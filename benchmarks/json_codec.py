@@ -0,0 +1,72 @@
+""" Encode and decode cost of every installed JSON backend on the readme sample payloads
+
+Usage: python benchmarks/json_codec.py [-n 20000]
+"""
+import os
+import sys
+import time
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "apilog.settings")
+os.environ.setdefault("SECRET", "benchmark")
+
+from rest_framework.utils.encoders import JSONEncoder
+from apilog import jsoncodec
+
+# Body of the readme plain text BE log, decoded inside BVParser.parse_log
+BE_BODY = '[{"MobileId":{"info":{"userAgent":"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_8_4) AppleWebKit/537.36 ' \
+          '(KHTML, like Gecko) Chrome/30.0.1599.69 Safari/537.36","xff":"10.70.15.127, 46.233.72.114",' \
+          '"contentType":null}}}]'
+# Readme JSON log, decoded by the rest framework parser
+JSON_LOG = '{"origin": "BE", "body": [{"MobileId": {"info": {"userAgent": "Apache-HttpClient/4.1.1 (java 1.5)", ' \
+           '"contentType": "application/json", "xff": null}}}], "http_request": {}, "responseDate": ' \
+           '"2013-07-30T14:10:09.154Z", "api": "mobileid", "app": "MobileId", "domain": null, "serviceId": "", ' \
+           '"requestDate": "2013-07-30T14:10:08.617Z", "body_request":{"msisdn": ""}, "responseCode": "400", ' \
+           '"appId": "", "transactionId": "2bf76d13-883a-419e-bfb3-f9a05e83928e", "id": 81,"statType": "INFOSTATS"}'
+
+
+def _stored_log():
+    """ Readme JSON log as returned by mongo, with datetimes
+    """
+    doc = jsoncodec.get_codec('json').loads(JSON_LOG)
+    doc['requestDate'] = datetime.datetime(2013, 7, 30, 14, 10, 8, 617000)
+    doc['responseDate'] = datetime.datetime(2013, 7, 30, 14, 10, 9, 154000)
+    return doc
+
+
+def _timeit(function, argument, iterations):
+    start = time.time()
+    for _ in xrange(iterations):
+        function(argument)
+    return (time.time() - start) / iterations * 1e6
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('-n', '--iterations', type=int, default=20000)
+    args = arg_parser.parse_args()
+
+    default = JSONEncoder().default
+    # Logger.get response: 50 stored logs
+    response = {'result': [_stored_log() for _ in range(50)]}
+    created = {'result': 81}
+
+    print "Default backend: {}".format(jsoncodec.codec.name)
+    print "{0:<12} {1:>14} {2:>14} {3:>16} {4:>16}".format('backend', 'BE body dec us', 'JSON log dec us',
+                                                           'created enc us', 'list(50) enc us')
+    for name in ('json', 'simplejson', 'ujson'):
+        try:
+            codec = jsoncodec.get_codec(name)
+        except ImportError:
+            print "{0:<12} not installed".format(name)
+            continue
+        encode = lambda obj: codec.dumps(obj, default=default)
+        print "{0:<12} {1:>14.2f} {2:>14.2f} {3:>16.2f} {4:>16.2f}".format(
+            name, _timeit(codec.loads, BE_BODY, args.iterations), _timeit(codec.loads, JSON_LOG, args.iterations),
+            _timeit(encode, created, args.iterations), _timeit(encode, response, args.iterations / 50 or 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+""" Per document cost of JSONNormalizer on the readme JSON log, next to BVParser.parse_log of a log line
+
+Usage: python benchmarks/json_normalize.py [-n 50000]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET", "benchmark")
+
+from api.logparser import BVParser, JSONNormalizer
+
+JSON_LOG = {"origin": "BE", "body": [{"MobileId": {"info": {"userAgent": "Apache-HttpClient/4.1.1 (java 1.5)",
+                                                           "contentType": "application/json", "xff": None}}}],
+            "http_request": {}, "responseDate": "2013-07-30T14:10:09.154Z", "app": "MobileId", "domain": None,
+            "serviceId": "", "requestDate": "2013-07-30T14:10:08.617Z", "responseCode": "400", "appId": "",
+            "transactionId": "2bf76d13-883a-419e-bfb3-f9a05e83928e", "statType": "INFOSTATS"}
+BE_LINE = '2013/10/11T11:48:50.860 2013/10/11T11:48:50.898 M2M 5f4e6060-58d5-443c-bafd-3f09ba532f28 BE MobileId / ' \
+          '21407 INFOSTATS 400 [{"MobileId":{"info":{"userAgent":"Apache-HttpClient/4.1.1 (java 1.5)",' \
+          '"contentType":"application/json","xff":null}}}]'
+
+
+def _timeit(function, iterations):
+    start = time.time()
+    for _ in xrange(iterations):
+        function()
+    return (time.time() - start) / iterations * 1e6
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('-n', '--iterations', type=int, default=50000)
+    args = arg_parser.parse_args()
+
+    normalizer = JSONNormalizer()
+    parser = BVParser()
+    copy = _timeit(lambda: dict(JSON_LOG), args.iterations)
+    normalize = _timeit(lambda: normalizer.normalize(dict(JSON_LOG)), args.iterations) - copy
+    parse = _timeit(lambda: parser.parse_log(BE_LINE), args.iterations)
+    print "{0:<28} {1:>12}".format('operation', 'us/doc')
+    print "{0:<28} {1:>12.2f}".format('JSONNormalizer.normalize', normalize)
+    print "{0:<28} {1:>12.2f}".format('BVParser.parse_log', parse)
+
+
+if __name__ == '__main__':
+    main()
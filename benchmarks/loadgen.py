@@ -0,0 +1,208 @@
+""" Concurrent load generator for POST /partnerprovisioning/v1/log/
+
+Replays the sample FE/BE log lines and JSON logs over keep-alive connections, either from a fixed number of
+concurrent clients or at a target request rate, and reports throughput, latency percentiles, a latency histogram and
+errors by status code.
+
+Usage:
+    python benchmarks/loadgen.py http://localhost:8000 -c 50 -d 30
+    python benchmarks/loadgen.py https://localhost -r 2000 -d 60 --payload json --batch 20
+"""
+from gevent import monkey
+monkey.patch_all()
+import gevent
+import gevent.pool
+import gevent.queue
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import httplib
+import argparse
+import urlparse
+from array import array
+from collections import Counter
+
+LOG_PATH = '/partnerprovisioning/v1/log/'
+
+FE_LINE = '2013/05/17T02:10:25.335 2013/05/17T02:10:25.548 Microsoft {transaction} FE FrontendTrustedPartner ' \
+          '9/18297 21407 INFOSTATS 201 ["POST /payment/v2/payments HTTP/1.0"]'
+BE_LINE = '2013/10/11T11:48:50.860 2013/10/11T11:48:50.898 M2M {transaction} BE MobileId / 21407 INFOSTATS 400 ' \
+          '[{{"MobileId":{{"info":{{"userAgent":"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_8_4) AppleWebKit/537.36 ' \
+          '(KHTML, like Gecko) Chrome/30.0.1599.69 Safari/537.36","xff":"10.70.15.127, 46.233.72.114",' \
+          '"contentType":null}}}}}}]'
+JSON_LOG = {"origin": "BE", "body": [{"MobileId": {"info": {"userAgent": "Apache-HttpClient/4.1.1 (java 1.5)",
+                                                           "contentType": "application/json", "xff": None}}}],
+            "http_request": {}, "responseDate": "2013-07-30T14:10:09.154Z", "api": "mobileid", "app": "MobileId",
+            "domain": None, "serviceId": "", "requestDate": "2013-07-30T14:10:08.617Z",
+            "body_request": {"msisdn": ""}, "responseCode": "400", "appId": "", "statType": "INFOSTATS"}
+
+
+def _log(kind):
+    """ One sample log with a new transactionId
+    :kind: fe, be or json
+    """
+    transaction = str(uuid.uuid4())
+    if kind == 'json':
+        log = dict(JSON_LOG)
+        log['transactionId'] = transaction
+        return log
+    return (FE_LINE if kind == 'fe' else BE_LINE).format(transaction=transaction)
+
+
+def build_request(payload, batch):
+    """ Body and content type of one request
+    :payload: fe, be, json or mixed
+    :batch: logs per request, 1 sends a single log
+    """
+    kinds = [random.choice(('fe', 'be', 'json')) if payload == 'mixed' else payload for _ in range(batch)]
+    if batch == 1 and kinds[0] != 'json':
+        return _log(kinds[0]), 'text/plain'
+    if batch == 1:
+        return json.dumps(_log('json')), 'application/json'
+    return json.dumps([_log(kind) for kind in kinds]), 'application/json'
+
+
+class Stats(object):
+    """ Latencies and outcomes of every request
+    """
+    def __init__(self):
+        self.latencies = array('d')
+        self.statuses = Counter()
+        self.errors = Counter()
+        # open loop sends not made because every connection was busy
+        self.dropped = 0
+
+    def record(self, latency, status=None, error=None):
+        self.latencies.append(latency)
+        if error is not None:
+            self.errors[error] += 1
+        else:
+            self.statuses[status] += 1
+
+    def percentile(self, ordered, fraction):
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+    def report(self, elapsed, logs_per_request, out=sys.stdout):
+        ordered = sorted(self.latencies)
+        total = len(ordered)
+        out.write("requests: {0}  logs: {1}  elapsed: {2:.2f}s\n".format(total, total * logs_per_request, elapsed))
+        out.write("throughput: {0:.1f} req/s  {1:.1f} logs/s\n".format(total / elapsed,
+                                                                     total * logs_per_request / elapsed))
+        out.write("latency ms: p50 {0:.2f}  p95 {1:.2f}  p99 {2:.2f}  max {3:.2f}\n".format(
+            *[self.percentile(ordered, fraction) * 1000 for fraction in (0.5, 0.95, 0.99, 1.0)]))
+        out.write("status codes: {}\n".format(', '.join('{0}: {1}'.format(status, count)
+                                                        for status, count in sorted(self.statuses.items()))))
+        if self.errors:
+            out.write("connection errors: {}\n".format(', '.join('{0}: {1}'.format(error, count)
+                                                                 for error, count in self.errors.most_common())))
+        if self.dropped:
+            out.write("dropped: {0} scheduled requests without a free connection ({1:.1f}%)\n".format(
+                self.dropped, 100.0 * self.dropped / (total + self.dropped)))
+        out.write("latency histogram:\n")
+        buckets = Counter(int(math.floor(math.log(max(latency * 1000, 0.5), 2))) for latency in ordered)
+        for bucket in sorted(buckets):
+            low = 0 if bucket < 0 else 2 ** bucket
+            bar = '#' * int(math.ceil(50.0 * buckets[bucket] / total))
+            out.write("  {0:>7} - {1:<7} ms {2:>9} {3}\n".format(low, 2 ** (bucket + 1), buckets[bucket], bar))
+
+
+class Client(object):
+    """ Keep-alive connection posting logs
+    """
+    def __init__(self, url, timeout):
+        parts = urlparse.urlparse(url)
+        connection_class = httplib.HTTPSConnection if parts.scheme == 'https' else httplib.HTTPConnection
+        self.connect = lambda: connection_class(parts.hostname, parts.port, timeout=timeout)
+        self.path = (parts.path.rstrip('/') or '') + LOG_PATH
+        self.connection = self.connect()
+
+    def post(self, body, content_type, stats, start=None):
+        """
+        :start: time latency is measured from, the scheduled start in open loop runs
+        """
+        start = time.time() if start is None else start
+        try:
+            self.connection.request('POST', self.path, body, {'Content-Type': content_type})
+            response = self.connection.getresponse()
+            response.read()
+            stats.record(time.time() - start, status=response.status)
+            if response.getheader('connection', '').lower() == 'close':
+                self.connection.close()
+                self.connection = self.connect()
+        except Exception as e:
+            stats.record(time.time() - start, error=e.__class__.__name__)
+            self.connection.close()
+            self.connection = self.connect()
+
+
+def run_concurrency(args, stats):
+    """ Closed loop: every client posts again as soon as it gets an answer
+    """
+    deadline = time.time() + args.duration
+
+    def worker():
+        client = Client(args.url, args.timeout)
+        while time.time() < deadline:
+            body, content_type = build_request(args.payload, args.batch)
+            client.post(body, content_type, stats)
+
+    gevent.joinall([gevent.spawn(worker) for _ in range(args.concurrency)])
+
+
+def run_rate(args, stats):
+    """ Open loop: requests are scheduled at the target rate whatever the latency. Latency counts from the scheduled
+    start, and a request scheduled while every one of the concurrency connections is busy is dropped, not delayed
+    """
+    clients = gevent.queue.Queue()
+    for _ in range(args.concurrency):
+        clients.put(Client(args.url, args.timeout))
+    greenlets = gevent.pool.Group()
+
+    def send(client, scheduled):
+        try:
+            body, content_type = build_request(args.payload, args.batch)
+            client.post(body, content_type, stats, start=scheduled)
+        finally:
+            clients.put(client)
+
+    start = time.time()
+    scheduled = 0
+    while time.time() - start < args.duration:
+        try:
+            client = clients.get_nowait()
+        except gevent.queue.Empty:
+            stats.dropped += 1
+        else:
+            greenlets.spawn(send, client, start + float(scheduled) / args.rate)
+        scheduled += 1
+        gevent.sleep(max(0, start + float(scheduled) / args.rate - time.time()))
+    greenlets.join()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('url', help='service root, e.g. http://localhost:8000')
+    arg_parser.add_argument('-c', '--concurrency', type=int, default=50, help='concurrent keep-alive connections')
+    arg_parser.add_argument('-r', '--rate', type=float, help='target requests per second (open loop)')
+    arg_parser.add_argument('-d', '--duration', type=float, default=30, help='seconds to run')
+    arg_parser.add_argument('-p', '--payload', choices=('fe', 'be', 'json', 'mixed'), default='mixed')
+    arg_parser.add_argument('-b', '--batch', type=int, default=1, help='logs per request, sent as a JSON list')
+    arg_parser.add_argument('-t', '--timeout', type=float, default=10, help='request timeout in seconds')
+    args = arg_parser.parse_args()
+
+    stats = Stats()
+    start = time.time()
+    if args.rate:
+        run_rate(args, stats)
+    else:
+        run_concurrency(args, stats)
+    stats.report(time.time() - start, args.batch)
+
+
+if __name__ == '__main__':
+    main()
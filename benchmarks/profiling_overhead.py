@@ -0,0 +1,74 @@
+""" Cost of the profiling hooks around BVParser.parse_log, disabled and sampling
+
+Each variant runs once to warm up, then --repeat times, and the median run is reported.
+
+Usage: python benchmarks/profiling_overhead.py [-n 50000] [-s 100] [-r 5]
+"""
+import os
+import sys
+import time
+import shutil
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET", "benchmark")
+
+from api.logparser import BVParser
+from apilog.profiling import Profiler
+
+FE_LINE = '2013/05/17T02:10:25.335 2013/05/17T02:10:25.548 Microsoft 1e246bb8-1162-46a2-93af-1da64ca9e3cb FE ' \
+          'FrontendTrustedPartner 9/18297 21407 INFOSTATS 201 ["POST /payment/v2/payments HTTP/1.0"]'
+
+
+def _timeit(function, iterations):
+    start = time.time()
+    for _ in xrange(iterations):
+        function()
+    return (time.time() - start) / iterations * 1e6
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('-n', '--iterations', type=int, default=50000)
+    arg_parser.add_argument('-s', '--sample-rate', type=int, default=100)
+    arg_parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    parse_log = BVParser().parse_log
+    directory = tempfile.mkdtemp()
+    profiler = Profiler(directory, sample_rate=args.sample_rate, dump_interval=3600)
+
+    profiled = lambda: profiler.profile('parse', parse_log, FE_LINE)
+    # name, function and whether profiling is enabled
+    variants = (('direct', lambda: parse_log(FE_LINE), False), ('profiling disabled', profiled, False),
+                ('sampling 1/{}'.format(args.sample_rate), profiled, True))
+    runs = dict((name, []) for name, _, _ in variants)
+    try:
+        # run 0 warms up, then variants are interleaved in a new order every run so drift does not favour one
+        for run in range(args.repeat + 1):
+            for name, function, enabled in random.sample(variants, len(variants)):
+                profiler.enabled = enabled
+                cost = _timeit(function, args.iterations)
+                profiler.enabled = False
+                if run:
+                    runs[name].append(cost)
+        profiler.disable()
+    finally:
+        shutil.rmtree(directory)
+    direct = _median(runs['direct'])
+    print "{0:<28} {1:>12} {2:>10}".format('parse_log', 'us/call', 'overhead')
+    for name, _, _ in variants:
+        cost = _median(runs[name])
+        print "{0:<28} {1:>12.2f} {2:>9.1f}%".format(name, cost, (cost / direct - 1) * 100)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+""" Per log cost of RequestsDao batch inserts, reads by id, searches and bulk deletes on a fresh database
+
+Usage: python benchmarks/requests_dao.py [-n 5000] [-b 100] [--backend mongomock] [--host localhost:27017]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET", "benchmark")
+
+from api.logparser import BVParser
+from apilog.mongo import RequestsDao, get_client
+
+DATABASE = 'apilog_benchmark'
+FE_LINE = '2013/05/17T02:10:25.335 2013/05/17T02:10:25.548 Microsoft {0} FE FrontendTrustedPartner 9/18297 ' \
+          '21407 INFOSTATS 201 ["POST /payment/v2/payments HTTP/1.0"]'
+
+
+def _timeit(function, iterations):
+    start = time.time()
+    function()
+    return (time.time() - start) / iterations * 1e6
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('-n', '--logs', type=int, default=5000)
+    arg_parser.add_argument('-b', '--batch', type=int, default=100)
+    arg_parser.add_argument('--backend', default='mongomock', choices=('mongomock', 'pymongo'))
+    arg_parser.add_argument('--host', default='localhost:27017')
+    args = arg_parser.parse_args()
+
+    parser = BVParser()
+    docs = [parser.parse_log(FE_LINE.format('{0:08d}-58d5-443c-bafd-3f09ba532f28'.format(i))) for i in xrange(args.logs)]
+    client = get_client(args.backend, args.host)
+    client.drop_database(DATABASE)
+    dao = RequestsDao(dbconn=client[DATABASE])
+    ids = []
+
+    def insert():
+        for i in xrange(0, len(docs), args.batch):
+            ids.extend(dao.insert_batch(docs[i:i + args.batch]))
+
+    def select():
+        for log_id in ids:
+            dao.select(log_id)
+
+    searches = max(args.logs / 100, 1)
+
+    def search():
+        for _ in xrange(searches):
+            list(dao.search('payments'))
+
+    try:
+        results = [('insert_batch x{}'.format(args.batch), _timeit(insert, args.logs)),
+                   ('select by id', _timeit(select, args.logs)),
+                   ('search', _timeit(search, searches)),
+                   ('bulk_delete', _timeit(lambda: dao.bulk_delete({'app': 'FrontendTrustedPartner'}, throttle=0),
+                                           args.logs))]
+    finally:
+        client.drop_database(DATABASE)
+    print "{0:<28} {1:>12}".format('operation ({})'.format(args.backend), 'us/op')
+    for name, cost in results:
+        print "{0:<28} {1:>12.2f}".format(name, cost)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+""" Requests per second of POST /log/ through the full django stack versus apilog.fastpath
+
+Both applications are called in-process with the same WSGI environ, so numbers are per worker and exclude the
+network and gunicorn. Mongo writes are stubbed unless --mongo is given, leaving only framework and parsing cost.
+Both paths are CSRF exempt, so the cookie-less POSTs are accepted by each.
+
+Usage: python benchmarks/wsgi_fastpath.py [-n 5000] [--mongo]
+"""
+import os
+import sys
+import time
+import json
+import argparse
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "apilog.settings")
+os.environ.setdefault("SECRET", "benchmark")
+
+TEXT_LOG = '2013/10/11T11:48:50.860 2013/10/11T11:48:50.898 M2M 5f4e6060-58d5-443c-bafd-3f09ba532f28 BE ' \
+           'MobileId / 21407 INFOSTATS 400 [{"MobileId":{"info":{"userAgent":"Mozilla/5.0 (Macintosh; Intel Mac ' \
+           'OS X 10_8_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/30.0.1599.69 Safari/537.36","xff":' \
+           '"10.70.15.127, 46.233.72.114","contentType":null}}}]'
+JSON_LOG = json.dumps({
+    "origin": "BE", "body": [{"MobileId": {"info": {"userAgent": "Apache-HttpClient/4.1.1 (java 1.5)",
+                                                    "contentType": "application/json", "xff": None}}}],
+    "http_request": {}, "responseDate": "2013-07-30T14:10:09.154Z", "api": "mobileid", "app": "MobileId",
+    "domain": None, "serviceId": "", "requestDate": "2013-07-30T14:10:08.617Z", "body_request": {"msisdn": ""},
+    "responseCode": "400", "appId": "", "transactionId": "2bf76d13-883a-419e-bfb3-f9a05e83928e",
+    "statType": "INFOSTATS"})
+
+
+def _environ(body, content_type):
+    return {
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': '/partnerprovisioning/v1/log/',
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '8000',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_TYPE': content_type,
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': StringIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+
+def _run(application, body, content_type, requests):
+    statuses = []
+
+    def start_response(status, headers):
+        statuses.append(status)
+
+    start = time.time()
+    for _ in xrange(requests):
+        ''.join(application(_environ(body, content_type), start_response))
+    elapsed = time.time() - start
+    assert all(status.startswith('201') for status in statuses), set(statuses)
+    return requests / elapsed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('-n', '--requests', type=int, default=5000)
+    arg_parser.add_argument('--mongo', action='store_true', help='write to the configured mongo instead of a stub')
+    args = arg_parser.parse_args()
+    if not args.mongo:
+        # the DAOs connect on import, no mongo server is needed for the stubbed runs
+        os.environ.setdefault("MONGODB_BACKEND", "mongomock")
+
+    from django.core.wsgi import get_wsgi_application
+    from apilog.fastpath import FastIngestApplication
+    from apilog.mongo import RequestsDao
+
+    django_application = get_wsgi_application()
+    fast_application = FastIngestApplication(django_application)
+    if not args.mongo:
+        RequestsDao.insert = lambda self, doc, operation_ack=1: 1
+
+    print "{0:<8} {1:>14} {2:>14} {3:>8}".format('payload', 'django req/s', 'fastpath req/s', 'speedup')
+    for name, body, content_type in (('text', TEXT_LOG, 'text/plain'), ('json', JSON_LOG, 'application/json')):
+        full = _run(django_application, body, content_type, args.requests)
+        fast = _run(fast_application, body, content_type, args.requests)
+        print "{0:<8} {1:>14.0f} {2:>14.0f} {3:>7.2f}x".format(name, full, fast, fast / full)
+
+
+if __name__ == '__main__':
+    main()